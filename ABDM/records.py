@@ -0,0 +1,167 @@
+"""Dummy ABDM health records, shared by the mock service and the benchmark dataset generator."""
+from datetime import datetime, timedelta
+import random
+
+def generate_dummy_health_record(identifier, rng=None):
+    # Generate consistent dummy data based on the identifier. A private RNG per
+    # call: re-seeding the global one raced between concurrent requests.
+    # Pass `rng` to get records that don't repeat every 10,000 identifiers.
+    if rng is None:
+        rng = random.Random(int(identifier[-4:]))  # Use last 4 digits for consistency
+    
+    conditions = [
+        "Type 2 Diabetes Mellitus", "Essential Hypertension", "Coronary Artery Disease",
+        "Hypothyroidism", "Tuberculosis", "Dengue Fever", "Chronic Kidney Disease",
+        "COPD", "Bronchial Asthma", "Rheumatoid Arthritis", "Anemia",
+        "Fatty Liver Disease", "Vitamin D Deficiency", "Vitamin B12 Deficiency"
+    ]
+    
+    medications = [
+        "Metformin 500mg BD", "Telmisartan 40mg OD", "Aspirin 75mg OD",
+        "Atorvastatin 10mg HS", "Levothyroxine 25mcg OD", "Amlodipine 5mg OD",
+        "Pantoprazole 40mg OD", "Rosuvastatin 10mg HS", "Glimepiride 1mg OD",
+        "Montelukast 10mg HS", "Methylcobalamin 1500mcg OD"
+    ]
+    
+    hospitals = [
+        "AIIMS Delhi", "Medanta - The Medicity, Gurugram", "Apollo Hospitals, Chennai",
+        "Fortis Memorial Research Institute", "Manipal Hospitals, Bangalore",
+        "Max Super Speciality Hospital, Delhi", "Kokilaben Hospital, Mumbai",
+        "Narayana Health City, Bangalore", "Tata Memorial Hospital, Mumbai"
+    ]
+
+    lab_tests = [
+        {
+            "name": "Complete Blood Count (CBC)",
+            "parameters": {
+                "Hemoglobin": f"{rng.uniform(11.0, 15.5):.1f} g/dL",
+                "WBC Count": f"{rng.uniform(4000, 11000):.0f} cells/mcL",
+                "Platelet Count": f"{rng.uniform(150000, 450000):.0f} /mcL"
+            }
+        },
+        {
+            "name": "Lipid Profile",
+            "parameters": {
+                "Total Cholesterol": f"{rng.uniform(150, 240):.0f} mg/dL",
+                "Triglycerides": f"{rng.uniform(100, 200):.0f} mg/dL",
+                "HDL Cholesterol": f"{rng.uniform(40, 60):.0f} mg/dL",
+                "LDL Cholesterol": f"{rng.uniform(70, 160):.0f} mg/dL"
+            }
+        },
+        {
+            "name": "Diabetes Profile",
+            "parameters": {
+                "Fasting Blood Sugar": f"{rng.uniform(70, 180):.0f} mg/dL",
+                "Post Prandial Blood Sugar": f"{rng.uniform(100, 200):.0f} mg/dL",
+                "HbA1c": f"{rng.uniform(5.0, 8.0):.1f}%"
+            }
+        }
+    ]
+
+    # Generate Indian name components
+    first_names = ["Aarav", "Advait", "Arjun", "Ishaan", "Reyansh", "Vihaan",
+                  "Aanya", "Diya", "Kiara", "Myra", "Prisha", "Zara"]
+    last_names = ["Patel", "Kumar", "Singh", "Sharma", "Verma", "Gupta",
+                 "Malhotra", "Reddy", "Iyer", "Mehta"]
+    
+    # Generate visit dates
+    base_date = datetime.now() - timedelta(days=365)
+    visit_dates = []
+    for _ in range(4):
+        days_to_add = rng.randint(0, 365)
+        visit_dates.append((base_date + timedelta(days=days_to_add)).strftime("%Y-%m-%d"))
+    visit_dates.sort()
+
+    patient_name = f"{rng.choice(first_names)} {rng.choice(last_names)}"
+    
+    return {
+        "patient_info": {
+            "name": patient_name,
+            "identifier": identifier,
+            "identifier_type": "ABHA" if len(identifier) == 14 else "Aadhaar",
+            "age": rng.randint(25, 75),
+            "gender": rng.choice(["Male", "Female"]),
+            "blood_group": rng.choice(["A+", "B+", "O+", "AB+", "A-", "B-", "O-", "AB-"]),
+            "marital_status": rng.choice(["Married", "Single", "Widowed"]),
+            "occupation": rng.choice(["Service", "Business", "Healthcare", "Education", "Homemaker", "Retired"]),
+            "address": {
+                "city": rng.choice(["Mumbai", "Delhi", "Bangalore", "Chennai", "Hyderabad", "Pune", "Kolkata"]),
+                "state": rng.choice(["Maharashtra", "Delhi", "Karnataka", "Tamil Nadu", "Telangana", "West Bengal"]),
+                "pincode": f"{rng.randint(100000, 999999)}"
+            }
+        },
+        "medical_history": {
+            "chronic_conditions": rng.sample(conditions, rng.randint(1, 3)),
+            "allergies": rng.sample(["Penicillin", "Sulfa Drugs", "Aspirin", "Dairy Products", "Pollen", "Dust"], rng.randint(0, 2)),
+            "family_history": [
+                f"{rng.choice(['Father', 'Mother', 'Sibling'])} - {rng.choice(['Diabetes', 'Hypertension', 'Heart Disease', 'Cancer'])}"
+                for _ in range(rng.randint(1, 2))
+            ],
+            "surgeries": [
+                {
+                    "procedure": rng.choice([
+                        "Laparoscopic Cholecystectomy", "Appendectomy",
+                        "Total Knee Replacement", "Coronary Angioplasty",
+                        "Cataract Surgery"
+                    ]),
+                    "date": (datetime.now() - timedelta(days=rng.randint(30, 730))).strftime("%Y-%m-%d"),
+                    "hospital": rng.choice(hospitals),
+                    "surgeon": f"Dr. {rng.choice(last_names)}"
+                }
+            ] if rng.random() > 0.5 else []
+        },
+        "recent_visits": [
+            {
+                "date": visit_date,
+                "hospital": rng.choice(hospitals),
+                "department": rng.choice([
+                    "General Medicine", "Cardiology", "Endocrinology",
+                    "Orthopedics", "Gastroenterology", "Pulmonology"
+                ]),
+                "doctor": f"Dr. {rng.choice(last_names)}",
+                "diagnosis": rng.choice(conditions),
+                "prescribed_medications": rng.sample(medications, rng.randint(2, 4)),
+                "follow_up_date": (datetime.strptime(visit_date, "%Y-%m-%d") + timedelta(days=rng.randint(15, 45))).strftime("%Y-%m-%d")
+            }
+            for visit_date in visit_dates
+        ],
+        "laboratory_results": {
+            "latest_tests": lab_tests,
+            "test_date": (datetime.now() - timedelta(days=rng.randint(1, 30))).strftime("%Y-%m-%d"),
+            "laboratory": rng.choice([
+                "Thyrocare", "Dr Lal PathLabs", "SRL Diagnostics",
+                "Metropolis Healthcare", "Apollo Diagnostics"
+            ])
+        },
+        "insurance_info": {
+            "policy_number": f"POL{rng.randint(100000, 999999)}",
+            "insurance_provider": rng.choice([
+                "Star Health Insurance", "LIC Health Insurance",
+                "HDFC ERGO Health", "Max Bupa Health Insurance",
+                "New India Assurance", "National Insurance"
+            ]),
+            "policy_type": rng.choice([
+                "Family Floater", "Individual Health Plan",
+                "Senior Citizen Health Plan", "Critical Illness Cover"
+            ]),
+            "coverage_amount": rng.choice([500000, 1000000, 2000000, 5000000, 10000000]),
+            "valid_until": (datetime.now() + timedelta(days=365)).strftime("%Y-%m-%d"),
+            "tpa": rng.choice([
+                "Medi Assist", "MD India", "Paramount Health",
+                "Family Health Plan", "Vipul MedCorp"
+            ])
+        },
+        "vitals_history": [
+            {
+                "date": (datetime.now() - timedelta(days=i*30)).strftime("%Y-%m-%d"),
+                "blood_pressure": f"{rng.randint(110,140)}/{rng.randint(70,90)} mmHg",
+                "heart_rate": f"{rng.randint(60, 100)} bpm",
+                "temperature": f"{round(rng.uniform(97.0, 99.0), 1)}°F",
+                "oxygen_saturation": f"{rng.randint(95, 100)}%",
+                "respiratory_rate": f"{rng.randint(12, 20)} /min",
+                "weight": f"{rng.randint(55, 85)} kg",
+                "bmi": f"{round(rng.uniform(18.5, 29.9), 1)}"
+            }
+            for i in range(3)
+        ]
+    }
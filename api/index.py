@@ -57,17 +57,47 @@ def analyze(req: ClaimRequest):
 
 import fitz  # PyMuPDF
 import json
+import math
+import mmap
 import os
+import sys
 import re  # Regex
 import hashlib # For duplicate file check
-import requests # <--- ADDED for IPFS fetch
+import heapq
+import multiprocessing
+import random
+import asyncio
+import base64
+import bisect
+import contextvars
+import functools
+import glob
+import httpx # Async, pooled IPFS fetch
+import numpy as np # MinHash signatures (near-duplicate index)
+import sqlite3 # Duplicate document index
+import struct
+import threading
+import tempfile
+import time
+import unicodedata
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
 from dateutil.parser import parse as date_parse
 from dateutil.relativedelta import relativedelta
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Tuple, Any
+from typing import List, Optional, Dict, Tuple, Any, Iterator, Iterable
+from urllib.parse import parse_qs
 from groq import Groq
+try:
+    import fcntl # Cross-process write lock for the duplicate index (POSIX only)
+except ImportError:
+    fcntl = None
 
 # --- Pydantic Models ---
 class Diagnosis(BaseModel):
@@ -86,6 +116,8 @@ class AbhaRecord(BaseModel):
 class ClaimRequest(BaseModel):
     ipfs_hash: str = Field(..., description="IPFS hash (CID) of the claim PDF.")
     abha_identifier: str = Field(..., description="Patient's Aadhaar/ABHA identifier.")
+    ocr_async: bool = Field(False, description="If the PDF needs OCR, return 202 with a job id instead of waiting.")
+    claim_id: Optional[str] = Field(None, description="Claim id (e.g. the on-chain claim id). Re-verifying the same claim isn't flagged as a duplicate submission.")
 
 # --- FastAPI App ---
 app = FastAPI(title="Decentralized Claim Verifier API")
@@ -136,69 +168,460 @@ MOCK_USER_CLAIM_HISTORY_DB = {
     "123456789012": [{"claim_date": "10-09-2025", "amount": 4500}, {"claim_date": "05-08-2025", "amount": 6000}],
     "98-7654-3210-9876": [{"claim_date": "15-06-2025", "amount": 5000}, {"claim_date": "02-03-2025", "amount": 3500}],
 }
-MOCK_DUPLICATE_HASH_DB = {
-    "example_hash_12345": "Claim-001",
-}
 
-# --- NEW Helper Function: Fetch PDF from IPFS ---
-def fetch_pdf_from_ipfs(ipfs_hash: str) -> bytes:
-    """Fetches PDF content from a public IPFS gateway."""
-    # Using ipfs.io, but you can switch to Pinata, Infura, etc. if needed
-    gateway_url = f"https://ipfs.io/ipfs/{ipfs_hash}"
-    print(f"Attempting to fetch PDF from: {gateway_url}") # Log the URL
-    try:
-        response = requests.get(gateway_url, timeout=60) # Increased timeout to 60 seconds
-        response.raise_for_status() # Raise HTTP errors
-        content_type = response.headers.get('Content-Type', '')
-        print(f"IPFS response status: {response.status_code}, Content-Type: {content_type}") # Log status and type
-
-        # Be more lenient with content type check, as gateways might vary
-        if 'pdf' not in content_type and 'octet-stream' not in content_type:
-            # Check file extension if possible from Content-Disposition
-            content_disposition = response.headers.get('Content-Disposition', '')
-            if not (content_disposition and '.pdf' in content_disposition.lower()):
-                 print(f"Warning: Unexpected Content-Type from IPFS: {content_type}. Content-Disposition: {content_disposition}. Proceeding anyway.")
-                 # Decide if you want to raise an error or just warn:
-                 # raise HTTPException(status_code=400, detail=f"IPFS content may not be a PDF (Type: {content_type}, Hash: {ipfs_hash})")
-
-        pdf_content = response.content
-        if not pdf_content:
-             raise HTTPException(status_code=400, detail=f"IPFS fetch returned empty content (Hash: {ipfs_hash})")
-        print(f"Successfully fetched {len(pdf_content)} bytes from IPFS.")
+# --- NEW Helper: Policy terms (mock policies plus an optional JSON file) ---
+POLICY_DB_PATH = os.getenv("POLICY_DB_PATH") or None # {identifier: {"waiting_period_days", "sum_insured", "start_date", ...}}
+_policy_db: Optional[Dict[str, dict]] = None
+_policy_db_lock = threading.Lock()
+
+def get_policy(abha_id: str) -> dict:
+    """Policy terms for a patient, from POLICY_DB_PATH (e.g. benchmarks/generate_dataset.py output) or MOCK_POLICY_DB."""
+    global _policy_db
+    if _policy_db is None:
+        with _policy_db_lock:
+            if _policy_db is None:
+                policies = dict(MOCK_POLICY_DB)
+                if POLICY_DB_PATH:
+                    try:
+                        with open(POLICY_DB_PATH, "r", encoding="utf-8") as f: policies.update(json.load(f))
+                        print(f"Loaded {len(policies)} policies (including '{POLICY_DB_PATH}').")
+                    except (OSError, ValueError) as e:
+                        print(f"Warning: Could not load policies from '{POLICY_DB_PATH}': {e}")
+                _policy_db = policies
+    return _policy_db.get(abha_id, {})
+
+# --- NEW Helper: Async, pooled IPFS fetcher ---
+IPFS_GATEWAYS = [g.strip() for g in os.getenv("IPFS_GATEWAYS", "https://ipfs.io/ipfs/").split(",") if g.strip()]
+IPFS_FETCH_MODE = os.getenv("IPFS_FETCH_MODE", "race") # "race" or "sequential"
+IPFS_FETCH_TIMEOUT = float(os.getenv("IPFS_FETCH_TIMEOUT", "60"))
+IPFS_CANCEL_LOSERS = os.getenv("IPFS_CANCEL_LOSERS", "1") != "0"
+IPFS_MAX_CONNECTIONS = int(os.getenv("IPFS_MAX_CONNECTIONS", "100"))
+
+
+class GatewayStats:
+    """Running latency/outcome counters for a single IPFS gateway."""
+
+    EWMA_ALPHA = 0.2
+
+    def __init__(self):
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.cancelled = 0
+        self.last_ms: Optional[float] = None
+        self.ewma_ms: Optional[float] = None
+
+    def record(self, elapsed_ms: float, ok: bool, penalty_ms: float = 0.0):
+        """Failures feed `penalty_ms` into the EWMA so a fast-failing gateway doesn't look fast."""
+        self.requests += 1
+        if ok: self.successes += 1
+        else: self.failures += 1
+        self.last_ms = elapsed_ms
+        sample = elapsed_ms if ok else max(elapsed_ms, penalty_ms)
+        self.ewma_ms = sample if self.ewma_ms is None else (1 - self.EWMA_ALPHA) * self.ewma_ms + self.EWMA_ALPHA * sample
+
+    def as_dict(self) -> dict:
+        return {"requests": self.requests, "successes": self.successes, "failures": self.failures, "cancelled": self.cancelled,
+                "last_ms": self.last_ms, "ewma_ms": self.ewma_ms}
+
+
+class IpfsFetcher:
+    """
+    Fetches CIDs over a shared, connection-pooled httpx.AsyncClient.
+
+    In "race" mode every gateway is queried at once and the first good response
+    wins; the losers are cancelled when `cancel_losers` is set, otherwise they run
+    to completion in the background so their latency is still recorded. In
+    "sequential" mode gateways are tried one after another, fastest observed first.
+    Pass `client` (e.g. one built on httpx.MockTransport) to test against a stub gateway.
+    """
+
+    def __init__(self, gateways: List[str], mode: str = "race", timeout: float = 60.0, cancel_losers: bool = True,
+                 max_connections: int = 100, client: Optional["httpx.AsyncClient"] = None):
+        if not gateways:
+            raise ValueError("At least one IPFS gateway is required.")
+        if mode not in ("race", "sequential"):
+            raise ValueError(f"Unknown IPFS fetch mode '{mode}'.")
+        self.gateways = list(gateways)
+        self.mode = mode
+        self.timeout = timeout
+        self.cancel_losers = cancel_losers
+        self.max_connections = max_connections
+        self.stats = {g: GatewayStats() for g in self.gateways}
+        self._client = client
+        self._background: set = set()
+
+    @property
+    def client(self) -> "httpx.AsyncClient":
+        if self._client is None:
+            limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=limits, follow_redirects=True)
+        return self._client
+
+    @staticmethod
+    def gateway_url(gateway: str, ipfs_hash: str) -> str:
+        return f"{gateway.rstrip('/')}/{ipfs_hash}"
+
+    async def _fetch_one(self, gateway: str, ipfs_hash: str) -> bytes:
+        gateway_url = self.gateway_url(gateway, ipfs_hash)
+        start = time.perf_counter()
+        try:
+            with span("ipfs.gateway", gateway=gateway) as gateway_span:
+                response = await self.client.get(gateway_url)
+                gateway_span.set(status=response.status_code, bytes=len(response.content))
+            response.raise_for_status() # Raise HTTP errors
+            content_type = response.headers.get('Content-Type', '')
+            # Be more lenient with content type check, as gateways might vary
+            if 'pdf' not in content_type and 'octet-stream' not in content_type:
+                content_disposition = response.headers.get('Content-Disposition', '')
+                if not (content_disposition and '.pdf' in content_disposition.lower()):
+                    print(f"Warning: Unexpected Content-Type from IPFS: {content_type}. Content-Disposition: {content_disposition}. Proceeding anyway.")
+            pdf_content = response.content
+            if not pdf_content:
+                raise HTTPException(status_code=400, detail=f"IPFS fetch returned empty content (Hash: {ipfs_hash})")
+        except asyncio.CancelledError:
+            self.stats[gateway].cancelled += 1
+            raise
+        except Exception:
+            self.stats[gateway].record((time.perf_counter() - start) * 1000, ok=False, penalty_ms=self.timeout * 1000)
+            raise
+        self.stats[gateway].record((time.perf_counter() - start) * 1000, ok=True)
         return pdf_content
-    except requests.exceptions.Timeout:
-        print(f"Error: Timeout fetching PDF from IPFS ({gateway_url})")
-        raise HTTPException(status_code=504, detail=f"Timeout fetching PDF from IPFS ({gateway_url})")
-    except requests.exceptions.RequestException as e:
-        print(f"Error: Could not fetch PDF from IPFS ({gateway_url}): {e}")
-        raise HTTPException(status_code=503, detail=f"Could not fetch PDF from IPFS ({gateway_url}): {e}")
+
+    def _ordered_gateways(self) -> List[str]:
+        # Untried gateways sort first so every gateway gets a latency sample
+        return sorted(self.gateways, key=lambda g: self.stats[g].ewma_ms or 0.0)
+
+    async def fetch(self, ipfs_hash: str) -> bytes:
+        """Returns the bytes for `ipfs_hash`, raising HTTPException if no gateway delivers them."""
+        errors: List[Tuple[str, BaseException]] = []
+        if self.mode == "sequential":
+            for gateway in self._ordered_gateways():
+                try:
+                    return await self._fetch_one(gateway, ipfs_hash)
+                except Exception as e:
+                    print(f"Error: Could not fetch PDF from IPFS ({self.gateway_url(gateway, ipfs_hash)}): {e}")
+                    errors.append((gateway, e))
+        else:
+            tasks = {asyncio.ensure_future(self._fetch_one(g, ipfs_hash)): g for g in self.gateways}
+            pending = set(tasks)
+            caller_cancelled = False
+            try:
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None:
+                            return task.result()
+                        print(f"Error: Could not fetch PDF from IPFS ({self.gateway_url(tasks[task], ipfs_hash)}): {task.exception()}")
+                        errors.append((tasks[task], task.exception()))
+            except asyncio.CancelledError:
+                caller_cancelled = True
+                raise
+            finally:
+                for task in pending:
+                    if self.cancel_losers or caller_cancelled:
+                        task.cancel()
+                    else:
+                        self._background.add(task)
+                        task.add_done_callback(self._discard_background)
+        raise self._to_http_error(ipfs_hash, errors)
+
+    def _discard_background(self, task: "asyncio.Task"):
+        self._background.discard(task)
+        if not task.cancelled(): task.exception() # Mark the exception as retrieved
+
+    @staticmethod
+    def _to_http_error(ipfs_hash: str, errors: List[Tuple[str, BaseException]]) -> HTTPException:
+        for _, e in errors:
+            if isinstance(e, HTTPException):
+                return e
+        detail = "; ".join(f"{g}: {e!r}" for g, e in errors)
+        if errors and all(isinstance(e, httpx.TimeoutException) for _, e in errors):
+            return HTTPException(status_code=504, detail=f"Timeout fetching PDF from IPFS (Hash: {ipfs_hash}): {detail}")
+        return HTTPException(status_code=503, detail=f"Could not fetch PDF from IPFS (Hash: {ipfs_hash}): {detail}")
+
+    def gateway_stats(self) -> Dict[str, dict]:
+        return {g: s.as_dict() for g, s in self.stats.items()}
+
+    async def aclose(self):
+        for task in list(self._background):
+            task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+ipfs_fetcher = IpfsFetcher(IPFS_GATEWAYS, mode=IPFS_FETCH_MODE, timeout=IPFS_FETCH_TIMEOUT,
+                           cancel_losers=IPFS_CANCEL_LOSERS, max_connections=IPFS_MAX_CONNECTIONS)
+
+# --- NEW Helper: Content-addressed local PDF cache ---
+_BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+_CID_SAFE_RE = re.compile(r"^[A-Za-z0-9]{10,128}$")
+_MULTIHASH_SHA2_256 = 0x12
+_CODEC_RAW = 0x55
+_CODEC_DAG_PB = 0x70
+_UNIXFS_CHUNK_SIZE = 262144 # Default IPFS chunker size
+
+def _b58decode(s: str) -> bytes:
+    n = 0
+    for ch in s:
+        n = n * 58 + _BASE58_ALPHABET.index(ch)
+    body = n.to_bytes((n.bit_length() + 7) // 8, "big")
+    return b"\x00" * (len(s) - len(s.lstrip("1"))) + body
+
+def _read_varint(buf: bytes, pos: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        b = buf[pos]; pos += 1
+        value |= (b & 0x7F) << shift; shift += 7
+        if not b & 0x80: return value, pos
+
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        b = n & 0x7F; n >>= 7
+        if n: out.append(b | 0x80)
+        else: out.append(b); return bytes(out)
+
+def _parse_cid(cid: str) -> Optional[Tuple[int, bytes]]:
+    """Returns (codec, sha256 digest) for sha2-256 CIDs, or None if the CID can't be decoded."""
+    try:
+        if cid.startswith("Qm") and len(cid) == 46: # CIDv0: bare base58btc multihash, always dag-pb
+            codec, mh = _CODEC_DAG_PB, _b58decode(cid)
+        else:
+            if cid[0] == "b": raw = base64.b32decode(cid[1:].upper() + "=" * (-len(cid[1:]) % 8))
+            elif cid[0] == "z": raw = _b58decode(cid[1:])
+            else: return None
+            version, pos = _read_varint(raw, 0)
+            if version != 1: return None
+            codec, pos = _read_varint(raw, pos)
+            mh = raw[pos:]
+        hash_fn, pos = _read_varint(mh, 0)
+        length, pos = _read_varint(mh, pos)
+        if hash_fn != _MULTIHASH_SHA2_256 or length != 32 or len(mh) != pos + 32: return None
+        return codec, mh[pos:]
+    except Exception:
+        return None
+
+def _unixfs_single_block(data: bytes) -> bytes:
+    """dag-pb node IPFS writes for a file that fits in one chunk (UnixFS File, no links)."""
+    unixfs = b"\x08\x02" + b"\x12" + _varint(len(data)) + data + b"\x18" + _varint(len(data))
+    return b"\x0a" + _varint(len(unixfs)) + unixfs
+
+def verify_cid(cid: str, data: bytes) -> Optional[bool]:
+    """
+    Checks `data` against `cid`. Returns True/False when the CID's hash can be
+    recomputed locally (raw-codec CIDs, and single-chunk dag-pb files), or None
+    when it can't (multi-chunk DAGs, non-sha256 hashes, unknown multibase).
+    """
+    parsed = _parse_cid(cid)
+    if parsed is None: return None
+    codec, digest = parsed
+    if codec == _CODEC_RAW:
+        return hashlib.sha256(data).digest() == digest
+    if codec == _CODEC_DAG_PB and len(data) <= _UNIXFS_CHUNK_SIZE:
+        # Non-default add options (chunker, raw leaves) produce other encodings, so a miss is inconclusive
+        return True if hashlib.sha256(_unixfs_single_block(data)).digest() == digest else None
+    return None
+
+
+class PdfCache:
+    """
+    Two-tier LRU cache of fetched PDFs keyed by IPFS CID.
+
+    A bounded in-memory tier sits in front of a size-bounded directory of
+    `<cid[:2]>/<cid>` files. Since a CID names immutable content, entries never go
+    stale; they only leave through LRU eviction. Bytes are checked with
+    `verify_cid` on insert: a definite mismatch is never stored, and content that
+    can't be checked locally (e.g. multi-block dag-pb files) is kept in the memory
+    tier only, or not at all if `require_verified` is set. Only verified bytes
+    reach disk, so a bad gateway response can't outlive the process.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, memory_max_bytes: int, require_verified: bool = False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_max_bytes = memory_max_bytes
+        self.require_verified = require_verified
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: "OrderedDict[str, int]" = OrderedDict() # cid -> size, oldest first
+        self._disk_bytes = 0
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "inserts": 0, "memory_evictions": 0,
+                         "disk_evictions": 0, "verify_failures": 0, "unverified": 0}
+        self._scan_disk()
+
+    def _path(self, cid: str) -> str:
+        return os.path.join(self.directory, cid[:2], cid)
+
+    def _scan_disk(self):
+        entries = []
+        if os.path.isdir(self.directory):
+            for sub in os.scandir(self.directory):
+                if not sub.is_dir(): continue
+                for entry in os.scandir(sub.path):
+                    if entry.is_file() and _CID_SAFE_RE.match(entry.name):
+                        st = entry.stat()
+                        entries.append((st.st_mtime, entry.name, st.st_size))
+        for _, cid, size in sorted(entries):
+            self._disk[cid] = size
+            self._disk_bytes += size
+        with self._lock:
+            self._evict_disk()
+
+    def _remember(self, cid: str, data: bytes):
+        if len(data) > self.memory_max_bytes: return
+        if cid in self._memory:
+            self._memory.move_to_end(cid); return
+        self._memory[cid] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, old = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old)
+            self.counters["memory_evictions"] += 1
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.max_bytes and self._disk:
+            cid, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self.counters["disk_evictions"] += 1
+            try: os.remove(self._path(cid))
+            except OSError: pass
+
+    def get_from_memory(self, cid: str) -> Optional[bytes]:
+        """Memory-tier lookup only; cheap enough to call on the event loop."""
+        with self._lock:
+            data = self._memory.get(cid)
+            if data is not None:
+                self._memory.move_to_end(cid)
+                self.counters["memory_hits"] += 1
+            return data
+
+    def get(self, cid: str) -> Optional[bytes]:
+        data = self.get_from_memory(cid)
+        if data is not None: return data
+        with self._lock:
+            on_disk = cid in self._disk
+        if on_disk:
+            try:
+                with open(self._path(cid), "rb") as f:
+                    data = f.read()
+                if verify_cid(cid, data) is not True: # e.g. an unverified entry written by an older version
+                    os.remove(self._path(cid)); data = None
+                else:
+                    os.utime(self._path(cid)) # Persist recency across restarts
+            except OSError:
+                data = None
+        with self._lock:
+            if data is None:
+                if on_disk:
+                    self._disk_bytes -= self._disk.pop(cid, 0)
+                self.counters["misses"] += 1
+                return None
+            if cid in self._disk: self._disk.move_to_end(cid)
+            self.counters["disk_hits"] += 1
+            self._remember(cid, data)
+            return data
+
+    def put(self, cid: str, data: bytes) -> bool:
+        """Stores `data` under `cid` if it verifies; returns whether it was cached."""
+        if not _CID_SAFE_RE.match(cid) or not data: return False
+        verified = verify_cid(cid, data)
+        if verified is False or (verified is None and self.require_verified):
+            with self._lock: self.counters["verify_failures" if verified is False else "unverified"] += 1
+            print(f"Warning: Not caching IPFS content for {cid} (CID verification: {verified}).")
+            return False
+        if verified and len(data) <= self.max_bytes:
+            path = self._path(cid)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"Warning: Could not write PDF cache entry for {cid}: {e}")
+                path = None
+        else:
+            path = None
+        with self._lock:
+            if verified is None: self.counters["unverified"] += 1
+            self.counters["inserts"] += 1
+            if path is not None and cid not in self._disk:
+                self._disk[cid] = len(data)
+                self._disk_bytes += len(data)
+                self._evict_disk()
+            self._remember(cid, data)
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            return {**self.counters, "hit_rate": (hits / lookups) if lookups else None,
+                    "memory_entries": len(self._memory), "memory_bytes": self._memory_bytes,
+                    "disk_entries": len(self._disk), "disk_bytes": self._disk_bytes,
+                    "memory_max_bytes": self.memory_max_bytes, "max_bytes": self.max_bytes}
+
+
+PDF_CACHE_ENABLED = os.getenv("PDF_CACHE_ENABLED", "1") != "0"
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", os.path.join(tempfile.gettempdir(), "trustlynk_pdf_cache"))
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+PDF_CACHE_MEMORY_BYTES = int(os.getenv("PDF_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024)))
+PDF_CACHE_REQUIRE_VERIFIED = os.getenv("PDF_CACHE_REQUIRE_VERIFIED", "0") == "1"
+
+pdf_cache = None
+if PDF_CACHE_ENABLED:
+    try:
+        pdf_cache = PdfCache(PDF_CACHE_DIR, PDF_CACHE_MAX_BYTES, PDF_CACHE_MEMORY_BYTES, PDF_CACHE_REQUIRE_VERIFIED)
     except Exception as e:
-        print(f"Error: Unexpected error processing IPFS fetch: {e}")
-        raise HTTPException(status_code=500, detail=f"Error processing IPFS fetch: {e}")
+        print(f"Warning: PDF cache disabled. {e}")
 
 
-# --- Helper Function: Extract Data from Large Dummy ABHA DB ---
-def get_simplified_abha_data(database_filepath: str, identifier: str) -> Optional[dict]:
-    # (This function remains exactly the same as the previous version)
+@app.get("/ipfs/cache")
+def ipfs_cache_stats():
+    if pdf_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **pdf_cache.stats()}
+
+
+async def fetch_pdf_from_ipfs(ipfs_hash: str) -> bytes:
+    """Fetches PDF content from the local CID cache, falling back to the configured IPFS gateways."""
+    if pdf_cache is not None:
+        cached = pdf_cache.get_from_memory(ipfs_hash) or await asyncio.to_thread(pdf_cache.get, ipfs_hash)
+        if cached is not None:
+            print(f"Serving {len(cached)} bytes for {ipfs_hash} from the local PDF cache.")
+            return cached
+    print(f"Attempting to fetch PDF {ipfs_hash} via {ipfs_fetcher.mode} over {len(ipfs_fetcher.gateways)} gateway(s).")
     try:
-        with open(database_filepath, 'r', encoding='utf-8') as f:
-            full_data = json.load(f)
+        pdf_content = await ipfs_fetcher.fetch(ipfs_hash)
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error reading/parsing dummy ABHA DB '{database_filepath}': {e}")
-        return None
+        print(f"Error: Unexpected error processing IPFS fetch: {e}")
+        raise HTTPException(status_code=500, detail=f"Error processing IPFS fetch: {e}")
+    print(f"Successfully fetched {len(pdf_content)} bytes from IPFS.")
+    if pdf_cache is not None:
+        await asyncio.to_thread(pdf_cache.put, ipfs_hash, pdf_content)
+    return pdf_content
+
+
+@app.get("/ipfs/gateways")
+def ipfs_gateway_stats():
+    return {"mode": ipfs_fetcher.mode, "gateways": ipfs_fetcher.gateway_stats()}
+
 
-    patient_record = None
-    for request in full_data.get("api_examples", {}).get("requests", []):
-        data = request.get("example_response", {}).get("data", {})
-        patient_info = data.get("patient_info", {})
-        if patient_info.get("identifier") == identifier:
-            patient_record = data
-            break
+@app.on_event("shutdown")
+async def close_ipfs_fetcher():
+    await ipfs_fetcher.aclose()
 
-    if not patient_record:
-        return None # Identifier not found
 
-    # Map to simple format
+# --- Helper Function: Extract Data from Large Dummy ABHA DB ---
+_MED_NAME_RE = re.compile(r"([a-zA-Z\s\-]+)")
+
+def _simplify_abha_record(patient_record: dict) -> dict:
+    """Maps a full ABDM health record to the simple AbhaRecord layout."""
     patient_info = patient_record.get("patient_info", {})
     medical_history = patient_record.get("medical_history", {})
     recent_visits = patient_record.get("recent_visits", [])
@@ -226,7 +649,7 @@ def get_simplified_abha_data(database_filepath: str, identifier: str) -> Optiona
     seen_meds = set()
     for visit in recent_visits:
         for med_string in visit.get("prescribed_medications", []):
-             match = re.match(r"([a-zA-Z\s\-]+)", med_string)
+             match = _MED_NAME_RE.match(med_string)
              if match:
                  med_name = match.group(1).strip()
                  if med_name and med_name.lower() not in seen_meds:
@@ -244,411 +667,3984 @@ def get_simplified_abha_data(database_filepath: str, identifier: str) -> Optiona
     return simplified_data
 
 
-# --- UPGRADED Rule Engine (MODIFIED __init__ and text extraction) ---
-class RuleEngine:
-    # MODIFIED: Takes pdf_content directly
-    def __init__(self, pdf_content: bytes, abha_data: AbhaRecord):
-        self.pdf_content = pdf_content
-        # Extract text internally using a new private method
-        self.pdf_text = self._extract_text_from_pdf_internal()
-        if not self.pdf_text:
-             raise ValueError("Could not extract text from the provided PDF content. Is it an image PDF?")
-        self.pdf_lower = self.pdf_text.lower()
-        self.abha = abha_data
+class AbhaStore:
+    """
+    Load-once, identifier-indexed view over the dummy ABHA database.
 
-        self.risk_score = 0
-        self.detailed_analysis = []
-        self.red_flags = []
+    The source JSON is parsed a single time and every record is simplified up
+    front, so lookups are a dict access. If `index_filepath` is given, the
+    simplified records are written to an on-disk index (one `identifier<TAB>json`
+    line per record) and only the byte offsets are kept in memory; lookups then
+    seek and parse a single line. The source file's mtime/size are re-checked at
+    most every `reload_check_seconds` and the store rebuilds itself when they change.
 
-        self.extracted = {
-            "total_amount": 0.0, "age": None, "bill_date": None,
-            "provider_name": "UNKNOWN", "doc_reg_id": None,
-            "diagnoses": [], "medications": [], "file_hash": None,
-            "admission_date": None, "discharge_date": None,
-        }
-        self.policy = MOCK_POLICY_DB.get(abha_data.abha_id, {})
+    Each source version gets its own index file (`<index_filepath>.gen-<mtime>-<size>`),
+    published together with its offsets, so workers sharing the path never read
+    offsets against another version's file. Lookups also check the identifier on
+    the line they read and reload on a mismatch.
+    """
 
-    # NEW: Internal text extraction method
-    def _extract_text_from_pdf_internal(self) -> str:
-        text = ""
+    INDEX_VERSION = 1
+
+    def __init__(self, database_filepath: str, index_filepath: Optional[str] = None, reload_check_seconds: float = 2.0):
+        self.database_filepath = database_filepath
+        self.index_filepath = index_filepath
+        self.reload_check_seconds = reload_check_seconds
+        self._lock = threading.Lock()
+        self._records: Dict[str, dict] = {}
+        self._index: Tuple[Optional[str], Dict[str, int]] = (None, {}) # (generation file, offsets), swapped as one
+        self._signature: Optional[Tuple[int, int]] = None
+        self._last_check = 0.0
+
+    def _source_signature(self) -> Optional[Tuple[int, int]]:
         try:
-            # Use fitz (PyMuPDF) to open the PDF content from memory
-            with fitz.open(stream=self.pdf_content, filetype="pdf") as doc:
-                for page in doc:
-                    page_text = page.get_text("text") # Ensure text extraction
-                    if page_text:
-                        text += page_text
-                    else:
-                        print(f"Warning: Page {page.number} seems to have no extractable text.")
-                        # Optionally, add OCR fallback here if needed in future
-        except Exception as e:
-            print(f"Error extracting PDF text internally: {e}")
-            # Do not raise HTTPException here, let the __init__ handle it
-            return "" # Return empty string on failure
-        return text
+            st = os.stat(self.database_filepath)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
 
-    # run_all_checks and all _check_* methods remain exactly the same as the previous version
-    def run_all_checks(self) -> Tuple[int, List[str], List[str]]:
-        """Runs all rule checks."""
-        self._extract_data_from_pdf() # Populates self.extracted
+    def _iter_source_records(self):
+        with open(self.database_filepath, 'r', encoding='utf-8') as f:
+            full_data = json.load(f)
+        for request in full_data.get("api_examples", {}).get("requests", []):
+            data = request.get("example_response", {}).get("data", {})
+            identifier = data.get("patient_info", {}).get("identifier")
+            if identifier:
+                yield identifier, data
 
-        checks_to_run = [
-            self._check_identity, self._check_medical_history, self._check_medication_disease_consistency,
-            self._check_age_vs_disease, self._check_treatment_duration, self._check_invoice_structure,
-            self._check_lab_result_consistency, self._check_icd_code_consistency, self._check_policy_compliance,
-            self._check_prescriber_authenticity, self._check_provider_behavior, self._check_outlier_pricing,
-            self._check_claim_frequency, self._check_previous_diagnosis_conflict, self._check_medication_refill_velocity,
-            self._check_document_tampering, self._check_duplicate_document, self._add_placeholders_for_other_rules
-        ]
-        for check_func in checks_to_run:
-            try: check_func()
-            except Exception as e:
-                rule_name = check_func.__name__; self.detailed_analysis.append(f"Analysis ({rule_name}): FAILED with error: {e}"); self.risk_score += 5
-        return self.risk_score, self.detailed_analysis, self.red_flags
+    def _load(self, signature: Tuple[int, int]):
+        if self.index_filepath:
+            if not self._load_index(signature):
+                self._build_index(signature)
+            self._records = {}
+        else:
+            records = {}
+            for identifier, data in self._iter_source_records():
+                records.setdefault(identifier, _simplify_abha_record(data)) # First match wins, as before
+            self._records = records
+            self._index = (None, {})
+        self._signature = signature
+        print(f"ABHA store loaded {len(self)} records from '{self.database_filepath}'.")
 
-    def _extract_data_from_pdf(self):
-        # (This method remains exactly the same as the previous version)
-        try: self.extracted["age"] = relativedelta(datetime.now(), date_parse(self.abha.dob, dayfirst=True)).years
-        except: pass
-        self.extracted["file_hash"] = hashlib.sha256(self.pdf_content).hexdigest()
-        lines = self.pdf_text.split('\n'); provider_found = False
-        for i in range(min(5, len(lines))):
-             line_upper = lines[i].strip().upper()
-             if "CLINIC" in line_upper or "HOSPITAL" in line_upper or "MEDICAL CENTER" in line_upper:
-                 self.extracted["provider_name"] = line_upper; provider_found = True; break
-        if not provider_found and len(lines) > 1: self.extracted["provider_name"] = lines[1].strip().upper() # Fallback
-        total_match = re.search(r"(net amount|total amount|net payable).*?([\d,]+\.?\d{2})", self.pdf_lower, re.DOTALL | re.IGNORECASE)
-        if total_match:
-            try: self.extracted["total_amount"] = float(total_match.group(2).replace(",", ""))
-            except: pass
-        date_match = re.search(r"(?:bill|invoice)\s*date:?\s*(\d{1,2}[-/]\d{1,2}[-/]\d{4})", self.pdf_lower)
-        if date_match:
-            try: self.extracted["bill_date"] = date_parse(date_match.group(1).replace('/', '-'), dayfirst=True)
-            except: pass
-        reg_match = re.search(r"reg(?:istration)?\.?\s*id:?\s*([A-Za-z0-9/\-]+)", self.pdf_text, re.IGNORECASE) # Allow '/'
-        if reg_match: self.extracted["doc_reg_id"] = reg_match.group(1).upper()
-        diag_patterns = [r"diagnosis:?\s*(?:[A-Z]\d{2}(?:\.\d+)?)\s*-\s*([\w\s\(\),/\-]+)", r"primary diagnosis:?\s*([\w\s\(\),/\-]+)", r"secondary diagnosis:?\s*([\w\s\(\),/\-]+)", r"provisional diagnosis:?\s*([\w\s\(\),/\-]+)"]
-        found_diags = set();
-        for pattern in diag_patterns:
-            for match in re.finditer(pattern, self.pdf_text, re.IGNORECASE):
-                diag_text = match.group(1).strip().lower(); diag_text = re.sub(r'\((primary|secondary)\)', '', diag_text).strip();
-                if diag_text and len(diag_text) > 3: found_diags.add(diag_text)
-        self.extracted["diagnoses"] = list(found_diags)
-        med_patterns = [r"medicine:?\s*([\w\s\-\(\)\+]+?)\s*(?:\(|tab|mg|inj|unit|cream|suspension|\d)", r"rx only\s*([\w\s\-\+]+)", r"prescribed_medications\":\s*\[\"([\w\s\d]+)"]
-        found_meds = set(); ignore_words = {"description", "sr. no.", "medicine:", "dosage", "quantity", "amount", "total", "consultation", "test", "procedure", "fee", "charges", "room", "nursing", "tax", "gst", "paid", "therapy", "counseling", "sessions", "exercises"}
-        for pattern in med_patterns:
-             for match in re.finditer(pattern, self.pdf_text, re.IGNORECASE):
-                 med_name = match.group(1).strip().lower(); med_name_cleaned = re.sub(r'\s*\d+.*', '', med_name).strip()
-                 is_ignored = any(word == med_name_cleaned for word in ignore_words) or any(word in med_name_cleaned.split() for word in ignore_words)
-                 if med_name_cleaned and len(med_name_cleaned) > 3 and not is_ignored: found_meds.add(med_name_cleaned)
-        self.extracted["medications"] = list(found_meds)
-
-
-    # ALL _check_* methods remain exactly the same as the previous 'full code' version
-    # (No need to repeat them all here, just copy them from the previous response)
-    # --- Start copy from previous code ---
-    def _check_identity(self): # Rule 1
-        alerts = [];
-        if self.abha.name.lower() not in self.pdf_lower: alerts.append("Name Mismatch")
-        if self.abha.dob not in self.pdf_text: alerts.append("DOB Mismatch")
-        try: abha_city = self.abha.address.split(',')[-1].strip().lower();
-        if abha_city not in self.pdf_lower: alerts.append(f"City Mismatch ('{abha_city}')")
-        except: pass
-        if alerts: self.risk_score += 70; self.red_flags.append(f"Identity Fail: {', '.join(alerts)}.")
-        self.detailed_analysis.append("Analysis (Rule 1): Checked Bill vs ABHA identity (Name, DOB, City).")
+    def _index_header(self, signature: Tuple[int, int]) -> str:
+        return json.dumps({"version": self.INDEX_VERSION, "source": os.path.abspath(self.database_filepath), "mtime_ns": signature[0], "size": signature[1]})
 
-    def _check_medical_history(self): # Rule 2
-        abha_diags_desc = [d.description.lower() for d in self.abha.past_diagnoses]; abha_meds = [m.lower() for m in self.abha.medications]; alerts_diag = []; alerts_med = []
-        pdf_diags_found = {diag: False for diag in self.extracted["diagnoses"]}
-        for pdf_diag in self.extracted["diagnoses"]:
-            found_in_abha = any(pdf_diag in abha_diag for abha_diag in abha_diags_desc);
-            if not found_in_abha: alerts_diag.append(pdf_diag)
-            pdf_diags_found[pdf_diag] = found_in_abha
-        if alerts_diag: self.risk_score += 15; self.red_flags.append(f"History Mismatch (Diagnosis): '{', '.join(alerts_diag)}' not in ABHA history.")
-        self.detailed_analysis.append(f"Analysis (Rule 2a - Diagnoses): Checked PDF diagnoses vs ABHA. Matches: {pdf_diags_found}")
-        pdf_meds_found = {med: False for med in self.extracted["medications"]}
-        for pdf_med in self.extracted["medications"]:
-             found_in_abha = pdf_med in abha_meds;
-             if not found_in_abha: alerts_med.append(pdf_med)
-             pdf_meds_found[pdf_med] = found_in_abha
-        if alerts_med: self.risk_score += 10; self.red_flags.append(f"History Mismatch (Medication): '{', '.join(alerts_med)}' not in ABHA history.")
-        self.detailed_analysis.append(f"Analysis (Rule 2b - Medications): Checked PDF medications vs ABHA. Matches: {pdf_meds_found}")
+    def _generation_path(self, signature: Tuple[int, int]) -> str:
+        return f"{self.index_filepath}.gen-{signature[0]}-{signature[1]}"
 
-    def _check_medication_disease_consistency(self): # Rule 5
-        if not self.extracted["medications"] or not self.extracted["diagnoses"]: return; alerts = []
-        for med in self.extracted["medications"]:
-            med_key = med.split(' ')[0];
-            if med_key in DRUG_DIAGNOSIS_MAP:
-                valid_diags_keywords = DRUG_DIAGNOSIS_MAP[med_key];
-                is_valid = any(kw in pdf_diag for kw in valid_diags_keywords for pdf_diag in self.extracted["diagnoses"])
-                if not is_valid: alerts.append(f"'{med}' vs {self.extracted['diagnoses']}")
-        if alerts: self.risk_score += 10; self.red_flags.append(f"Logic Warn (Drug-Disease): Mismatches found - {'; '.join(alerts)}.")
-        self.detailed_analysis.append("Analysis (Rule 5): Checked Medication vs. Diagnosis consistency on the bill.")
-
-    def _check_age_vs_disease(self): # Rule 19
-        age = self.extracted["age"];
-        if not age or not self.extracted["diagnoses"]: return;
-        main_diag = self.extracted["diagnoses"][0];
-        if main_diag in DIAGNOSIS_AGE_RANGE:
-            min_age, max_age = DIAGNOSIS_AGE_RANGE[main_diag];
-            if not (min_age <= age <= max_age): self.risk_score += 40; self.red_flags.append(f"Logic Fail (Age-Disease): Patient age ({age}) is not plausible for '{main_diag}' (Expected: {min_age}-{max_age}).")
-        self.detailed_analysis.append(f"Analysis (Rule 19): Checked Age ({age}) vs. Primary Diagnosis ('{main_diag}').")
-
-    def _check_treatment_duration(self): # Rule 6
-        if "opd" in self.pdf_lower or "outpatient" in self.pdf_lower or "consultation" in self.pdf_lower: self.detailed_analysis.append("Analysis (Rule 6): Treatment duration identified as 'OPD' (plausible).")
-        elif self.extracted["admission_date"] and self.extracted["discharge_date"]: self.detailed_analysis.append("Analysis (Rule 6): SKIPPED - In-patient duration logic vs diagnosis not yet implemented.")
-        else: self.risk_score += 5; self.red_flags.append("Logic Warn: Treatment type (OPD/In-patient) is unclear from PDF."); self.detailed_analysis.append("Analysis (Rule 6): Could not clearly determine treatment duration type (OPD/Inpatient).")
-
-    def _check_invoice_structure(self): # Rule 22
-        missing = [];
-        if not re.search(r"bill id|invoice no", self.pdf_lower): missing.append("Bill ID")
-        if not re.search(r"patient name", self.pdf_lower): missing.append("Patient Name")
-        if self.extracted["total_amount"] == 0: missing.append("Total Amount")
-        if not re.search(r"doctor|dr\.", self.pdf_lower): missing.append("Doctor Details")
-        if self.extracted["provider_name"] == "UNKNOWN": missing.append("Provider Name")
-        if not re.search(r"date of birth|dob", self.pdf_lower) and self.abha.dob not in self.pdf_text: missing.append("Patient DOB")
-        if missing: self.risk_score += 10; self.red_flags.append(f"Authenticity Warn (Invoice Structure): Missing standard fields: {', '.join(missing)}.");
-        self.detailed_analysis.append("Analysis (Rule 22): Checked basic invoice structure.")
+    def _load_index(self, signature: Tuple[int, int]) -> bool:
+        """Reuses a prebuilt on-disk index if it matches the current source file."""
+        path = self._generation_path(signature)
+        try:
+            with open(path, 'rb') as f:
+                if f.readline().decode('utf-8').strip() != self._index_header(signature):
+                    return False
+                offsets = {}
+                while True:
+                    offset = f.tell()
+                    line = f.readline()
+                    if not line: break
+                    identifier = line.split(b'\t', 1)[0].decode('utf-8')
+                    offsets.setdefault(identifier, offset)
+        except OSError:
+            return False
+        self._index = (path, offsets)
+        return True
 
-    def _check_lab_result_consistency(self): # Rule 20
-        alerts = []; has_asthma = any("asthma" in d for d in self.extracted["diagnoses"]); has_hypertension = any("hypertension" in d for d in self.extracted["diagnoses"]); has_diabetes = any("diabetes" in d for d in self.extracted["diagnoses"]);
-        mentions_spirometry = "spirometry" in self.pdf_lower or "pft" in self.pdf_lower; mentions_bp = "blood pressure" in self.pdf_lower or " bp " in self.pdf_lower; mentions_hba1c = "hba1c" in self.pdf_lower or "glycated hemoglobin" in self.pdf_lower;
-        if has_asthma and not mentions_spirometry: alerts.append("Spirometry/PFT for Asthma")
-        if has_hypertension and not mentions_bp: alerts.append("BP Check for Hypertension")
-        if has_diabetes and not mentions_hba1c: alerts.append("HbA1c for Diabetes")
-        if alerts: self.risk_score += 5; self.red_flags.append(f"Logic Warn (Lab Consistency): Expected tests missing: {', '.join(alerts)}.");
-        self.detailed_analysis.append("Analysis (Rule 20): Checked for expected tests based on diagnosis.")
-
-    def _check_icd_code_consistency(self): # Rule 15
-        found_codes = re.findall(r"([A-Z]\d{2}(?:\.\d+)?)", self.pdf_text); alerts = []
-        if not found_codes: self.risk_score += 5; self.red_flags.append("Authenticity Warn: No valid ICD-10 codes found."); self.detailed_analysis.append("Analysis (Rule 15): No ICD codes found."); return
-        if "J45" in found_codes and not any("asthma" in d for d in self.extracted["diagnoses"]): alerts.append("J45 code present but 'Asthma' diagnosis missing/mismatched")
-        if "I10" in found_codes and not any("hypertension" in d for d in self.extracted["diagnoses"]): alerts.append("I10 code present but 'Hypertension' diagnosis missing/mismatched")
-        if "M08" in found_codes and not any("arthritis" in d for d in self.extracted["diagnoses"]): alerts.append("M08 code present but 'Arthritis' diagnosis missing/mismatched")
-        if alerts: self.risk_score += 10; self.red_flags.append(f"Logic Warn (ICD Consistency): Issues found - {'; '.join(alerts)}.");
-        self.detailed_analysis.append(f"Analysis (Rule 15): Checked ICD codes vs diagnosis text. Codes Found: {found_codes}")
-
-    def _check_policy_compliance(self): # Rule 29
-        if not self.policy: self.detailed_analysis.append("Analysis (Rule 29): SKIPPED - Policy data not found for user in Mock DB."); return; alerts = []
+    def _build_index(self, signature: Tuple[int, int]):
+        path = self._generation_path(signature)
+        directory, base = os.path.split(os.path.abspath(self.index_filepath))
+        offsets = {}
+        fd, tmp_path = tempfile.mkstemp(prefix=f"{base}.build-", dir=directory) # Per-process name; workers may build concurrently
         try:
-            wait_days = self.policy.get("waiting_period_days", 30); policy_start = date_parse(self.policy.get("start_date", "1900-01-01")); claim_date = self.extracted["bill_date"] or datetime.now(); sum_insured = self.policy.get("sum_insured", float('inf'));
-            if (claim_date - policy_start).days < wait_days: alerts.append(f"Claim within {wait_days}-day waiting period")
-            if self.extracted["total_amount"] > sum_insured: alerts.append(f"Amount > Sum Insured (₹{sum_insured})")
-            if alerts: self.risk_score += 100; self.red_flags.append(f"Policy Fail: {'; '.join(alerts)}.");
-            self.detailed_analysis.append("Analysis (Rule 29): Checked policy compliance (Waiting Period, Sum Insured).")
-        except Exception as e: self.detailed_analysis.append(f"Analysis (Rule 29): ERROR during policy check - {e}")
+            with os.fdopen(fd, 'wb') as f:
+                f.write((self._index_header(signature) + "\n").encode('utf-8'))
+                for identifier, data in self._iter_source_records():
+                    if identifier in offsets: continue
+                    offsets[identifier] = f.tell()
+                    f.write(f"{identifier}\t{json.dumps(_simplify_abha_record(data))}\n".encode('utf-8'))
+            os.replace(tmp_path, path) # Same source version -> same bytes, so racing builders agree
+        except BaseException:
+            try: os.remove(tmp_path)
+            except OSError: pass
+            raise
+        self._index = (path, offsets)
+        for stale in glob.glob(f"{glob.escape(self.index_filepath)}.gen-*"):
+            if stale != path:
+                try: os.remove(stale) # Readers of it see a miss, reload and move to this generation
+                except OSError: pass
 
-    def _check_prescriber_authenticity(self): # Rule 14
-        reg_id = self.extracted["doc_reg_id"];
-        if not reg_id: self.detailed_analysis.append("Analysis (Rule 14): SKIPPED - Doctor Registration ID not found on PDF."); return;
-        doc_info = MOCK_MEDICAL_COUNCIL_DB.get(reg_id);
-        if not doc_info: self.risk_score += 10; self.red_flags.append(f"Authenticity Warn: Doctor's license ({reg_id}) could not be verified in Mock Council DB.")
-        elif doc_info.get("status") == "SUSPENDED": self.risk_score += 50; self.red_flags.append(f"Authenticity Fail: Doctor's license ({reg_id} - {doc_info.get('name')}) is SUSPENDED.")
-        self.detailed_analysis.append(f"Analysis (Rule 14): Checked doctor's license status ({reg_id}) via Mock Council DB.")
+    def ensure_loaded(self, force: bool = False):
+        """Loads the store on first use and reloads it if the source file changed (`force` skips the check interval)."""
+        now = time.monotonic()
+        if not force and self._signature is not None and now - self._last_check < self.reload_check_seconds:
+            return
+        with self._lock:
+            if not force and self._signature is not None and now - self._last_check < self.reload_check_seconds:
+                return
+            signature = self._source_signature()
+            self._last_check = now
+            if signature is None:
+                if self._signature is None:
+                    raise FileNotFoundError(f"ABHA database '{self.database_filepath}' not found.")
+                return # Keep serving the last good copy
+            if force or signature != self._signature:
+                self._load(signature)
 
-    def _check_provider_behavior(self): # Rule 7
-        provider = self.extracted["provider_name"];
-        if provider == "UNKNOWN": self.detailed_analysis.append("Analysis (Rule 7): SKIPPED - Provider name not clearly extracted from PDF."); return;
-        risk_data = MOCK_PROVIDER_RISK_DB.get(provider);
-        if not risk_data: self.risk_score += 5; self.red_flags.append(f"External Warn: Provider '{provider}' not found in Mock Risk DB.")
+    def get(self, identifier: str) -> Optional[dict]:
+        """Returns the simplified AbhaRecord dict for `identifier`, or None."""
+        self.ensure_loaded()
+        if not self.index_filepath:
+            return self._records.get(identifier)
+        for attempt in range(2):
+            path, offsets = self._index
+            offset = offsets.get(identifier)
+            if offset is None:
+                return None
+            try:
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    key, _, payload = f.readline().partition(b'\t')
+                if key.decode('utf-8', 'replace') == identifier:
+                    return json.loads(payload)
+            except (OSError, ValueError):
+                pass
+            self.ensure_loaded(force=True) # Index replaced underneath us (another worker rebuilt it); re-read once
+        return None
+
+    def __len__(self) -> int:
+        return len(self._index[1]) if self.index_filepath else len(self._records)
+
+
+ABHA_DB_PATH = os.getenv("ABHA_DB_PATH", "dummy_abha_database.json")
+ABHA_INDEX_PATH = os.getenv("ABHA_INDEX_PATH") or None
+_abha_stores: Dict[str, AbhaStore] = {}
+_abha_stores_lock = threading.Lock()
+
+def get_abha_store(database_filepath: str = ABHA_DB_PATH) -> AbhaStore:
+    """Returns the shared AbhaStore for a database file, creating it on first use."""
+    store = _abha_stores.get(database_filepath)
+    if store is None:
+        with _abha_stores_lock:
+            store = _abha_stores.get(database_filepath)
+            if store is None:
+                index_path = ABHA_INDEX_PATH if database_filepath == ABHA_DB_PATH else None
+                store = _abha_stores[database_filepath] = AbhaStore(database_filepath, index_path)
+    return store
+
+def get_simplified_abha_data(database_filepath: str, identifier: str) -> Optional[dict]:
+    try:
+        return get_abha_store(database_filepath).get(identifier)
+    except Exception as e:
+        print(f"Error reading/parsing dummy ABHA DB '{database_filepath}': {e}")
+        return None
+
+
+@app.on_event("startup")
+def load_abha_store():
+    if ABDM_BASE_URL: return # Records come from the ABDM service instead
+    try:
+        get_abha_store().ensure_loaded()
+    except Exception as e:
+        print(f"Warning: ABHA store not preloaded. {e}")
+
+
+# --- NEW: ABDM health-records client (pooled, batches concurrent lookups into bulk calls) ---
+ABDM_BASE_URL = os.getenv("ABDM_BASE_URL", "").rstrip("/") # e.g. http://localhost:5000; unset = read ABHA_DB_PATH
+ABDM_TIMEOUT = float(os.getenv("ABDM_TIMEOUT", "10"))
+ABDM_MAX_CONNECTIONS = int(os.getenv("ABDM_MAX_CONNECTIONS", "20"))
+ABDM_BATCH_MAX = int(os.getenv("ABDM_BATCH_MAX", "100")) # Identifiers per bulk call
+ABDM_BATCH_WINDOW_MS = float(os.getenv("ABDM_BATCH_WINDOW_MS", "5")) # How long the first lookup waits for others to join it
+
+class AbdmClient:
+    """
+    Looks up ABHA records from the ABDM service's bulk NDJSON endpoint.
+
+    Lookups made within `batch_window_ms` of each other are sent as one
+    POST /api/v1/health-records/bulk (at most `batch_max` identifiers; a full
+    batch goes out at once). Lines are matched to callers as they stream in and
+    simplified to the AbhaRecord layout. Concurrent lookups of one identifier share
+    a request. Calls run over a keep-alive, connection-pooled httpx.AsyncClient;
+    pass `client` (e.g. one built on httpx.MockTransport) to test against a stub.
+    """
+
+    BULK_PATH = "/api/v1/health-records/bulk"
+
+    def __init__(self, base_url: str, timeout: float = 10.0, max_connections: int = 20, batch_max: int = 100,
+                 batch_window_ms: float = 5.0, client: Optional["httpx.AsyncClient"] = None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.batch_max = max(1, batch_max)
+        self.batch_window = batch_window_ms / 1000
+        self._client = client
+        self._pending: Dict[str, "asyncio.Future"] = {} # Waiting for the next bulk call
+        self._inflight: Dict[str, "asyncio.Future"] = {} # Pending or already sent, not yet answered
+        self._flush_handle: Optional["asyncio.TimerHandle"] = None
+        self._batches: set = set()
+        self.stats = {"lookups": 0, "shared": 0, "batches": 0, "identifiers_sent": 0, "failed_batches": 0, "last_batch_ms": None}
+
+    @property
+    def client(self) -> "httpx.AsyncClient":
+        if self._client is None:
+            limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+            self._client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=limits)
+        return self._client
+
+    async def lookup(self, identifier: str) -> Optional[dict]:
+        """Returns the simplified AbhaRecord dict for `identifier`, or None if the service has no record for it."""
+        self.stats["lookups"] += 1
+        future = self._inflight.get(identifier)
+        if future is not None:
+            self.stats["shared"] += 1
         else:
-            provider_risk = risk_data.get("risk_score", 0);
-            if provider_risk > 80: self.risk_score += 30; self.red_flags.append(f"External Risk: Provider '{provider}' has a high fraud risk score ({provider_risk}).")
-            elif provider_risk > 50: self.risk_score += 15; self.red_flags.append(f"External Warn: Provider '{provider}' has moderate fraud risk ({provider_risk}).")
-        self.detailed_analysis.append(f"Analysis (Rule 7): Checked provider '{provider}' risk score via Mock Risk DB.")
-
-    def _check_outlier_pricing(self): # Rule 26
-        self.detailed_analysis.append("Analysis (Rule 26): SKIPPED - Outlier line-item pricing (requires detailed line item extraction & standard pricing DB).")
-
-    def _check_claim_frequency(self): # Rule 4
-        history = MOCK_USER_CLAIM_HISTORY_DB.get(self.abha.abha_id, []);
-        if not history or not self.extracted["bill_date"]: self.detailed_analysis.append("Analysis (Rule 4): Checked claim frequency (No prior history or bill date)."); return;
-        claims_in_last_month = 0; current_claim_date = self.extracted["bill_date"];
-        for claim in history:
-            try: past_claim_date = date_parse(claim["claim_date"], dayfirst=True);
-            if 0 < (current_claim_date - past_claim_date).days <= 30: claims_in_last_month += 1
-            except: continue
-        if claims_in_last_month >= 2: self.risk_score += 20; self.red_flags.append(f"History Risk: High claim frequency ({claims_in_last_month + 1} claims within ~30 days).");
-        self.detailed_analysis.append(f"Analysis (Rule 4): Checked claim frequency ({claims_in_last_month} other claims in ~30 days found in Mock History).")
-
-    def _check_previous_diagnosis_conflict(self): # Rule 12
-        abha_diags_str = " ".join(d.description.lower() for d in self.abha.past_diagnoses); pdf_diags_str = " ".join(self.extracted["diagnoses"]); is_unrelated = False
-        if "arthritis" in pdf_diags_str and "arthritis" not in abha_diags_str and "diabetes" in abha_diags_str: is_unrelated = True
-        if "cancer" in pdf_diags_str and "cancer" not in abha_diags_str and "hypertension" in abha_diags_str: is_unrelated = True
-        if is_unrelated: self.risk_score += 10; self.red_flags.append("History Warn: Claim diagnosis seems unrelated to known chronic conditions in ABHA.");
-        self.detailed_analysis.append("Analysis (Rule 12): Basic check for conflict between new claim and chronic history.")
+            loop = asyncio.get_running_loop()
+            future = self._inflight[identifier] = self._pending[identifier] = loop.create_future()
+            future.add_done_callback(functools.partial(self._answered, identifier))
+            if len(self._pending) >= self.batch_max:
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.batch_window, self._flush)
+        # Shielded so one caller timing out doesn't fail everyone waiting on the same identifier
+        return await asyncio.shield(future)
+
+    def _answered(self, identifier: str, future: "asyncio.Future"):
+        self._inflight.pop(identifier, None)
+        if not future.cancelled(): future.exception() # Mark it retrieved even if every caller gave up
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending: return
+        batch, self._pending = self._pending, {}
+        task = asyncio.ensure_future(self._send(batch))
+        self._batches.add(task)
+        task.add_done_callback(self._batches.discard)
 
-    def _check_medication_refill_velocity(self): # Rule 13
-        self.detailed_analysis.append("Analysis (Rule 13): SKIPPED - Medication refill velocity (needs historical prescription DB).")
+    async def _send(self, batch: Dict[str, "asyncio.Future"]):
+        self.stats["batches"] += 1
+        self.stats["identifiers_sent"] += len(batch)
+        start = time.perf_counter()
+        try:
+            async with self.client.stream("POST", self.BULK_PATH, json={"identifiers": list(batch)}) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.strip(): continue
+                    document = json.loads(line)
+                    data = (document.get("data") or {}) if isinstance(document, dict) else None
+                    if not isinstance(data, dict) or not isinstance(data.get("patient_info", {}), dict):
+                        raise ValueError(f"Malformed ABDM bulk response line: {line[:200]!r}")
+                    identifier = data.get("patient_info", {}).get("identifier") or document.get("identifier")
+                    future = batch.pop(identifier, None)
+                    if future is None or future.done(): continue
+                    future.set_result(_simplify_abha_record(data) if document.get("status") == "success" else None)
+            for future in batch.values(): # The service returned nothing for these
+                if not future.done(): future.set_result(None)
+        except Exception as e:
+            self.stats["failed_batches"] += 1
+            print(f"Error: ABDM bulk lookup of {len(batch)} identifier(s) failed: {e!r}")
+            for future in batch.values():
+                if not future.done(): future.set_exception(e)
+        finally:
+            self.stats["last_batch_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            for future in batch.values():
+                if not future.done(): future.cancel() # Only reached if this task itself was cancelled
 
-    def _check_document_tampering(self): # Rule 8
-        non_ascii_count = len(re.findall(r'[^\x00-\x7F\s]', self.pdf_text));
-        if non_ascii_count > 20: self.risk_score += 5; self.red_flags.append(f"Authenticity Warn (Tampering?): High count ({non_ascii_count}) of unusual characters found.");
-        self.detailed_analysis.append("Analysis (Rule 8): Basic check for signs of document tampering (unusual character count).")
+    def snapshot(self) -> dict:
+        batches = self.stats["batches"]
+        return {"base_url": self.base_url, **self.stats, "pending": len(self._pending), "inflight": len(self._inflight),
+                "mean_batch_size": round(self.stats["identifiers_sent"] / batches, 2) if batches else None}
 
-    def _check_duplicate_document(self): # Rule 10
-        file_hash = self.extracted["file_hash"];
-        if file_hash in MOCK_DUPLICATE_HASH_DB: self.risk_score += 100; self.red_flags.append(f"Authenticity Fail (Duplicate): Document hash {file_hash[:8]}... found in Mock DB (Claim {MOCK_DUPLICATE_HASH_DB[file_hash]}).")
-        self.detailed_analysis.append("Analysis (Rule 10): Checked document hash against Mock Duplicate DB.")
+    async def aclose(self):
+        self._flush()
+        if self._batches:
+            await asyncio.gather(*self._batches, return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
-    def _add_placeholders_for_other_rules(self):
-        skipped_rules = {9: "Geolocation consistency", 11: "Voice/video verification", 16: "Network graph analysis", 17: "Unusual payment flow", 18: "Incapacity vs. activity check", 21: "Imaging authenticity", 23: "Claim narrative similarity", 24: "Disease progression plausibility", 25: "Cross-product claims", 27: "Device fingerprinting", 28: "Social network/family claims"};
-        for rule_num, desc in skipped_rules.items(): self.detailed_analysis.append(f"Analysis (Rule {rule_num}): SKIPPED - {desc} (Requires external data or advanced analysis).")
-        self.detailed_analysis.append("Analysis (Rule 30): PASSED - Explainability provided via this detailed analysis.")
 
-    # --- End copy ---
+abdm_client = AbdmClient(ABDM_BASE_URL, timeout=ABDM_TIMEOUT, max_connections=ABDM_MAX_CONNECTIONS,
+                         batch_max=ABDM_BATCH_MAX, batch_window_ms=ABDM_BATCH_WINDOW_MS) if ABDM_BASE_URL else None
 
 
-# --- Helper Function 4: Groq AI (Updated Prompt) ---
-def get_ai_score_and_reasoning(
-    pre_risk_score: int,
-    detailed_analysis: List[str],
-    red_flags: List[str],
-    extracted_data: Dict[str, Any]
-) -> Tuple[int, str, str]:
+async def lookup_abha_record(identifier: str) -> Optional[dict]:
+    """Simplified AbhaRecord dict for `identifier` from the ABDM service if ABDM_BASE_URL is set, else from the local ABHA database."""
+    if abdm_client is None:
+        return await asyncio.to_thread(get_simplified_abha_data, ABHA_DB_PATH, identifier)
+    try:
+        return await abdm_client.lookup(identifier)
+    except httpx.TimeoutException as e:
+        raise HTTPException(status_code=504, detail=f"Timeout looking up ABHA Identifier '{identifier}' at ABDM: {e!r}")
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=503, detail=f"Could not look up ABHA Identifier '{identifier}' at ABDM: {e!r}")
+    except (ValueError, KeyError) as e: # Garbled or truncated NDJSON from the service
+        raise HTTPException(status_code=502, detail=f"Invalid response from ABDM for ABHA Identifier '{identifier}': {e!r}")
 
-    if not client:
-        rec = "PENDING REVIEW"; score = pre_risk_score
-        if pre_risk_score >= 100 or any("Fail" in flag for flag in red_flags): rec = "REJECT"; score = max(score, 85)
-        elif pre_risk_score == 0 and not red_flags: rec = "APPROVE"; score = min(score, 25)
-        return score, "AI Error: Client not initialized. Recommendation based on rule score.", rec
 
-    prompt = f"""
-    Analyze the insurance claim based on the Rule Engine's findings. Provide a final aggregate_score (0-100), reasoning, and recommendation ('APPROVE', 'REJECT', 'PENDING REVIEW').
+@app.get("/abdm")
+def abdm_client_stats():
+    if abdm_client is None:
+        return {"enabled": False, "source": ABHA_DB_PATH}
+    return {"enabled": True, **abdm_client.snapshot()}
+
 
-    **Scoring Guide (Low Score = Good):**
-    * 0-30: APPROVE (Low risk)
-    * 31-70: PENDING REVIEW (Moderate risk or requires human check)
-    * 71-100: REJECT (High risk or rule failures)
+@app.on_event("shutdown")
+async def close_abdm_client():
+    if abdm_client is not None:
+        await abdm_client.aclose()
 
-    **Input Data:**
-    1.  **Rule Engine Risk Score:** {pre_risk_score} (0=Low, 100+=Very High)
-    2.  **Red Flags Found:** {json.dumps(red_flags)}
-    3.  **Extracted PDF Data:** {json.dumps(extracted_data, default=str)}
-    4.  **Rule Analysis Steps:** (Review for context, includes SKIPPED rules)
 
-    **Your Task:**
-    1.  **Cost Plausibility:** Assess if the 'total_amount' (₹{extracted_data.get('total_amount', 0)}) is reasonable for the primary 'diagnosis' ('{extracted_data.get('diagnoses', ["N/A"])[0]}'). Use general medical cost knowledge. Add this to your reasoning.
-    2.  **Recommendation Logic:**
-        * If any "Fail" (Identity Fail, Logic Fail, Policy Fail, Authenticity Fail) red flags exist OR pre_risk_score >= 100: Recommend REJECT.
-        * If pre_risk_score == 0 AND there are NO red flags AND cost seems plausible: Recommend APPROVE.
-        * Otherwise (Warn flags, History Mismatch, External Risk/Warn, cost seems slightly high/low): Recommend PENDING REVIEW.
-    3.  **Final Score:** Assign a score (0-100) consistent with your recommendation.
-    4.  **Reasoning:** Summarize the key factors (especially red flags and cost plausibility) driving your recommendation. Mention skipped rules if relevant.
+# --- NEW: Duplicate document index (Bloom filter front + SQLite store, shared across processes) ---
+# Stores that must outlive restarts (and caches whose contents are trusted on read) default under DATA_DIR, not the shared temp dir
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+DUPLICATE_INDEX_ENABLED = os.getenv("DUPLICATE_INDEX_ENABLED", "true").lower() in ("1", "true", "yes")
+DUPLICATE_INDEX_PATH = os.getenv("DUPLICATE_INDEX_PATH", os.path.join(DATA_DIR, "doc-hashes"))
+DUPLICATE_INDEX_CAPACITY = int(os.getenv("DUPLICATE_INDEX_CAPACITY", "10000000")) # Sizes the Bloom filter (~18 MB at 0.1%)
+DUPLICATE_INDEX_FP_RATE = float(os.getenv("DUPLICATE_INDEX_FP_RATE", "0.001"))
+_BLOOM_HEADER = struct.Struct("<8sQIIQ") # magic, bit count, hash count, reserved, items added
+_BLOOM_MAGIC = b"TLBLOOM1"
 
-    **Output (JSON only):**
-    {{"aggregate_score": <score>, "reasoning": "<your_summary>", "recommendation": "<RECOMMENDATION>"}}
+class BloomFilter:
     """
+    Bloom filter over SHA-256 digests, stored in a memory-mapped file.
 
-    try:
-        chat_completion = client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model="llama-3.1-8b-instant", # Use current model
-            response_format={"type": "json_object"},
-            temperature=0.1,
-            max_tokens=400 # Increased token limit for more detailed reasoning
-        )
-        response_content = chat_completion.choices[0].message.content
-        response_json = json.loads(response_content)
+    Every process maps the same file, so bits set by one process are seen by
+    the others without reloading. Positions come from double hashing two
+    64-bit slices of the digest, which is already uniformly distributed.
+    """
 
-        rec = response_json.get("recommendation", "REJECT").upper()
-        score = int(response_json.get("aggregate_score", 99))
-        reason = response_json.get("reasoning", "AI did not provide reasoning.")
+    def __init__(self, path: str, capacity: int, fp_rate: float):
+        self.path = path
+        self.created = False
+        if not self._valid_file():
+            bits = max(512, int(-capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+            bits = (bits + 7) // 8 * 8
+            hashes = max(1, round(bits / max(1, capacity) * math.log(2)))
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(_BLOOM_HEADER.pack(_BLOOM_MAGIC, bits, hashes, 0, 0))
+                f.truncate(_BLOOM_HEADER.size + bits // 8)
+            os.replace(tmp_path, path)
+            self.created = True
+        self._file = open(path, "r+b")
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+        _, self.bits, self.hashes, _, _ = _BLOOM_HEADER.unpack_from(self._mm, 0)
 
-        # Adjust score to fit recommendation range if AI output is inconsistent
-        if rec == "APPROVE" and score > 30: score = 25
-        elif rec == "PENDING REVIEW" and (score < 31 or score > 70): score = 50
-        elif rec == "REJECT" and score < 71: score = 85
+    def _valid_file(self) -> bool:
+        try:
+            with open(self.path, "rb") as f:
+                magic, bits, hashes, _, _ = _BLOOM_HEADER.unpack(f.read(_BLOOM_HEADER.size))
+                return magic == _BLOOM_MAGIC and hashes > 0 and os.fstat(f.fileno()).st_size == _BLOOM_HEADER.size + bits // 8
+        except (OSError, struct.error):
+            return False
 
-        return score, reason, rec
+    def _positions(self, digest: bytes) -> List[int]:
+        h1 = int.from_bytes(digest[:8], "little"); h2 = int.from_bytes(digest[8:16], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
 
-    except Exception as e:
-        print(f"Groq API error: {e}")
-        rec = "PENDING REVIEW"
-        if pre_risk_score >= 100 or any("Fail" in flag for flag in red_flags): rec = "REJECT"
-        elif pre_risk_score == 0 and not red_flags: rec = "APPROVE"
-        # Return pre_risk_score if AI fails, clamped to 0-100
-        fail_score = max(0, min(100, pre_risk_score))
-        return fail_score, f"AI Error: {e}. Recommendation based on rule score.", rec
+    def __contains__(self, digest: bytes) -> bool:
+        mm, base = self._mm, _BLOOM_HEADER.size
+        return all(mm[base + (p >> 3)] & (1 << (p & 7)) for p in self._positions(digest))
 
+    def add(self, digest: bytes):
+        """Sets the digest's bits. Callers serialize writers (see DuplicateHashIndex._writer)."""
+        mm, base = self._mm, _BLOOM_HEADER.size
+        for p in self._positions(digest):
+            mm[base + (p >> 3)] |= 1 << (p & 7)
 
-# --- MAIN API ENDPOINT ---
-@app.post("/verify-claim/")
-# MODIFIED: Accepts JSON input via ClaimRequest model
-async def verify_claim(request: ClaimRequest):
-    print(f"Received request for ABHA ID: {request.abha_identifier}, IPFS Hash: {request.ipfs_hash}")
-    try:
-        # Step 1: Fetch PDF from IPFS
-        pdf_content = fetch_pdf_from_ipfs(request.ipfs_hash)
+    @property
+    def items(self) -> int:
+        return _BLOOM_HEADER.unpack_from(self._mm, 0)[4]
 
-        # Step 2: Fetch ABHA data using identifier
-        simplified_abha_dict = get_simplified_abha_data("dummy_abha_database.json", request.abha_identifier)
+    def add_items(self, count: int):
+        magic, bits, hashes, reserved, items = _BLOOM_HEADER.unpack_from(self._mm, 0)
+        _BLOOM_HEADER.pack_into(self._mm, 0, magic, bits, hashes, reserved, items + count)
 
-        if not simplified_abha_dict:
-            print(f"Error: ABHA Identifier '{request.abha_identifier}' not found.")
-            raise HTTPException(status_code=404, detail=f"ABHA Identifier '{request.abha_identifier}' not found.")
+    def estimated_fp_rate(self) -> float:
+        return (1 - math.exp(-self.hashes * self.items / self.bits)) ** self.hashes
 
-        abha_data = AbhaRecord(**simplified_abha_dict)
-        print(f"Successfully fetched and parsed ABHA data for {abha_data.name}.")
+    def flush(self):
+        self._mm.flush()
 
-    except HTTPException as e:
-        raise e # Re-raise HTTP exceptions from helpers
-    except Exception as e:
-        print(f"Error during input processing: {e}")
-        raise HTTPException(status_code=400, detail=f"Invalid Input or DB Error: {e}")
 
-    # Step 3: Run Rule Engine
-    try:
-        print("Initializing Rule Engine...")
-        engine = RuleEngine(pdf_content, abha_data)
-        print("Running all checks...")
-        pre_risk_score, detailed_analysis, red_flags = engine.run_all_checks()
-        print(f"Rule Engine finished. Pre-risk score: {pre_risk_score}, Red Flags: {len(red_flags)}")
-    except ValueError as e: # Catch PDF text extraction error specifically
-        print(f"Error: Rule Engine failed on PDF extraction: {e}")
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        print(f"Error: Unexpected error during rule execution: {e}")
-        # Consider logging the full traceback here for debugging
-        raise HTTPException(status_code=500, detail=f"Error during rule execution: {e}")
+class SharedSqliteStore:
+    """
+    SQLite file shared by every worker process.
 
-    # Step 4: Get AI Score
-    print("Getting AI score and reasoning...")
-    final_score, final_reasoning, final_recommendation = get_ai_score_and_reasoning(
-        pre_risk_score, detailed_analysis, red_flags, engine.extracted
-    )
-    print(f"AI Result - Score: {final_score}, Recommendation: {final_recommendation}")
+    Each thread gets its own WAL-mode connection (reopened after a fork).
+    Writers hold a thread lock and an flock on `<path>.lock`, so one process
+    writes at a time while others keep reading.
+    """
 
+    def __init__(self, path: str):
+        self.db_path = f"{path}.sqlite"
+        self.lock_path = f"{path}.lock"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        self._thread_lock = threading.Lock()
 
-    # Step 5: Final consistency check based on hard failures
-    hard_failure = pre_risk_score >= 100 or any("Fail" in flag for flag in red_flags)
-    if hard_failure and final_recommendation != "REJECT":
-        print(f"Overriding AI recommendation. Hard failure detected (Score: {pre_risk_score}, Flags: {red_flags})")
-        final_score = max(final_score, 85) # Ensure reject score
-        final_recommendation = "REJECT"
-        final_reasoning = f"[AUTO-REJECTED due to hard rule failure]. AI Reason: {final_reasoning}"
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid(): # SQLite connections must not cross a fork
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL"); conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    @contextmanager
+    def _writer(self):
+        with self._thread_lock, open(self.lock_path, "a") as lock_file:
+            if fcntl is not None: fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None: fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class DuplicateHashIndex(SharedSqliteStore):
+    """
+    Persistent set of document SHA-256 hashes seen in verified or imported claims.
+
+    Lookups check the shared Bloom filter first, so the common "never seen"
+    case is answered without touching disk. Possible hits are confirmed in
+    SQLite (WAL mode: many reader processes, one writer at a time). Writers hold
+    an flock on `<path>.lock` and set Bloom bits before committing rows. The
+    filter is therefore always a superset of the table and never gives a false
+    negative. A missing or damaged filter file is rebuilt from the table.
+    """
+
+    def __init__(self, path: str, capacity: int = 10000000, fp_rate: float = 0.001):
+        super().__init__(path)
+        self.bloom_path = f"{path}.bloom"
+        self.counters = {"lookups": 0, "bloom_negatives": 0, "confirmed": 0, "bloom_false_positives": 0, "added": 0, "invalid": 0}
+        with self._writer():
+            self._conn().execute("CREATE TABLE IF NOT EXISTS doc_hashes (hash BLOB PRIMARY KEY, abha_id TEXT, claim_ref TEXT, first_seen REAL) WITHOUT ROWID")
+            self.bloom = BloomFilter(self.bloom_path, capacity, fp_rate)
+            if self.bloom.created:
+                self._rebuild_bloom()
+
+    def _rebuild_bloom(self):
+        cursor = self._conn().execute("SELECT hash FROM doc_hashes")
+        count = 0
+        while True:
+            rows = cursor.fetchmany(100000)
+            if not rows: break
+            for (digest,) in rows: self.bloom.add(digest)
+            count += len(rows)
+        self.bloom.add_items(count); self.bloom.flush()
+        if count: print(f"Rebuilt duplicate-index Bloom filter from {count} stored hashes.")
+
+    def lookup(self, file_hash: str) -> Optional[Tuple[Optional[str], Optional[str], float]]:
+        """Returns (abha_id, claim_ref, first_seen) if the hash was seen before, else None."""
+        self.counters["lookups"] += 1
+        try: digest = bytes.fromhex(file_hash)
+        except ValueError: return None
+        if digest not in self.bloom:
+            self.counters["bloom_negatives"] += 1
+            return None
+        row = self._conn().execute("SELECT abha_id, claim_ref, first_seen FROM doc_hashes WHERE hash = ?", (digest,)).fetchone()
+        self.counters["confirmed" if row else "bloom_false_positives"] += 1
+        return row
+
+    def add_many(self, entries: Iterable[Tuple[str, Optional[str], Optional[str]]], batch_size: int = 50000) -> int:
+        """Records (sha256 hex, abha_id, claim_ref) entries in batches; returns how many were new."""
+        added, batch, now = 0, [], time.time()
+        for file_hash, abha_id, claim_ref in entries:
+            try: digest = bytes.fromhex(file_hash.strip())
+            except (AttributeError, ValueError): digest = b""
+            if len(digest) != 32:
+                self.counters["invalid"] += 1; continue
+            batch.append((digest, abha_id, claim_ref, now))
+            if len(batch) >= batch_size:
+                added += self._write(batch); batch = []
+        if batch: added += self._write(batch)
+        return added
+
+    def _write(self, rows: List[tuple]) -> int:
+        with self._writer():
+            for row in rows: self.bloom.add(row[0]) # Before the commit: the filter must never miss a stored hash
+            self.bloom.flush()
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                before = conn.total_changes
+                conn.executemany("INSERT OR IGNORE INTO doc_hashes (hash, abha_id, claim_ref, first_seen) VALUES (?, ?, ?, ?)", rows)
+                added = conn.total_changes - before
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self.bloom.add_items(added)
+        self.counters["added"] += added
+        return added
+
+    def add(self, file_hash: str, abha_id: Optional[str] = None, claim_ref: Optional[str] = None) -> bool:
+        return self.add_many([(file_hash, abha_id, claim_ref)]) == 1
+
+    def stats(self) -> dict:
+        return {**self.counters, "items": self.bloom.items, "bloom_bits": self.bloom.bits, "bloom_hashes": self.bloom.hashes,
+                "bloom_bytes": self.bloom.bits // 8, "estimated_fp_rate": self.bloom.estimated_fp_rate(), "db_path": self.db_path}
+
+
+def _iter_hash_import(lines: Iterable[str]) -> Iterator[Tuple[str, Optional[str], Optional[str]]]:
+    """Parses bulk-import lines: NDJSON {"hash", "abha_id", "claim_ref"} or CSV `hash[,claim_ref[,abha_id]]`."""
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"): continue
+        if line.startswith("{"):
+            try: item = json.loads(line)
+            except ValueError: item = {}
+            yield str(item.get("hash", "")), item.get("abha_id"), item.get("claim_ref")
+        else:
+            parts = [p.strip() for p in line.split(",")]
+            yield parts[0], (parts[2] if len(parts) > 2 else None) or None, (parts[1] if len(parts) > 1 else None) or None
+
+
+_duplicate_index: Optional[DuplicateHashIndex] = None
+_duplicate_index_lock = threading.Lock()
+
+def get_duplicate_index() -> Optional[DuplicateHashIndex]:
+    """Opens this process's handle on the shared duplicate index on first use; None if disabled or unavailable."""
+    global _duplicate_index
+    if _duplicate_index is None and DUPLICATE_INDEX_ENABLED:
+        with _duplicate_index_lock:
+            if _duplicate_index is None:
+                try:
+                    _duplicate_index = DuplicateHashIndex(DUPLICATE_INDEX_PATH, DUPLICATE_INDEX_CAPACITY, DUPLICATE_INDEX_FP_RATE)
+                except (OSError, sqlite3.Error) as e:
+                    print(f"Warning: Duplicate document index unavailable: {e}")
+                    return None
+    return _duplicate_index
+
+
+@app.on_event("startup")
+async def open_duplicate_index():
+    await asyncio.to_thread(get_duplicate_index) # Rebuilds a missing Bloom filter before the first claim
+
+
+@app.get("/duplicates")
+def get_duplicate_index_stats():
+    index = get_duplicate_index()
+    return {"enabled": index is not None, **(index.stats() if index else {})}
+
+
+# --- NEW: Near-duplicate bill index (MinHash signatures + LSH bands in SQLite) ---
+NEAR_DUP_ENABLED = os.getenv("NEAR_DUP_ENABLED", "true").lower() in ("1", "true", "yes")
+NEAR_DUP_PATH = os.getenv("NEAR_DUP_PATH", os.path.join(DATA_DIR, "near-dup"))
+NEAR_DUP_BANDS = int(os.getenv("NEAR_DUP_BANDS", "8"))
+NEAR_DUP_ROWS = int(os.getenv("NEAR_DUP_ROWS", "8")) # 8 x 8: ~92% chance to surface a 0.85-similar bill, ~3% at 0.5
+NEAR_DUP_SHINGLE_WORDS = int(os.getenv("NEAR_DUP_SHINGLE_WORDS", "5"))
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.85"))
+NEAR_DUP_MAX_DOCS = int(os.getenv("NEAR_DUP_MAX_DOCS", "200000")) # Oldest signatures are evicted beyond this (~500 bytes each)
+NEAR_DUP_MAX_CANDIDATES = int(os.getenv("NEAR_DUP_MAX_CANDIDATES", "500"))
+NEAR_DUP_TOP_K = int(os.getenv("NEAR_DUP_TOP_K", "3"))
+_MINHASH_SEED = 0x7A11
+_MINHASH_CHUNK = 4096
+_SHINGLE_WORD_RE = re.compile(r"\w+")
+_FNV_PRIME = np.uint64(1099511628211)
+
+@functools.lru_cache(maxsize=None)
+def _minhash_permutations(count: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Fixed-seed (a, b) pairs for h(x) = a*x + b mod 2^64; a is odd so each one is a bijection."""
+    rng = np.random.default_rng(_MINHASH_SEED)
+    a = rng.integers(0, np.iinfo(np.uint64).max, size=count, dtype=np.uint64, endpoint=True) | np.uint64(1)
+    b = rng.integers(0, np.iinfo(np.uint64).max, size=count, dtype=np.uint64, endpoint=True)
+    return a, b
+
+def shingle_hashes(text: str, words: int = NEAR_DUP_SHINGLE_WORDS) -> np.ndarray:
+    """Distinct 64-bit hashes of the lower-cased word n-grams of `text`."""
+    tokens = _SHINGLE_WORD_RE.findall(text.lower())
+    if not tokens: return np.empty(0, dtype=np.uint64)
+    vocabulary = {t: int.from_bytes(hashlib.blake2b(t.encode(), digest_size=8).digest(), "little") for t in set(tokens)}
+    token_hashes = np.fromiter((vocabulary[t] for t in tokens), dtype=np.uint64, count=len(tokens))
+    words = min(words, len(tokens)); count = len(tokens) - words + 1
+    shingles = token_hashes[:count].copy()
+    for offset in range(1, words): # FNV-style combine; uint64 arithmetic wraps
+        shingles = shingles * _FNV_PRIME ^ token_hashes[offset:offset + count]
+    return np.unique(shingles)
+
+def minhash_signature(text: str, permutations: int = NEAR_DUP_BANDS * NEAR_DUP_ROWS) -> Optional[np.ndarray]:
+    """uint32 MinHash signature of the text's shingle set, or None if it has no words."""
+    shingles = shingle_hashes(text)
+    if not shingles.size: return None
+    a, b = _minhash_permutations(permutations)
+    signature = np.full(permutations, np.iinfo(np.uint32).max, dtype=np.uint32)
+    for start in range(0, shingles.size, _MINHASH_CHUNK): # Bounds the (shingles x permutations) matrix
+        chunk = shingles[start:start + _MINHASH_CHUNK, None]
+        np.minimum(signature, ((chunk * a + b) >> np.uint64(32)).astype(np.uint32).min(axis=0), out=signature)
+    return signature
+
+
+class NearDuplicateIndex(SharedSqliteStore):
+    """
+    MinHash/LSH index of the bill text of verified claims.
+
+    Signatures are split into bands; two bills sharing any band bucket become
+    candidates, so a query reads a few index rows instead of scanning every
+    stored bill. Candidates are ranked by the fraction of equal signature
+    entries, an estimate of shingle Jaccard similarity. Storage is capped at
+    `max_docs`: the oldest signatures are evicted first.
+    """
+
+    def __init__(self, path: str, bands: int = 8, rows: int = 8, max_docs: int = 200000):
+        super().__init__(path)
+        self.bands, self.rows, self.max_docs = bands, rows, max_docs
+        self.permutations = bands * rows
+        self.counters = {"queries": 0, "candidates": 0, "added": 0, "evicted": 0}
+        a, b = _minhash_permutations(self.permutations)
+        params = f"{bands}x{rows}/{NEAR_DUP_SHINGLE_WORDS}w/{hashlib.sha256(a.tobytes() + b.tobytes()).hexdigest()[:16]}"
+        with self._writer():
+            conn = self._conn()
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE IF NOT EXISTS docs (doc_id INTEGER PRIMARY KEY, abha_id TEXT, file_hash TEXT, added REAL, signature BLOB, UNIQUE (file_hash, abha_id));
+                CREATE TABLE IF NOT EXISTS bands (band INTEGER, bucket INTEGER, doc_id INTEGER, PRIMARY KEY (band, bucket, doc_id)) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS bands_doc ON bands (doc_id);
+            """)
+            stored = conn.execute("SELECT value FROM meta WHERE key = 'params'").fetchone()
+            if stored and stored[0] != params: # Signatures from other parameters are not comparable
+                print(f"Near-duplicate index parameters changed ({stored[0]} -> {params}); clearing stored signatures.")
+                conn.executescript("DELETE FROM bands; DELETE FROM docs;")
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('params', ?)", (params,))
+
+    def _band_keys(self, signature: np.ndarray) -> List[Tuple[int, int]]:
+        rows = signature.reshape(self.bands, self.rows)
+        return [(band, int.from_bytes(hashlib.blake2b(rows[band].tobytes(), digest_size=8).digest(), "little", signed=True)) for band in range(self.bands)]
+
+    def query(self, signature: np.ndarray, file_hash: Optional[str] = None, top_k: int = 3) -> List[Tuple[float, Optional[str], Optional[str], float]]:
+        """Returns up to `top_k` (similarity, abha_id, file_hash, added) for stored bills, most similar first. Exact copies of `file_hash` are skipped (Rule 10 covers those)."""
+        self.counters["queries"] += 1
+        conn = self._conn(); keys = self._band_keys(signature)
+        doc_ids = [row[0] for row in conn.execute(
+            f"SELECT DISTINCT doc_id FROM bands WHERE {' OR '.join(['(band = ? AND bucket = ?)'] * len(keys))} LIMIT ?",
+            [v for key in keys for v in key] + [NEAR_DUP_MAX_CANDIDATES])]
+        if not doc_ids: return []
+        rows = conn.execute(f"SELECT abha_id, file_hash, added, signature FROM docs WHERE doc_id IN ({','.join('?' * len(doc_ids))})", doc_ids).fetchall()
+        rows = [row for row in rows if file_hash is None or row[1] != file_hash]
+        self.counters["candidates"] += len(rows)
+        if not rows: return []
+        stored = np.frombuffer(b"".join(row[3] for row in rows), dtype=np.uint32).reshape(len(rows), self.permutations)
+        similarity = (stored == signature).mean(axis=1)
+        best = np.argsort(-similarity, kind="stable")[:top_k]
+        return [(float(similarity[i]), rows[i][0], rows[i][1], rows[i][2]) for i in best]
+
+    def add(self, signature: Any, abha_id: Optional[str] = None, file_hash: Optional[str] = None) -> bool:
+        """Stores one bill's signature (array or raw bytes); returns False if this patient's copy of the file is already stored."""
+        signature = np.frombuffer(signature, dtype=np.uint32) if isinstance(signature, bytes) else signature
+        if signature.size != self.permutations: raise ValueError(f"Expected a {self.permutations}-entry MinHash signature, got {signature.size}.")
+        with self._writer():
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = conn.execute("INSERT OR IGNORE INTO docs (abha_id, file_hash, added, signature) VALUES (?, ?, ?, ?)",
+                                      (abha_id, file_hash, time.time(), signature.astype(np.uint32).tobytes()))
+                added = cursor.rowcount == 1
+                if added:
+                    conn.executemany("INSERT OR IGNORE INTO bands (band, bucket, doc_id) VALUES (?, ?, ?)",
+                                     [(band, bucket, cursor.lastrowid) for band, bucket in self._band_keys(signature)])
+                    self._evict(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        self.counters["added"] += added
+        return added
+
+    def _evict(self, conn: sqlite3.Connection):
+        # doc_ids are assigned in order and only the oldest are deleted, so MAX - MIN + 1 is the row count
+        low, high = conn.execute("SELECT MIN(doc_id), MAX(doc_id) FROM docs").fetchone()
+        excess = high - low + 1 - self.max_docs
+        if excess > 0:
+            conn.execute("DELETE FROM bands WHERE doc_id < ?", (low + excess,))
+            conn.execute("DELETE FROM docs WHERE doc_id < ?", (low + excess,))
+            self.counters["evicted"] += excess
+
+    def count(self) -> int:
+        low, high = self._conn().execute("SELECT MIN(doc_id), MAX(doc_id) FROM docs").fetchone()
+        return high - low + 1 if high is not None else 0
+
+    def stats(self) -> dict:
+        return {**self.counters, "docs": self.count(), "max_docs": self.max_docs, "bands": self.bands, "rows": self.rows,
+                "threshold": NEAR_DUP_THRESHOLD, "candidate_probability_at_threshold": 1 - (1 - NEAR_DUP_THRESHOLD ** self.rows) ** self.bands,
+                "db_path": self.db_path}
+
+
+_near_duplicate_index: Optional[NearDuplicateIndex] = None
+_near_duplicate_index_lock = threading.Lock()
+
+def get_near_duplicate_index() -> Optional[NearDuplicateIndex]:
+    """Opens this process's handle on the shared near-duplicate index on first use; None if disabled or unavailable."""
+    global _near_duplicate_index
+    if _near_duplicate_index is None and NEAR_DUP_ENABLED:
+        with _near_duplicate_index_lock:
+            if _near_duplicate_index is None:
+                try:
+                    _near_duplicate_index = NearDuplicateIndex(NEAR_DUP_PATH, NEAR_DUP_BANDS, NEAR_DUP_ROWS, NEAR_DUP_MAX_DOCS)
+                except (OSError, sqlite3.Error) as e:
+                    print(f"Warning: Near-duplicate index unavailable: {e}")
+                    return None
+    return _near_duplicate_index
+
+
+@app.get("/near-duplicates")
+def get_near_duplicate_index_stats():
+    index = get_near_duplicate_index()
+    return {"enabled": index is not None, **(index.stats() if index else {})}
+
+
+# --- NEW: Claim history store (per-patient sorted day arrays over a shared SQLite log) ---
+CLAIM_HISTORY_ENABLED = os.getenv("CLAIM_HISTORY_ENABLED", "true").lower() in ("1", "true", "yes")
+CLAIM_HISTORY_PATH = os.getenv("CLAIM_HISTORY_PATH", os.path.join(DATA_DIR, "claim-history"))
+CLAIM_HISTORY_CACHE_PATIENTS = int(os.getenv("CLAIM_HISTORY_CACHE_PATIENTS", "50000")) # Patients kept as in-memory arrays (LRU)
+CLAIM_FREQUENCY_WINDOW_DAYS = int(os.getenv("CLAIM_FREQUENCY_WINDOW_DAYS", "30"))
+REFILL_MIN_DAYS = int(os.getenv("REFILL_MIN_DAYS", "15")) # Earliest plausible refill when there is only one prior fill
+REFILL_EARLY_FRACTION = float(os.getenv("REFILL_EARLY_FRACTION", "0.5")) # ...else: earlier than this fraction of the usual interval
+
+
+class _PatientHistory:
+    """One patient's history as sorted ordinal-day arrays: claims (with amounts) and fills per drug."""
+
+    __slots__ = ("claim_days", "claim_amounts", "fill_days")
+
+    def __init__(self):
+        self.claim_days = np.empty(0, dtype=np.int32)
+        self.claim_amounts = np.empty(0, dtype=np.float64)
+        self.fill_days: Dict[str, np.ndarray] = {}
+
+    def add(self, day: int, amount: Optional[float], drug: Optional[str]):
+        if drug is None:
+            i = int(np.searchsorted(self.claim_days, day, side="right")) # Appends land at the end; backdated bills are inserted
+            self.claim_days = np.insert(self.claim_days, i, day)
+            self.claim_amounts = np.insert(self.claim_amounts, i, amount or 0.0)
+        else:
+            days = self.fill_days.get(drug, np.empty(0, dtype=np.int32))
+            self.fill_days[drug] = np.insert(days, int(np.searchsorted(days, day, side="right")), day)
+
+
+class ClaimHistoryStore(SharedSqliteStore):
+    """
+    Claim and prescription history of every verified claim.
+
+    All processes append to one SQLite log. Each process keeps recently used
+    patients as sorted NumPy day arrays, so range questions such as "claims in
+    the last N days" are answered with `searchsorted` instead of re-parsing
+    dates. Before each query the process reads log rows added since its last
+    look (normally none), so appends from other workers are seen.
+    """
+
+    def __init__(self, path: str, cache_patients: int = 50000, seed: Optional[Dict[str, List[dict]]] = None):
+        super().__init__(path)
+        self.cache_patients = cache_patients
+        self._patients: "OrderedDict[str, _PatientHistory]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._seen_seq = 0
+        self.counters = {"queries": 0, "patient_loads": 0, "synced_rows": 0, "claims_added": 0, "duplicates_skipped": 0}
+        with self._writer():
+            conn = self._conn()
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE IF NOT EXISTS history (seq INTEGER PRIMARY KEY, abha_id TEXT NOT NULL, day INTEGER NOT NULL, amount REAL, drug TEXT, file_hash TEXT);
+                CREATE INDEX IF NOT EXISTS history_patient ON history (abha_id, file_hash);
+            """)
+            if seed and not conn.execute("SELECT 1 FROM meta WHERE key = 'seeded'").fetchone():
+                rows = []
+                for abha_id, claims in seed.items():
+                    for claim in claims:
+                        try: rows.append((abha_id, date_parse(claim["claim_date"], dayfirst=True).toordinal(), claim.get("amount"), None, None))
+                        except (KeyError, ValueError, OverflowError): continue
+                conn.executemany("INSERT INTO history (abha_id, day, amount, drug, file_hash) VALUES (?, ?, ?, ?, ?)", rows)
+                conn.execute("INSERT INTO meta (key, value) VALUES ('seeded', ?)", (str(len(rows)),))
+            self._seen_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM history").fetchone()[0]
+
+    def _sync(self, conn: sqlite3.Connection):
+        """Applies rows other processes appended since the last look to the patients held in memory."""
+        rows = conn.execute("SELECT seq, abha_id, day, amount, drug FROM history WHERE seq > ? ORDER BY seq", (self._seen_seq,)).fetchall()
+        for seq, abha_id, day, amount, drug in rows:
+            patient = self._patients.get(abha_id) # Patients not in memory pick the row up when they are loaded
+            if patient is not None: patient.add(day, amount, drug)
+            self._seen_seq = seq
+        self.counters["synced_rows"] += len(rows)
+
+    def _patient(self, abha_id: str) -> _PatientHistory:
+        conn = self._conn()
+        with self._cache_lock:
+            self._sync(conn)
+            patient = self._patients.get(abha_id)
+            if patient is not None:
+                self._patients.move_to_end(abha_id)
+                return patient
+            rows = conn.execute("SELECT day, amount, drug FROM history WHERE abha_id = ? AND seq <= ?", (abha_id, self._seen_seq)).fetchall()
+            patient = _PatientHistory()
+            claims = sorted((day, amount or 0.0) for day, amount, drug in rows if drug is None)
+            patient.claim_days = np.array([c[0] for c in claims], dtype=np.int32)
+            patient.claim_amounts = np.array([c[1] for c in claims], dtype=np.float64)
+            fills: Dict[str, List[int]] = {}
+            for day, _, drug in rows:
+                if drug is not None: fills.setdefault(drug, []).append(day)
+            patient.fill_days = {drug: np.sort(np.array(days, dtype=np.int32)) for drug, days in fills.items()}
+            self._patients[abha_id] = patient
+            if len(self._patients) > self.cache_patients: self._patients.popitem(last=False)
+            self.counters["patient_loads"] += 1
+            return patient
+
+    def claims_between(self, abha_id: str, start: datetime, end: datetime) -> Tuple[int, float]:
+        """(count, total amount) of the patient's claims billed on days in [start, end]."""
+        self.counters["queries"] += 1
+        patient = self._patient(abha_id)
+        lo = np.searchsorted(patient.claim_days, start.toordinal(), side="left")
+        hi = np.searchsorted(patient.claim_days, end.toordinal(), side="right")
+        return int(hi - lo), float(patient.claim_amounts[lo:hi].sum())
+
+    def fill_days_before(self, abha_id: str, drug: str, before: datetime) -> np.ndarray:
+        """Ordinal days on which the patient was billed for `drug`, strictly before `before`."""
+        self.counters["queries"] += 1
+        days = self._patient(abha_id).fill_days.get(drug)
+        if days is None: return np.empty(0, dtype=np.int32)
+        return days[:np.searchsorted(days, before.toordinal(), side="left")]
+
+    def record_claim(self, abha_id: str, bill_date: Optional[datetime], amount: float, medications: Iterable[str], file_hash: Optional[str] = None) -> bool:
+        """Appends a verified claim and its medications; returns False if this patient's copy of the file was already recorded."""
+        if not abha_id or bill_date is None: return False
+        day = bill_date.toordinal()
+        rows = [(abha_id, day, amount, None, file_hash)] + [(abha_id, day, None, drug, file_hash) for drug in sorted(set(medications))]
+        with self._writer():
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if file_hash and conn.execute("SELECT 1 FROM history WHERE abha_id = ? AND file_hash = ? LIMIT 1", (abha_id, file_hash)).fetchone():
+                    conn.execute("ROLLBACK")
+                    self.counters["duplicates_skipped"] += 1
+                    return False
+                conn.executemany("INSERT INTO history (abha_id, day, amount, drug, file_hash) VALUES (?, ?, ?, ?, ?)", rows)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        self.counters["claims_added"] += 1
+        return True
+
+    def stats(self) -> dict:
+        claims, fills, patients = self._conn().execute("SELECT SUM(drug IS NULL), SUM(drug IS NOT NULL), COUNT(DISTINCT abha_id) FROM history").fetchone()
+        return {**self.counters, "claims": claims or 0, "fills": fills or 0, "patients": patients, "patients_in_memory": len(self._patients),
+                "cache_patients": self.cache_patients, "db_path": self.db_path}
+
+
+_claim_history: Optional[ClaimHistoryStore] = None
+_claim_history_lock = threading.Lock()
+
+def get_claim_history() -> Optional[ClaimHistoryStore]:
+    """Opens this process's handle on the shared claim history on first use; None if disabled or unavailable."""
+    global _claim_history
+    if _claim_history is None and CLAIM_HISTORY_ENABLED:
+        with _claim_history_lock:
+            if _claim_history is None:
+                try:
+                    _claim_history = ClaimHistoryStore(CLAIM_HISTORY_PATH, CLAIM_HISTORY_CACHE_PATIENTS, seed=MOCK_USER_CLAIM_HISTORY_DB)
+                except (OSError, sqlite3.Error) as e:
+                    print(f"Warning: Claim history store unavailable: {e}")
+                    return None
+    return _claim_history
+
+
+@app.get("/claim-history")
+def get_claim_history_stats():
+    history = get_claim_history()
+    return {"enabled": history is not None, **(history.stats() if history else {})}
+
+
+# --- NEW: Bill text scanner (precompiled patterns, one extraction stage) ---
+# Every label the rules care about is located once with str.find on the lowercased
+# text (CPython's literal search is far faster than a case-insensitive regex scan),
+# and the precompiled field patterns below are only tried with .match() at those
+# anchors, so each one costs a few characters instead of a pass over the document.
+_ANCHOR_KEYWORDS = ("diagnosis", "medicine", "rx only", "prescribed_medications", "reg", "bill", "invoice",
+                    "net amount", "total amount", "net payable")
+_FLAG_KEYWORDS = ("patient name", "doctor", "dr.", "date of birth", "dob", "outpatient", "opd", "consultation",
+                  "spirometry", "pft", "blood pressure", " bp ", "hba1c", "glycated hemoglobin")
+_ICD_CODE_RE = re.compile(r"\b[A-Z]\d{2}(?:\.[0-9A-Z]{1,4})?\b") # Whole tokens only, so "MH12345" yields no "H12"
+_TOTAL_AMOUNT_RE = re.compile(r"[\d,]+\.?\d{2}")
+_BILL_DATE_RE = re.compile(r"(?:bill|invoice)\s*date:?\s*(\d{1,2}[-/]\d{1,2}[-/]\d{4})", re.IGNORECASE)
+_REG_ID_RE = re.compile(r"reg(?:istration)?\.?\s*id:?\s*([A-Za-z0-9/\-]+)", re.IGNORECASE)
+_DIAG_PATTERNS = [ # (text before the "diagnosis" anchor, pattern), in the order results are reported
+    ("", re.compile(r"diagnosis:?\s*(?:[A-Z]\d{2}(?:\.\d+)?)\s*-\s*([\w\s\(\),/\-]+)", re.IGNORECASE)),
+    ("primary ", re.compile(r"primary diagnosis:?\s*([\w\s\(\),/\-]+)", re.IGNORECASE)),
+    ("secondary ", re.compile(r"secondary diagnosis:?\s*([\w\s\(\),/\-]+)", re.IGNORECASE)),
+    ("provisional ", re.compile(r"provisional diagnosis:?\s*([\w\s\(\),/\-]+)", re.IGNORECASE)),
+]
+_MED_PATTERNS = [ # (anchor keyword, pattern)
+    ("medicine", re.compile(r"medicine:?\s*([\w\s\-\(\)\+]+?)\s*(?:\(|tab|mg|inj|unit|cream|suspension|\d)", re.IGNORECASE)),
+    ("rx only", re.compile(r"rx only\s*([\w\s\-\+]+)", re.IGNORECASE)),
+    ("prescribed_medications", re.compile(r"prescribed_medications\":\s*\[\"([\w\s\d]+)", re.IGNORECASE)),
+]
+_DIAG_ROLE_RE = re.compile(r'\((primary|secondary)\)')
+_MED_DOSE_TAIL_RE = re.compile(r'\s*\d+.*')
+_UNUSUAL_CHAR_RE = re.compile(r'[^\x00-\x7F\s]')
+_MED_IGNORE_WORDS = {"description", "sr. no.", "medicine:", "dosage", "quantity", "amount", "total", "consultation", "test", "procedure", "fee", "charges", "room", "nursing", "tax", "gst", "paid", "therapy", "counseling", "sessions", "exercises"}
+_PROVIDER_KEYWORDS = ("CLINIC", "HOSPITAL", "MEDICAL CENTER")
+
+def _match_at_anchors(pattern, text: str, anchors: List[int]) -> List["re.Match"]:
+    """Same matches as pattern.finditer(text), given every position a match could start at."""
+    matches, last_end = [], -1
+    for pos in anchors:
+        if pos < last_end: continue # finditer never reports overlapping matches
+        m = pattern.match(text, pos)
+        if m:
+            matches.append(m)
+            last_end = m.end()
+    return matches
+
+def _find_all(text: str, text_lower: str, keyword: str) -> List[int]:
+    if len(text_lower) != len(text): # Some characters change length when lowercased; positions would drift
+        return [m.start() for m in re.finditer(re.escape(keyword), text, re.IGNORECASE)]
+    positions, pos = [], text_lower.find(keyword)
+    while pos != -1:
+        positions.append(pos)
+        pos = text_lower.find(keyword, pos + 1)
+    return positions
+
+def scan_bill_text(text: str, text_lower: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Extracts every text-derived field the rules use from `text`.
+
+    Returns the public fields that end up in `RuleEngine.extracted`
+    (provider_name, total_amount, bill_date, doc_reg_id, diagnoses, medications)
+    plus the internal signals the checks read: `icd_codes` (in document order),
+    `keywords` (the `_ANCHOR_KEYWORDS`/`_FLAG_KEYWORDS` present), `has_bill_id`
+    and `non_ascii_count`.
+    """
+    if text_lower is None: text_lower = text.lower()
+    anchors = {kw: _find_all(text, text_lower, kw) for kw in _ANCHOR_KEYWORDS}
+    keywords = {kw for kw, positions in anchors.items() if positions}
+    if len(text_lower) == len(text): keywords.update(kw for kw in _FLAG_KEYWORDS if kw in text_lower)
+    else: keywords.update(kw for kw in _FLAG_KEYWORDS if _find_all(text, text_lower, kw))
+    icd_codes = _ICD_CODE_RE.findall(text)
+
+    fields: Dict[str, Any] = {
+        "provider_name": "UNKNOWN", "total_amount": 0.0, "bill_date": None, "doc_reg_id": None,
+        "diagnoses": [], "medications": [], "icd_codes": icd_codes, "keywords": keywords,
+    }
+
+    lines = text.split('\n', 5)
+    for line in lines[:5]:
+        line_upper = line.strip().upper()
+        if any(k in line_upper for k in _PROVIDER_KEYWORDS):
+            fields["provider_name"] = line_upper; break
+    else:
+        if len(lines) > 1: fields["provider_name"] = lines[1].strip().upper() # Fallback
+
+    total_labels = [(p, p + len(k)) for k in ("net amount", "total amount", "net payable") for p in anchors[k]]
+    if total_labels:
+        amount = _TOTAL_AMOUNT_RE.search(text, min(total_labels)[1])
+        if amount:
+            try: fields["total_amount"] = float(amount.group().replace(",", ""))
+            except: pass
+
+    bill_anchors = sorted(anchors["bill"] + anchors["invoice"])
+    fields["has_bill_id"] = any(text[p:p + 7].lower() == "bill id" or text[p:p + 10].lower() == "invoice no" for p in bill_anchors)
+    for m in _match_at_anchors(_BILL_DATE_RE, text, bill_anchors):
+        try: fields["bill_date"] = date_parse(m.group(1).replace('/', '-'), dayfirst=True)
+        except: pass
+        break
+
+    reg = _match_at_anchors(_REG_ID_RE, text, anchors["reg"])
+    if reg: fields["doc_reg_id"] = reg[0].group(1).upper()
+
+    diagnoses: Dict[str, None] = {}
+    diag_anchors = anchors["diagnosis"]
+    for prefix, pattern in _DIAG_PATTERNS:
+        starts = [p - len(prefix) for p in diag_anchors if p >= len(prefix) and text[p - len(prefix):p].lower() == prefix]
+        for m in _match_at_anchors(pattern, text, starts):
+            diag_text = _DIAG_ROLE_RE.sub('', m.group(1).strip().lower()).strip()
+            if diag_text and len(diag_text) > 3: diagnoses.setdefault(diag_text)
+    fields["diagnoses"] = list(diagnoses)
+
+    medications: Dict[str, None] = {}
+    for keyword, pattern in _MED_PATTERNS:
+        for m in _match_at_anchors(pattern, text, anchors[keyword]):
+            med_name_cleaned = _MED_DOSE_TAIL_RE.sub('', m.group(1).strip().lower()).strip()
+            is_ignored = med_name_cleaned in _MED_IGNORE_WORDS or any(word in _MED_IGNORE_WORDS for word in med_name_cleaned.split())
+            if med_name_cleaned and len(med_name_cleaned) > 3 and not is_ignored: medications.setdefault(med_name_cleaned)
+    fields["medications"] = list(medications)
+
+    non_ascii = len(text) - len(text.encode("ascii", "ignore"))
+    fields["non_ascii_count"] = len(_UNUSUAL_CHAR_RE.findall(text)) if non_ascii else 0
+    return fields
+
+
+# --- NEW: Line-item outlier pricing (per item/city log-price distributions as NumPy arrays) ---
+PRICE_TABLE_ENABLED = os.getenv("PRICE_TABLE_ENABLED", "true").lower() in ("1", "true", "yes")
+PRICE_TABLE_PATH = os.getenv("PRICE_TABLE_PATH", os.path.join(DATA_DIR, "price-table"))
+PRICE_MIN_SAMPLES = int(os.getenv("PRICE_MIN_SAMPLES", "20")) # Below this a city row falls back to the all-city row
+PRICE_Z_THRESHOLD = float(os.getenv("PRICE_Z_THRESHOLD", "3.0"))
+PRICE_MIN_LOG_STD = 0.1 # Floor on the spread, so near-constant prices don't turn small differences into huge z-scores
+PRICE_MAX_LINE_ITEMS = int(os.getenv("PRICE_MAX_LINE_ITEMS", "500"))
+_ALL_CITIES = "*"
+_LINE_ITEM_RE = re.compile(
+    r"^[ \t]*(?:\d{1,3}[.)][ \t]*)?(?P<desc>[A-Za-z][A-Za-z0-9 ()&/,.+\-]*?)[ \t]+"
+    r"(?:(?:qty|quantity)[:.]?[ \t]*(?P<qty>\d{1,4})[ \t]+)?"
+    r"(?:(?:amount|amt|rs\.?|inr|₹)[:.]?[ \t]*)?(?P<amount>\d{1,3}(?:,\d{2,3})+\.\d{2}|\d+\.\d{2})[ \t]*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+_LINE_ITEM_SKIP_RE = re.compile(r"\b(?:total|sub ?total|net|payable|tax|gst|cgst|sgst|discount|balance|paid|advance|due|round)\b", re.IGNORECASE)
+_ITEM_KEY_RE = re.compile(r"[^a-z0-9]+")
+
+def extract_line_items(text: str, limit: int = PRICE_MAX_LINE_ITEMS) -> List[Tuple[str, int, float]]:
+    """(item key, quantity, line amount) for bill rows ending in an amount, e.g. "3. CBC Test  Qty 2  Amount 900.00"."""
+    items = []
+    for m in _LINE_ITEM_RE.finditer(text):
+        desc = m.group("desc")
+        if _LINE_ITEM_SKIP_RE.search(desc): continue
+        key = _ITEM_KEY_RE.sub(" ", desc.lower()).strip()
+        amount = float(m.group("amount").replace(",", ""))
+        if len(key) < 3 or amount <= 0: continue
+        items.append((key, max(1, int(m.group("qty") or 1)), amount))
+        if len(items) >= limit: break
+    return items
+
+def _city_of(address: str) -> str:
+    return address.split(',')[-1].strip().lower() if address else ""
+
+
+class PriceTable(SharedSqliteStore):
+    """
+    Unit-price distributions per (item, city), plus an all-city row per item.
+
+    Each row keeps the count, sum and sum of squares of log unit prices, so an
+    accepted claim is folded in with one `np.add.at` and a bill is scored with
+    one vectorized z-score. The sums live in SQLite, shared by all workers;
+    every process mirrors them in NumPy arrays and pulls only rows changed
+    since its last look.
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._keys: Dict[Tuple[str, str], int] = {}
+        self._n = np.zeros(0); self._sum = np.zeros(0); self._sumsq = np.zeros(0)
+        self._seen_version = 0
+        self._cache_lock = threading.Lock()
+        self.counters = {"scored_items": 0, "unpriced_items": 0, "claims_added": 0, "items_added": 0}
+        with self._writer():
+            self._conn().executescript("""
+                CREATE TABLE IF NOT EXISTS prices (item TEXT, city TEXT, n REAL, log_sum REAL, log_sumsq REAL, version INTEGER, PRIMARY KEY (item, city)) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS prices_version ON prices (version);
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+            """)
+
+    def _row(self, key: Tuple[str, str]) -> int:
+        i = self._keys.get(key)
+        if i is None:
+            i = self._keys[key] = len(self._keys)
+            if i >= self._n.size: # Grow by doubling; the arrays are rewritten rarely
+                grow = max(1024, self._n.size)
+                self._n, self._sum, self._sumsq = (np.concatenate([a, np.zeros(grow)]) for a in (self._n, self._sum, self._sumsq))
+        return i
+
+    def _sync(self):
+        rows = self._conn().execute("SELECT item, city, n, log_sum, log_sumsq, version FROM prices WHERE version > ?", (self._seen_version,)).fetchall()
+        if not rows: return
+        idx = np.array([self._row((item, city)) for item, city, *_ in rows])
+        self._n[idx], self._sum[idx], self._sumsq[idx] = (np.array([row[c] for row in rows]) for c in (2, 3, 4))
+        self._seen_version = max(row[5] for row in rows)
+
+    def score(self, items: List[Tuple[str, int, float]], city: str) -> List[dict]:
+        """Z-score of each item's log unit price against its city row (or the all-city row when the city has too few samples)."""
+        if not items: return []
+        with self._cache_lock:
+            self._sync()
+            if not self._keys: # Nothing priced yet (the arrays below would be empty)
+                self.counters["unpriced_items"] += len(items)
+                return []
+            city_rows = np.array([self._keys.get((key, city), -1) for key, _, _ in items])
+            all_rows = np.array([self._keys.get((key, _ALL_CITIES), -1) for key, _, _ in items])
+            n = self._n; use_city = (city_rows >= 0) & (n[city_rows] >= PRICE_MIN_SAMPLES)
+            rows = np.where(use_city, city_rows, all_rows)
+            priced = (rows >= 0) & (n[rows] >= PRICE_MIN_SAMPLES)
+            safe = np.where(priced, rows, 0)
+            count = np.maximum(n[safe], 1); mean = self._sum[safe] / count
+            std = np.maximum(np.sqrt(np.maximum(self._sumsq[safe] / count - mean ** 2, 0)), PRICE_MIN_LOG_STD)
+        unit = np.log(np.array([amount / qty for _, qty, amount in items]))
+        z = (unit - mean) / std
+        self.counters["scored_items"] += int(priced.sum()); self.counters["unpriced_items"] += int((~priced).sum())
+        return [{"item": key, "unit_price": round(float(np.exp(unit[i])), 2), "typical_price": round(float(np.exp(mean[i])), 2),
+                 "z": round(float(z[i]), 2), "scope": "city" if use_city[i] else "all cities"}
+                for i, (key, _, _) in enumerate(items) if priced[i]]
+
+    def add_claim(self, items: Iterable[Tuple[str, int, float]], city: str) -> int:
+        """Folds an accepted claim's line items into the city and all-city rows; returns the number of items added."""
+        items = [(key, qty, amount) for key, qty, amount in items if qty > 0 and amount > 0]
+        if not items: return 0
+        keys = [(key, c) for key, _, _ in items for c in ((city, _ALL_CITIES) if city and city != _ALL_CITIES else (_ALL_CITIES,))]
+        logs = np.repeat(np.log([amount / qty for _, qty, amount in items]), len(keys) // len(items))
+        unique = sorted(set(keys)); slot = {k: i for i, k in enumerate(unique)}
+        pos = np.array([slot[k] for k in keys])
+        n, total, total_sq = (np.zeros(len(unique)) for _ in range(3))
+        np.add.at(n, pos, 1); np.add.at(total, pos, logs); np.add.at(total_sq, pos, logs ** 2)
+        with self._writer():
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = conn.execute("SELECT COALESCE(MAX(value), 0) + 1 FROM meta WHERE key = 'version'").fetchone()[0]
+                conn.executemany("""INSERT INTO prices (item, city, n, log_sum, log_sumsq, version) VALUES (?, ?, ?, ?, ?, ?)
+                                    ON CONFLICT (item, city) DO UPDATE SET n = n + excluded.n, log_sum = log_sum + excluded.log_sum,
+                                    log_sumsq = log_sumsq + excluded.log_sumsq, version = excluded.version""",
+                                 [(item, c, float(n[i]), float(total[i]), float(total_sq[i]), version) for i, (item, c) in enumerate(unique)])
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (version,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        self.counters["claims_added"] += 1; self.counters["items_added"] += len(items)
+        return len(items)
+
+    def stats(self) -> dict:
+        rows, items, priced = self._conn().execute(
+            "SELECT COUNT(*), SUM(city = ?), SUM(city = ? AND n >= ?) FROM prices", (_ALL_CITIES, _ALL_CITIES, PRICE_MIN_SAMPLES)).fetchone()
+        return {**self.counters, "rows": rows, "items": items or 0, "items_with_enough_samples": priced or 0, "rows_in_memory": len(self._keys),
+                "min_samples": PRICE_MIN_SAMPLES, "z_threshold": PRICE_Z_THRESHOLD, "db_path": self.db_path}
+
+
+def _iter_price_import(lines: Iterable[str]) -> Iterator[Tuple[str, str, int, float]]:
+    """Parses bulk-import CSV lines `item,city,amount[,qty]` (reference prices or historical accepted line items)."""
+    for line in lines:
+        parts = [p.strip() for p in line.strip().split(",")]
+        if len(parts) < 3 or parts[0].startswith("#"): continue
+        try: amount, qty = float(parts[2]), int(parts[3]) if len(parts) > 3 and parts[3] else 1
+        except ValueError: continue # Header or malformed row
+        yield _ITEM_KEY_RE.sub(" ", parts[0].lower()).strip(), parts[1].lower(), qty, amount
+
+
+_price_table: Optional[PriceTable] = None
+_price_table_lock = threading.Lock()
+
+def get_price_table() -> Optional[PriceTable]:
+    """Opens this process's handle on the shared price table on first use; None if disabled or unavailable."""
+    global _price_table
+    if _price_table is None and PRICE_TABLE_ENABLED:
+        with _price_table_lock:
+            if _price_table is None:
+                try:
+                    _price_table = PriceTable(PRICE_TABLE_PATH)
+                except (OSError, sqlite3.Error) as e:
+                    print(f"Warning: Price table unavailable: {e}")
+                    return None
+    return _price_table
+
+
+@app.get("/prices")
+def get_price_table_stats():
+    table = get_price_table()
+    return {"enabled": table is not None, **(table.stats() if table else {})}
+
+
+# --- NEW: Provider / doctor registry (normalized names, trigram fuzzy match, TTL-refreshed snapshot) ---
+REGISTRY_SOURCE = os.getenv("REGISTRY_SOURCE", "") # "" = built-in mock data, a JSON file path, or an http(s) URL
+REGISTRY_TTL_SECONDS = float(os.getenv("REGISTRY_TTL_SECONDS", "3600"))
+REGISTRY_FETCH_TIMEOUT = float(os.getenv("REGISTRY_FETCH_TIMEOUT", "30"))
+REGISTRY_FUZZY_THRESHOLD = float(os.getenv("REGISTRY_FUZZY_THRESHOLD", "0.8")) # Dice similarity of name trigrams
+REGISTRY_MEMO_SIZE = int(os.getenv("REGISTRY_MEMO_SIZE", "10000"))
+_NAME_PUNCT_RE = re.compile(r"[^A-Z0-9]+")
+_REG_ID_CONFUSABLES = str.maketrans("OILSBZ", "011582") # Characters OCR swaps for digits in license numbers
+
+def normalize_provider_name(name: str) -> str:
+    """Upper-case ASCII words only: 'Mumbai Arthritis & Heart Clinic.' -> 'MUMBAI ARTHRITIS AND HEART CLINIC'."""
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode().upper().replace("&", " AND ")
+    return _NAME_PUNCT_RE.sub(" ", name).strip()
+
+def normalize_reg_id(reg_id: str) -> str:
+    """'mh-mc-1l223' and 'MH/MC/11223' both become 'MHMC11223' once separators and OCR look-alikes are folded."""
+    key = _NAME_PUNCT_RE.sub("", reg_id.upper())
+    prefix = re.match(r"[A-Z]*", key).group()
+    return prefix + key[len(prefix):].translate(_REG_ID_CONFUSABLES)
+
+def _trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _RegistrySnapshot:
+    """One immutable load of the registry: exact-key dicts plus a trigram index over provider names."""
+
+    def __init__(self, providers: Dict[str, dict], doctors: Dict[str, dict], loaded_at: float):
+        self.loaded_at = loaded_at
+        self.providers: Dict[str, Tuple[str, dict]] = {}
+        for name, info in providers.items():
+            self.providers.setdefault(normalize_provider_name(name), (name, info))
+        self.doctors = {normalize_reg_id(reg_id): (reg_id, info) for reg_id, info in doctors.items()}
+        self.names = list(self.providers)
+        postings: Dict[str, List[int]] = {}
+        sizes = []
+        for i, name in enumerate(self.names):
+            grams = _trigrams(name); sizes.append(len(grams))
+            for gram in grams: postings.setdefault(gram, []).append(i)
+        self.postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+        self.sizes = np.array(sizes, dtype=np.float64)
+
+    def fuzzy_provider(self, key: str) -> Tuple[Optional[int], float]:
+        grams = _trigrams(key)
+        hits = [self.postings[g] for g in grams if g in self.postings]
+        if not hits: return None, 0.0
+        shared = np.bincount(np.concatenate(hits), minlength=len(self.names))
+        dice = 2 * shared / (len(grams) + self.sizes)
+        best = int(np.argmax(dice))
+        return best, float(dice[best])
+
+
+def _load_registry_source(source: str) -> Tuple[Dict[str, dict], Dict[str, dict]]:
+    """
+    Reads {"providers": ..., "doctors": ...} from a file or URL; each may be a
+    dict keyed by provider name / registration id, or a list of records with
+    "name" / "reg_id". No source means the built-in mock databases.
+    """
+    if not source:
+        return MOCK_PROVIDER_RISK_DB, MOCK_MEDICAL_COUNCIL_DB
+    if source.startswith(("http://", "https://")):
+        response = httpx.get(source, timeout=REGISTRY_FETCH_TIMEOUT, follow_redirects=True)
+        response.raise_for_status()
+        data = response.json()
+    else:
+        with open(source, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    def as_dict(records, key: str) -> Dict[str, dict]:
+        if isinstance(records, dict): return records
+        return {str(record[key]): record for record in records or [] if record.get(key)}
+    return as_dict(data.get("providers"), "name"), as_dict(data.get("doctors"), "reg_id")
+
+
+class ProviderRegistry:
+    """
+    In-process cache of the provider risk and medical council registries.
+
+    The whole registry is loaded as one snapshot. Once it is older than `ttl`,
+    the next lookup starts a background reload and keeps answering from the
+    old snapshot until the new one is swapped in; a failed reload keeps the
+    old data. Provider names are matched exactly after normalization, then by
+    trigram similarity, so OCR noise and punctuation differences still hit.
+    """
+
+    def __init__(self, source: str = "", ttl: float = 3600.0, fuzzy_threshold: float = 0.8):
+        self.source, self.ttl, self.fuzzy_threshold = source, ttl, fuzzy_threshold
+        self._snapshot: Optional[_RegistrySnapshot] = None
+        self._memo: "OrderedDict[str, Tuple[Optional[str], Optional[dict], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self.last_error: Optional[str] = None
+        self.counters = {"refreshes": 0, "refresh_failures": 0, "provider_exact": 0, "provider_fuzzy": 0, "provider_miss": 0,
+                         "memo_hits": 0, "doctor_hits": 0, "doctor_miss": 0}
+
+    def refresh(self) -> _RegistrySnapshot:
+        """Bulk-reloads the source and atomically swaps in the new snapshot."""
+        try:
+            providers, doctors = _load_registry_source(self.source)
+            snapshot = _RegistrySnapshot(providers, doctors, time.time())
+        except Exception as e:
+            self.counters["refresh_failures"] += 1; self.last_error = str(e)
+            raise
+        finally:
+            self._refreshing = False
+        with self._lock:
+            self._snapshot = snapshot; self._memo.clear()
+        self.counters["refreshes"] += 1; self.last_error = None
+        print(f"Provider registry loaded: {len(snapshot.providers)} provider(s), {len(snapshot.doctors)} doctor license(s).")
+        return snapshot
+
+    def _background_refresh(self):
+        try: self.refresh()
+        except Exception as e: print(f"Warning: Provider registry refresh failed; serving cached data. {e}")
+
+    def snapshot(self) -> _RegistrySnapshot:
+        snapshot = self._snapshot
+        if snapshot is None: return self.refresh() # First use: nothing to serve yet
+        if time.time() - snapshot.loaded_at > self.ttl and not self._refreshing:
+            with self._lock:
+                start = not self._refreshing; self._refreshing = True
+            if start: threading.Thread(target=self._background_refresh, name="registry-refresh", daemon=True).start()
+        return snapshot
+
+    def find_provider(self, name: str) -> Tuple[Optional[str], Optional[dict], float]:
+        """Returns (registered name, record, similarity); similarity 1.0 is an exact match after normalization."""
+        snapshot = self.snapshot(); key = normalize_provider_name(name)
+        match = snapshot.providers.get(key)
+        if match:
+            self.counters["provider_exact"] += 1
+            return match[0], match[1], 1.0
+        with self._lock:
+            memo = self._memo.get(key)
+        if memo is not None:
+            self.counters["memo_hits"] += 1
+            return memo
+        best, similarity = snapshot.fuzzy_provider(key) if key else (None, 0.0)
+        if best is not None and similarity >= self.fuzzy_threshold:
+            result = (*snapshot.providers[snapshot.names[best]], similarity); self.counters["provider_fuzzy"] += 1
+        else:
+            result = (None, None, similarity); self.counters["provider_miss"] += 1
+        with self._lock:
+            if snapshot is self._snapshot:
+                self._memo[key] = result
+                if len(self._memo) > REGISTRY_MEMO_SIZE: self._memo.popitem(last=False)
+        return result
+
+    def find_doctor(self, reg_id: str) -> Tuple[Optional[str], Optional[dict]]:
+        """Returns (registered id, record) for a license number, tolerating separators and OCR look-alike characters."""
+        match = self.snapshot().doctors.get(normalize_reg_id(reg_id))
+        self.counters["doctor_hits" if match else "doctor_miss"] += 1
+        return match or (None, None)
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {**self.counters, "source": self.source or "built-in mock data", "ttl_seconds": self.ttl,
+                "providers": len(snapshot.providers) if snapshot else 0, "doctors": len(snapshot.doctors) if snapshot else 0,
+                "age_seconds": round(time.time() - snapshot.loaded_at, 1) if snapshot else None, "memo_entries": len(self._memo),
+                "last_error": self.last_error}
+
+
+provider_registry = ProviderRegistry(REGISTRY_SOURCE, REGISTRY_TTL_SECONDS, REGISTRY_FUZZY_THRESHOLD)
+
+
+@app.on_event("startup")
+async def load_provider_registry():
+    try: await asyncio.to_thread(provider_registry.snapshot)
+    except Exception as e: print(f"Warning: Provider registry not preloaded. {e}")
+
+
+@app.get("/registry")
+def get_registry_stats():
+    return provider_registry.stats()
+
+
+@app.post("/registry/refresh")
+async def refresh_registry():
+    try: await asyncio.to_thread(provider_registry.refresh)
+    except Exception as e: raise HTTPException(status_code=502, detail=f"Registry refresh failed: {e}")
+    return provider_registry.stats()
+
+
+# --- NEW: Clinical knowledge base (drug indications + diagnosis age ranges, compiled to an Aho-Corasick automaton) ---
+KB_DRUG_INDICATIONS_PATH = os.getenv("KB_DRUG_INDICATIONS_PATH", "") # CSV `drug,indication` rows or JSON {drug: [indications]}; "" = DRUG_DIAGNOSIS_MAP
+KB_AGE_RANGES_PATH = os.getenv("KB_AGE_RANGES_PATH", "") # CSV `diagnosis,min_age,max_age` rows or JSON {diagnosis: [min, max]}; "" = DIAGNOSIS_AGE_RANGE
+KB_CACHE_DIR = os.getenv("KB_CACHE_DIR", os.path.join(DATA_DIR, "kb-cache"))
+_KB_FORMAT_VERSION = 2
+_KB_SPACE_RE = re.compile(r"\s+")
+
+def _kb_term(text: str) -> str:
+    return _KB_SPACE_RE.sub(" ", text.strip().lower())
+
+def _read_kb_rows(path: str) -> Iterator[List[str]]:
+    with open(path, "r", encoding="utf-8") as f:
+        if path.lower().endswith(".json"):
+            for key, value in json.load(f).items():
+                yield [key, *(value if isinstance(value, (list, tuple)) else [value])]
+        else:
+            for line in f:
+                if line.strip() and not line.lstrip().startswith("#"): yield [p.strip() for p in line.split(",")]
+
+def _load_drug_indications(path: str) -> Dict[str, List[str]]:
+    if not path: return DRUG_DIAGNOSIS_MAP
+    indications: Dict[str, List[str]] = {}
+    for row in _read_kb_rows(path):
+        if path.lower().endswith(".json"): indications.setdefault(_kb_term(row[0]), []).extend(_kb_term(t) for t in row[1:] if t)
+        elif len(row) >= 2 and row[0] and row[1] and row[0].lower() != "drug": indications.setdefault(_kb_term(row[0]), []).append(_kb_term(row[1]))
+    return indications
+
+def _load_age_ranges(path: str) -> Dict[str, Tuple[int, int]]:
+    if not path: return DIAGNOSIS_AGE_RANGE
+    ranges = {}
+    for row in _read_kb_rows(path):
+        try: ranges[_kb_term(row[0])] = (int(float(row[1])), int(float(row[2])))
+        except (IndexError, ValueError): continue # Header or malformed row
+    return ranges
+
+
+class ClinicalKnowledgeBase:
+    """
+    Drug indications and diagnosis age ranges compiled for linear-time matching.
+
+    Every indication and age-range term goes into one Aho-Corasick automaton,
+    so scanning the bill's diagnosis text once finds every term it contains,
+    however large the formulary is. Each drug maps to the ids of its
+    indication terms, making the drug-vs-diagnosis check a set intersection.
+    """
+
+    def __init__(self, drug_indications: Dict[str, List[str]], age_ranges: Dict[str, Tuple[int, int]]):
+        terms: Dict[str, int] = {}
+        def term_id(term: str) -> int: return terms.setdefault(_kb_term(term), len(terms))
+        self.drugs = {_kb_term(drug): frozenset(term_id(t) for t in kws) for drug, kws in drug_indications.items()}
+        self.age_ranges = {term_id(diag): tuple(bounds) for diag, bounds in age_ranges.items()}
+        self.terms = list(terms)
+        self._build_automaton()
+
+    def _build_automaton(self):
+        goto: List[Dict[str, int]] = [{}]; out: List[Tuple[int, ...]] = [()]
+        for tid, term in enumerate(self.terms):
+            node = 0
+            for ch in term:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = goto[node][ch] = len(goto); goto.append({}); out.append(())
+                node = nxt
+            out[node] += (tid,)
+        fail = [0] * len(goto); queue = list(goto[0].values())
+        for node in queue: # Breadth-first, so each failure target is finished before it is used
+            for ch, child in goto[node].items():
+                f = fail[node]
+                while f and ch not in goto[f]: f = fail[f]
+                fail[child] = goto[f].get(ch, 0) if goto[f].get(ch) != child else 0
+                out[child] += out[fail[child]]
+                queue.append(child)
+        self._goto, self._fail, self._out = goto, fail, out
+
+    def to_cache(self) -> dict:
+        """Plain JSON-serializable form of the compiled knowledge base, automaton included."""
+        return {"terms": self.terms, "drugs": {drug: sorted(ids) for drug, ids in self.drugs.items()},
+                "age_ranges": [[tid, *bounds] for tid, bounds in self.age_ranges.items()],
+                "goto": self._goto, "fail": self._fail, "out": self._out}
+
+    @classmethod
+    def from_cache(cls, data: dict) -> "ClinicalKnowledgeBase":
+        """Inverse of to_cache(); raises KeyError/TypeError/ValueError if `data` isn't a well-formed cache."""
+        kb = cls.__new__(cls)
+        kb.terms = [str(t) for t in data["terms"]]
+        kb.drugs = {str(drug): frozenset(int(i) for i in ids) for drug, ids in data["drugs"].items()}
+        kb.age_ranges = {int(tid): (int(lo), int(hi)) for tid, lo, hi in data["age_ranges"]}
+        kb._goto = [{str(ch): int(n) for ch, n in edges.items()} for edges in data["goto"]]
+        kb._fail = [int(n) for n in data["fail"]]
+        kb._out = [tuple(int(t) for t in tids) for tids in data["out"]]
+        states, n_terms = len(kb._goto), len(kb.terms)
+        if not (states == len(kb._fail) == len(kb._out)) or not states: raise ValueError("inconsistent automaton tables")
+        if any(n >= states or n < 0 for edges in kb._goto for n in edges.values()) or any(n >= states or n < 0 for n in kb._fail): raise ValueError("state out of range")
+        if any(t >= n_terms or t < 0 for tids in kb._out for t in tids) or any(i >= n_terms or i < 0 for ids in kb.drugs.values() for i in ids): raise ValueError("term id out of range")
+        return kb
+
+    def find_terms(self, text: str) -> Dict[int, int]:
+        """Term id -> end offset of its first occurrence in `text`, in one pass over the text."""
+        goto, fail, out = self._goto, self._fail, self._out
+        found: Dict[int, int] = {}; node = 0
+        for i, ch in enumerate(_kb_term(text)):
+            while node and ch not in goto[node]: node = fail[node]
+            node = goto[node].get(ch, 0)
+            for tid in out[node]: found.setdefault(tid, i + 1)
+        return found
+
+    def unsupported_drugs(self, medications: List[str], diagnoses: List[str]) -> List[str]:
+        """Medications known to the knowledge base whose indications appear in none of the diagnoses."""
+        drug_sets = [(med, self.drugs.get(_kb_term(med)) or self.drugs.get(_kb_term(med).split(" ")[0])) for med in medications]
+        if not any(indications for _, indications in drug_sets): return []
+        found = self.find_terms("\n".join(diagnoses)).keys() # Newline: no term spans two diagnoses
+        return [med for med, indications in drug_sets if indications and indications.isdisjoint(found)]
+
+    def age_range(self, diagnosis: str) -> Optional[Tuple[str, int, int]]:
+        """(term, min age, max age) for the longest age-ranged term inside `diagnosis`, if any."""
+        ranged = [tid for tid in self.find_terms(diagnosis) if tid in self.age_ranges]
+        if not ranged: return None
+        tid = max(ranged, key=lambda t: len(self.terms[t]))
+        return (self.terms[tid], *self.age_ranges[tid])
+
+    def stats(self) -> dict:
+        return {"drugs": len(self.drugs), "terms": len(self.terms), "age_ranges": len(self.age_ranges), "automaton_states": len(self._goto)}
+
+
+def _kb_source_fingerprint() -> str:
+    parts = [str(_KB_FORMAT_VERSION)]
+    for path, builtin in ((KB_DRUG_INDICATIONS_PATH, DRUG_DIAGNOSIS_MAP), (KB_AGE_RANGES_PATH, DIAGNOSIS_AGE_RANGE)):
+        if path:
+            st = os.stat(path); parts.append(f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}")
+        else:
+            parts.append(json.dumps(builtin, sort_keys=True))
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()[:24]
+
+def compile_knowledge_base() -> Tuple[ClinicalKnowledgeBase, dict]:
+    """Loads the compiled knowledge base from the disk cache, or compiles the source files and caches the result."""
+    start = time.perf_counter()
+    cache_path = os.path.join(KB_CACHE_DIR, f"kb-{_kb_source_fingerprint()}.json")
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            kb = ClinicalKnowledgeBase.from_cache(json.load(f)) # Plain data only: a planted cache file can't run code
+        return kb, {"from_cache": True, "load_ms": round((time.perf_counter() - start) * 1000, 1), "cache_path": cache_path}
+    except (OSError, ValueError, KeyError, TypeError, AttributeError): # Missing or damaged
+        pass
+    kb = ClinicalKnowledgeBase(_load_drug_indications(KB_DRUG_INDICATIONS_PATH), _load_age_ranges(KB_AGE_RANGES_PATH))
+    try:
+        os.makedirs(KB_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(kb.to_cache(), f, separators=(",", ":"))
+        os.replace(tmp_path, cache_path) # Atomic: other workers never read a half-written cache
+    except OSError as e:
+        print(f"Warning: Could not cache compiled knowledge base: {e}")
+    return kb, {"from_cache": False, "load_ms": round((time.perf_counter() - start) * 1000, 1), "cache_path": cache_path}
+
+
+_knowledge_base: Optional[Tuple[ClinicalKnowledgeBase, dict]] = None
+_knowledge_base_lock = threading.Lock()
+
+def get_knowledge_base() -> ClinicalKnowledgeBase:
+    global _knowledge_base
+    if _knowledge_base is None:
+        with _knowledge_base_lock:
+            if _knowledge_base is None:
+                _knowledge_base = compile_knowledge_base()
+    return _knowledge_base[0]
+
+
+@app.on_event("startup")
+async def load_knowledge_base():
+    try: await asyncio.to_thread(get_knowledge_base)
+    except Exception as e: print(f"Warning: Knowledge base not preloaded. {e}")
+
+
+@app.get("/knowledge-base")
+def get_knowledge_base_stats():
+    kb = get_knowledge_base()
+    return {**kb.stats(), **_knowledge_base[1]}
+
+
+# --- NEW: ICD-10 catalogue (sorted code array, hierarchical lookup, chapters) ---
+ICD10_CATALOGUE_PATH = os.getenv("ICD10_CATALOGUE_PATH", "") # CSV `code,description` or CMS-style `CODE  description` lines
+_ICD10_CHAPTERS = [ # (first category, last category, chapter, title) -- WHO ICD-10
+    ("A00", "B99", "I", "Certain infectious and parasitic diseases"), ("C00", "D48", "II", "Neoplasms"),
+    ("D50", "D89", "III", "Diseases of the blood and immune mechanism"), ("E00", "E90", "IV", "Endocrine, nutritional and metabolic diseases"),
+    ("F00", "F99", "V", "Mental and behavioural disorders"), ("G00", "G99", "VI", "Diseases of the nervous system"),
+    ("H00", "H59", "VII", "Diseases of the eye and adnexa"), ("H60", "H95", "VIII", "Diseases of the ear and mastoid process"),
+    ("I00", "I99", "IX", "Diseases of the circulatory system"), ("J00", "J99", "X", "Diseases of the respiratory system"),
+    ("K00", "K93", "XI", "Diseases of the digestive system"), ("L00", "L99", "XII", "Diseases of the skin and subcutaneous tissue"),
+    ("M00", "M99", "XIII", "Diseases of the musculoskeletal system and connective tissue"), ("N00", "N99", "XIV", "Diseases of the genitourinary system"),
+    ("O00", "O99", "XV", "Pregnancy, childbirth and the puerperium"), ("P00", "P96", "XVI", "Certain conditions originating in the perinatal period"),
+    ("Q00", "Q99", "XVII", "Congenital malformations and chromosomal abnormalities"), ("R00", "R99", "XVIII", "Symptoms, signs and abnormal findings, not elsewhere classified"),
+    ("S00", "T98", "XIX", "Injury, poisoning and other consequences of external causes"), ("U00", "U99", "XXII", "Codes for special purposes"),
+    ("V01", "Y98", "XX", "External causes of morbidity and mortality"), ("Z00", "Z99", "XXI", "Factors influencing health status and contact with health services"),
+]
+_ICD10_CHAPTER_STARTS = [c[0] for c in _ICD10_CHAPTERS]
+_ICD10_BUILTIN = { # Used when no catalogue file is configured
+    "E11": "Type 2 diabetes mellitus", "I10": "Essential (primary) hypertension", "J45": "Asthma", "J45.9": "Asthma, unspecified",
+    "M08": "Juvenile arthritis", "M08.0": "Juvenile rheumatoid arthritis",
+}
+_ICD_DESCRIPTION_STOPWORDS = {"with", "without", "other", "unspecified", "type", "disease", "diseases", "disorder", "disorders", "primary",
+                              "secondary", "acute", "chronic", "due", "site", "sites", "specified", "elsewhere", "classified", "and", "the"}
+_ICD_WORD_RE = re.compile(r"[a-z]{4,}")
+_ICD_FILE_CODE_RE = re.compile(r"^\s*(?:\d+\s+)?([A-Z]\d{2}(?:\.?[0-9A-Z]{1,4})?)\s*[,\s]\s*(?:[01]\s+)?(.*)$") # Also CMS order-file rows
+
+
+def icd10_chapter(code: str) -> Optional[Tuple[str, str]]:
+    """(chapter number, title) for a code's three-character category, or None if it is outside every chapter."""
+    category = code[:3].upper()
+    i = bisect.bisect_right(_ICD10_CHAPTER_STARTS, category) - 1
+    if i >= 0 and category <= _ICD10_CHAPTERS[i][1]: return _ICD10_CHAPTERS[i][2], _ICD10_CHAPTERS[i][3]
+    return None
+
+
+class Icd10Catalogue:
+    """
+    ICD-10 codes as one sorted fixed-width byte array (dots removed) plus a
+    description blob with offsets. Lookups are binary searches: an exact hit,
+    a category that prefixes stored codes, or the nearest stored parent of an
+    over-specific code. Without a catalogue file only a few built-in codes
+    have descriptions and other well-formed codes are accepted by chapter.
+    """
+
+    def __init__(self, codes: np.ndarray, offsets: np.ndarray, blob: bytes, complete: bool):
+        self.codes, self.offsets, self.blob, self.complete = codes, offsets, blob, complete
+
+    @classmethod
+    def from_entries(cls, entries: Dict[str, str], complete: bool) -> "Icd10Catalogue":
+        items = sorted((code.replace(".", "").upper(), desc.strip()) for code, desc in entries.items())
+        encoded = [desc.encode() for _, desc in items]
+        offsets = np.zeros(len(items) + 1, dtype=np.int64); np.cumsum([len(d) for d in encoded], out=offsets[1:])
+        return cls(np.array([code.encode() for code, _ in items], dtype="S8"), offsets, b"".join(encoded), complete)
+
+    def _description(self, i: int) -> str:
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].decode()
+
+    def lookup(self, code: str) -> Optional[dict]:
+        """{"code", "level", "description", "chapter", "chapter_title"} for a valid code, else None."""
+        key = code.replace(".", "").upper().encode(); chapter = icd10_chapter(code)
+        if chapter is None: return None
+        result = {"code": code, "chapter": chapter[0], "chapter_title": chapter[1], "description": None, "level": None}
+        i = int(np.searchsorted(self.codes, key))
+        if i < len(self.codes) and self.codes[i] == key:
+            result.update(level="exact", description=self._description(i))
+        elif i < len(self.codes) and self.codes[i].startswith(key):
+            result.update(level="category", description=self._description(i)) # First stored code under this category
+        else:
+            for length in range(len(key) - 1, 2, -1): # Over-specific code: fall back to the nearest stored parent
+                j = int(np.searchsorted(self.codes, key[:length]))
+                if j < len(self.codes) and self.codes[j] == key[:length]:
+                    result.update(level="parent", description=self._description(j)); break
+            else:
+                if self.complete: return None # Well-formed but not a real code (e.g. part of a registration number)
+                result["level"] = "chapter_only"
+        return result
+
+    def stats(self) -> dict:
+        return {"codes": len(self.codes), "description_bytes": len(self.blob), "complete": self.complete}
+
+
+def _read_icd10_file(path: str) -> Dict[str, str]:
+    entries = {}
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            m = _ICD_FILE_CODE_RE.match(line.rstrip("\n"))
+            if m: entries.setdefault(m.group(1), m.group(2).strip().strip('"'))
+    return entries
+
+def load_icd10_catalogue(path: str = ICD10_CATALOGUE_PATH) -> Tuple[Icd10Catalogue, dict]:
+    """Loads the catalogue from its NumPy cache under KB_CACHE_DIR, parsing the source file only when it changed."""
+    start = time.perf_counter()
+    if not path:
+        catalogue = Icd10Catalogue.from_entries(_ICD10_BUILTIN, complete=False)
+        return catalogue, {"source": "built-in", "from_cache": False, "load_ms": round((time.perf_counter() - start) * 1000, 1)}
+    st = os.stat(path)
+    fingerprint = hashlib.sha256(f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest()[:24]
+    cache_path = os.path.join(KB_CACHE_DIR, f"icd10-{fingerprint}.npz")
+    try:
+        with np.load(cache_path) as cached:
+            catalogue = Icd10Catalogue(cached["codes"], cached["offsets"], cached["blob"].tobytes(), complete=True)
+        from_cache = True
+    except (OSError, KeyError, ValueError):
+        catalogue = Icd10Catalogue.from_entries(_read_icd10_file(path), complete=True); from_cache = False
+        try:
+            os.makedirs(KB_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp.npz"
+            np.savez(tmp_path, codes=catalogue.codes, offsets=catalogue.offsets, blob=np.frombuffer(catalogue.blob, dtype=np.uint8))
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"Warning: Could not cache ICD-10 catalogue: {e}")
+    return catalogue, {"source": path, "from_cache": from_cache, "load_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+
+def icd_description_matches(entry: dict, diagnoses: List[str]) -> Optional[bool]:
+    """Whether any significant word of the code's description (or its chapter's, if it has none) occurs in the diagnoses; None if unknown."""
+    if not entry["description"]: return None
+    words = {w[:5] for w in _ICD_WORD_RE.findall(entry["description"].lower()) if w not in _ICD_DESCRIPTION_STOPWORDS} # 5-char stems: "diabetic" ~ "diabetes"
+    if not words: return None
+    diag_stems = {w[:5] for d in diagnoses for w in _ICD_WORD_RE.findall(d.lower())}
+    return bool(words & diag_stems)
+
+
+_icd10_catalogue: Optional[Tuple[Icd10Catalogue, dict]] = None
+_icd10_catalogue_lock = threading.Lock()
+
+def get_icd10_catalogue() -> Icd10Catalogue:
+    global _icd10_catalogue
+    if _icd10_catalogue is None:
+        with _icd10_catalogue_lock:
+            if _icd10_catalogue is None:
+                _icd10_catalogue = load_icd10_catalogue()
+    return _icd10_catalogue[0]
+
+
+@app.on_event("startup")
+async def load_icd10():
+    try: await asyncio.to_thread(get_icd10_catalogue)
+    except Exception as e: print(f"Warning: ICD-10 catalogue not preloaded. {e}")
+
+
+@app.get("/icd10")
+def get_icd10_stats(code: Optional[str] = None):
+    catalogue = get_icd10_catalogue()
+    return {**catalogue.stats(), **_icd10_catalogue[1], **({"lookup": catalogue.lookup(code)} if code else {})}
+
+
+# --- NEW: Page-streaming PDF text extraction ---
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "0")) # 0 = no limit
+PDF_MAX_TEXT_BYTES = int(os.getenv("PDF_MAX_TEXT_BYTES", "0")) # 0 = no limit
+# Stop reading once these are all found, e.g. "provider_name,bill_date,total_amount". Empty = read every page.
+PDF_REQUIRED_FIELDS = tuple(f.strip() for f in os.getenv("PDF_REQUIRED_FIELDS", "").split(",") if f.strip())
+_TOTAL_LABEL_RE = re.compile(r"net amount|total amount|net payable", re.IGNORECASE)
+
+def iter_pdf_page_text(pdf_content: bytes, max_pages: int = 0) -> Iterator[Tuple[int, int, str]]:
+    """Yields (page_number, page_count, text) one page at a time, loading each page only when asked for it."""
+    with fitz.open(stream=pdf_content, filetype="pdf") as doc:
+        page_count = doc.page_count
+        for page_number in range(page_count if not max_pages else min(page_count, max_pages)):
+            yield page_number, page_count, doc.load_page(page_number).get_text("text") or ""
+
+
+class ImageOnlyPdfError(ValueError):
+    """No page had a text layer; `pages` lists the pages an OCR pass could recover."""
+
+    def __init__(self, message: str, pages: List[int]):
+        super().__init__(message, pages) # Both in args so the error survives process-pool pickling
+        self.pages = pages
+
+    def __str__(self):
+        return self.args[0]
+
+
+class _RequiredFieldTracker:
+    """Per-page detectors telling the page streamer when the configured required fields have all been seen."""
+
+    FIELDS = ("provider_name", "bill_date", "total_amount", "doc_reg_id", "diagnoses")
+
+    def __init__(self, required: Tuple[str, ...]):
+        unknown = set(required) - set(self.FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown PDF_REQUIRED_FIELDS {sorted(unknown)}; expected some of {self.FIELDS}.")
+        self.missing = set(required)
+        self._total_label_pending = False
+
+    def feed(self, page_text: str) -> bool:
+        """Inspects one page; returns True once every required field has been found."""
+        self.missing.discard("provider_name") # Always decided by the first lines of the first page with text
+        if "bill_date" in self.missing and _BILL_DATE_RE.search(page_text): self.missing.discard("bill_date")
+        if "doc_reg_id" in self.missing and _REG_ID_RE.search(page_text): self.missing.discard("doc_reg_id")
+        if "diagnoses" in self.missing and "diagnosis" in page_text.lower(): self.missing.discard("diagnoses")
+        if "total_amount" in self.missing:
+            label = _TOTAL_LABEL_RE.search(page_text)
+            if label: self._total_label_pending = True
+            # The amount may follow the label on the same page or spill onto the next one
+            if self._total_label_pending and _TOTAL_AMOUNT_RE.search(page_text, label.end() if label else 0):
+                self.missing.discard("total_amount")
+        return not self.missing
+
+
+# --- NEW: Rule registry (declarative rules, per-rule timing, config-driven weights) ---
+RULES_CONFIG_PATH = os.getenv("RULES_CONFIG_PATH") or None
+RULE_PARALLELISM = int(os.getenv("RULE_PARALLELISM", "1")) # >1 runs independent rules on a thread pool
+RULE_ERROR_WEIGHT = 5
+
+
+class RuleSpec:
+    """Declaration of one rule: what it reads, what its findings weigh, and what must run before it."""
+
+    def __init__(self, name: str, number: Optional[int], func, inputs: Tuple[str, ...], weights: Dict[str, int], depends_on: Tuple[str, ...]):
+        self.name = name
+        self.number = number
+        self.func = func
+        self.inputs = inputs
+        self.weights = weights
+        self.depends_on = depends_on
+
+
+class RuleResult:
+    """What a single rule contributed to a claim. Rules write here instead of to the engine."""
+
+    __slots__ = ("weights", "score", "red_flags", "analysis")
+
+    def __init__(self, weights: Dict[str, int]):
+        self.weights = weights
+        self.score = 0
+        self.red_flags: List[str] = []
+        self.analysis: List[str] = []
+
+    def flag(self, weight_key: str, message: str):
+        self.score += self.weights.get(weight_key, 0)
+        self.red_flags.append(message)
+
+    def note(self, line: str):
+        self.analysis.append(line)
+
+
+class RulePlan:
+    """Effective rule set after applying configuration: report order, enabled rules, dependency levels."""
+
+    def __init__(self, order: List[RuleSpec], disabled: set, weights: Dict[str, Dict[str, int]], levels: List[List[RuleSpec]], error_weight: int):
+        self.order = order
+        self.disabled = disabled
+        self.weights = weights
+        self.levels = levels
+        self.error_weight = error_weight
+
+
+class RuleRegistry:
+    """
+    Holds every declared rule and turns it into a `RulePlan`.
+
+    Rules are declared with the `@rule(...)` decorator on RuleEngine methods and
+    run in declaration order unless the config file sets `"order"`. The optional
+    JSON config (RULES_CONFIG_PATH) can disable rules or override weights without a
+    redeploy; it is re-read when its mtime changes:
+
+        {"order": ["identity", ...], "error_weight": 5,
+         "rules": {"duplicate_document": {"enabled": false}, "identity": {"weights": {"mismatch": 60}}}}
+    """
+
+    def __init__(self, config_path: Optional[str] = None, reload_check_seconds: float = 2.0):
+        self.specs: Dict[str, RuleSpec] = {}
+        self.config_path = config_path
+        self.reload_check_seconds = reload_check_seconds
+        self._lock = threading.Lock()
+        self._plan: Optional[RulePlan] = None
+        self._config_signature = None
+        self._last_check = 0.0
+
+    def register(self, spec: RuleSpec):
+        if spec.name in self.specs:
+            raise ValueError(f"Rule '{spec.name}' is already registered.")
+        self.specs[spec.name] = spec
+        self._plan = None
+
+    def _read_config(self) -> dict:
+        if not self.config_path: return {}
+        try:
+            with open(self.config_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _build_plan(self, config: dict) -> RulePlan:
+        rule_config = config.get("rules", {})
+        unknown = (set(rule_config) | set(config.get("order", []))) - set(self.specs)
+        if unknown:
+            print(f"Warning: Rule config mentions unknown rules: {sorted(unknown)}")
+        ordered_names = [n for n in config.get("order", []) if n in self.specs]
+        ordered_names += [n for n in self.specs if n not in ordered_names]
+        disabled = {n for n, c in rule_config.items() if n in self.specs and c.get("enabled", True) is False}
+        weights = {n: {**spec.weights, **rule_config.get(n, {}).get("weights", {})} for n, spec in self.specs.items()}
+
+        # Dependency levels: each level only needs rules from earlier levels, so its members can run together
+        position = {n: i for i, n in enumerate(ordered_names)}
+        level_of: Dict[str, int] = {}
+        def level(name: str, visiting: Tuple[str, ...] = ()) -> int:
+            if name in visiting: raise ValueError(f"Rule dependency cycle: {' -> '.join(visiting + (name,))}")
+            if name not in level_of:
+                deps = [d for d in self.specs[name].depends_on if d in self.specs and d not in disabled]
+                level_of[name] = 1 + max((level(d, visiting + (name,)) for d in deps), default=-1)
+            return level_of[name]
+        levels: List[List[RuleSpec]] = []
+        for name in ordered_names:
+            if name in disabled: continue
+            lvl = level(name)
+            while len(levels) <= lvl: levels.append([])
+            levels[lvl].append(self.specs[name])
+        # Report order respects dependencies, using the configured order as the tiebreak
+        order = sorted((self.specs[n] for n in ordered_names), key=lambda s: (level_of.get(s.name, 0), position[s.name]))
+        return RulePlan(order, disabled, weights, levels, int(config.get("error_weight", RULE_ERROR_WEIGHT)))
+
+    def plan(self) -> RulePlan:
+        """Returns the current plan, rebuilding it if the config file changed."""
+        now = time.monotonic()
+        if self._plan is not None and (not self.config_path or now - self._last_check < self.reload_check_seconds):
+            return self._plan
+        with self._lock:
+            signature = None
+            if self.config_path:
+                try:
+                    st = os.stat(self.config_path); signature = (st.st_mtime_ns, st.st_size)
+                except OSError:
+                    signature = None
+            self._last_check = now
+            if self._plan is None or signature != self._config_signature:
+                try:
+                    self._plan = self._build_plan(self._read_config())
+                    if self._config_signature is not None or signature is not None:
+                        print(f"Rule plan loaded ({len(self.specs) - len(self._plan.disabled)}/{len(self.specs)} rules enabled).")
+                except Exception as e:
+                    if self._plan is None: raise
+                    print(f"Warning: Keeping previous rule plan; config '{self.config_path}' is invalid. {e}")
+                self._config_signature = signature
+            return self._plan
+
+    def describe(self) -> List[dict]:
+        plan = self.plan()
+        return [{"name": s.name, "rule_number": s.number, "enabled": s.name not in plan.disabled, "inputs": list(s.inputs),
+                 "weights": plan.weights[s.name], "depends_on": list(s.depends_on)} for s in plan.order]
+
+
+class RuleStats:
+    """Process-wide per-rule wall time and outcome counters."""
+
+    OUTCOMES = ("clean", "flagged", "error", "disabled")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, dict] = {}
+
+    def record(self, timings: Dict[str, Tuple[float, str]]):
+        with self._lock:
+            for name, (elapsed_ms, outcome) in timings.items():
+                s = self._stats.setdefault(name, {"calls": 0, "total_ms": 0.0, "max_ms": 0.0, **{o: 0 for o in self.OUTCOMES}})
+                s["calls"] += 1; s[outcome] += 1
+                s["total_ms"] += elapsed_ms; s["max_ms"] = max(s["max_ms"], elapsed_ms)
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            return {n: {**s, "mean_ms": s["total_ms"] / s["calls"] if s["calls"] else 0.0} for n, s in self._stats.items()}
+
+
+RULE_REGISTRY = RuleRegistry(RULES_CONFIG_PATH)
+RULE_STATS = RuleStats()
+_rule_thread_pool: Optional[ThreadPoolExecutor] = None
+_rule_thread_pool_lock = threading.Lock()
+
+def rule(name: str, number: Optional[int] = None, inputs: Tuple[str, ...] = (), weights: Optional[Dict[str, int]] = None, depends_on: Tuple[str, ...] = ()):
+    """Declares a RuleEngine method as a rule. The method receives a RuleResult to write its findings to."""
+    def decorator(func):
+        RULE_REGISTRY.register(RuleSpec(name, number, func, tuple(inputs), dict(weights or {}), tuple(depends_on)))
+        return func
+    return decorator
+
+def _get_rule_thread_pool() -> ThreadPoolExecutor:
+    global _rule_thread_pool
+    if _rule_thread_pool is None:
+        with _rule_thread_pool_lock: # Engines on several executor threads may get here at once
+            if _rule_thread_pool is None:
+                _rule_thread_pool = ThreadPoolExecutor(max_workers=RULE_PARALLELISM, thread_name_prefix="rule")
+    return _rule_thread_pool
+
+
+# --- UPGRADED Rule Engine (MODIFIED __init__ and text extraction) ---
+class RuleEngine:
+    # MODIFIED: Takes pdf_content directly
+    def __init__(self, pdf_content: bytes, abha_data: AbhaRecord, ocr_pages: Optional[Dict[int, str]] = None, trace: bool = False, claim_ref: Optional[str] = None):
+        self.pdf_content = pdf_content
+        self.claim_ref = claim_ref # Caller's claim id, if any; only a re-verification of the same claim may reuse a document
+        self.ocr_pages = ocr_pages or {} # page number -> OCR text, used for pages without a text layer
+        self.extraction_report = {"pages_total": 0, "pages_read": 0, "pages_without_text": [], "pages_ocr": [], "stopped_early": None}
+        self.trace_spans: Optional[List[Tuple[str, int, int, dict]]] = [] if trace else None # (name, start ns, duration ns, attrs); see Trace.graft
+        # Extract text internally using a new private method
+        start_ns, start = time.time_ns(), time.perf_counter_ns()
+        self.pdf_text = self._extract_text_from_pdf_internal()
+        if self.trace_spans is not None:
+            self.trace_spans.append(("extract.text", start_ns, time.perf_counter_ns() - start, {"pages": self.extraction_report["pages_read"], "chars": len(self.pdf_text)}))
+        if not self.pdf_text:
+            message = "Could not extract text from the provided PDF content. Is it an image PDF?"
+            if self.extraction_report["pages_without_text"]:
+                raise ImageOnlyPdfError(message, self.extraction_report["pages_without_text"])
+            raise ValueError(message)
+        self.pdf_lower = self.pdf_text.lower()
+        self.abha = abha_data
+
+        self.risk_score = 0
+        self.detailed_analysis = []
+        self.red_flags = []
+        self.rule_results: Dict[str, RuleResult] = {}
+        self.rule_timings: Dict[str, Tuple[float, str]] = {} # rule name -> (wall ms, outcome)
+        self.artifacts: Dict[str, Any] = {} # Rule by-products the API process stores after scoring (e.g. the MinHash signature)
+
+        self.extracted = {
+            "total_amount": 0.0, "age": None, "bill_date": None,
+            "provider_name": "UNKNOWN", "doc_reg_id": None,
+            "diagnoses": [], "medications": [], "file_hash": None,
+            "admission_date": None, "discharge_date": None, "line_items": [],
+        }
+        self.signals: Dict[str, Any] = {} # Internal scan output (ICD codes, keywords seen, ...), filled with self.extracted
+        self.policy = get_policy(abha_data.abha_id)
+
+    # NEW: Internal text extraction method (streams pages; see iter_pdf_page_text)
+    def _extract_text_from_pdf_internal(self) -> str:
+        page_texts = []; used_bytes = 0
+        tracker = _RequiredFieldTracker(PDF_REQUIRED_FIELDS) if PDF_REQUIRED_FIELDS else None
+        report = self.extraction_report
+        try:
+            for page_number, page_count, page_text in iter_pdf_page_text(self.pdf_content, PDF_MAX_PAGES):
+                report["pages_total"] = page_count; report["pages_read"] = page_number + 1
+                if not page_text.strip():
+                    page_text = self.ocr_pages.get(page_number) or ""
+                    if not page_text.strip():
+                        print(f"Warning: Page {page_number} seems to have no extractable text.")
+                        report["pages_without_text"].append(page_number) # Candidates for the OCR fallback
+                        continue
+                    report["pages_ocr"].append(page_number)
+                if PDF_MAX_TEXT_BYTES:
+                    page_bytes = len(page_text.encode('utf-8'))
+                    if used_bytes + page_bytes > PDF_MAX_TEXT_BYTES:
+                        page_text = page_text.encode('utf-8')[:PDF_MAX_TEXT_BYTES - used_bytes].decode('utf-8', 'ignore')
+                        page_texts.append(page_text); report["stopped_early"] = "byte_budget"; break
+                    used_bytes += page_bytes
+                page_texts.append(page_text)
+                if tracker is not None and tracker.feed(page_text):
+                    report["stopped_early"] = "required_fields_found"; break
+            if not report["stopped_early"] and report["pages_read"] < report["pages_total"]:
+                report["stopped_early"] = "max_pages"
+        except Exception as e:
+            print(f"Error extracting PDF text internally: {e}")
+            # Do not raise HTTPException here, let the __init__ handle it
+            return "" # Return empty string on failure
+        return "".join(page_texts)
+
+    def run_all_checks(self) -> Tuple[int, List[str], List[str]]:
+        """Runs every enabled rule in the registry and merges their results in plan order."""
+        start_ns, start = time.time_ns(), time.perf_counter_ns()
+        self._extract_data_from_pdf() # Populates self.extracted
+        if self.trace_spans is not None:
+            self.trace_spans.append(("extract.fields", start_ns, time.perf_counter_ns() - start, {}))
+        plan = RULE_REGISTRY.plan()
+        for level in plan.levels:
+            if RULE_PARALLELISM > 1 and len(level) > 1:
+                list(_get_rule_thread_pool().map(lambda spec: self._run_rule(spec, plan), level))
+            else:
+                for spec in level: self._run_rule(spec, plan)
+        for spec in plan.order:
+            if spec.name in plan.disabled:
+                self.rule_timings[spec.name] = (0.0, "disabled")
+                self.detailed_analysis.append(f"Analysis ({spec.name}): SKIPPED - Disabled by rule configuration.")
+                continue
+            result = self.rule_results[spec.name]
+            self.risk_score += result.score; self.red_flags.extend(result.red_flags); self.detailed_analysis.extend(result.analysis)
+        return self.risk_score, self.detailed_analysis, self.red_flags
+
+    def _run_rule(self, spec: RuleSpec, plan: RulePlan):
+        result = RuleResult(plan.weights[spec.name])
+        start = time.perf_counter(); outcome = "clean"
+        try:
+            spec.func(self, result)
+            if result.red_flags: outcome = "flagged"
+        except Exception as e:
+            result.note(f"Analysis ({spec.func.__name__}): FAILED with error: {e}"); result.score += plan.error_weight; outcome = "error"
+        self.rule_results[spec.name] = result
+        elapsed = time.perf_counter() - start
+        self.rule_timings[spec.name] = (elapsed * 1000, outcome)
+        if self.trace_spans is not None:
+            self.trace_spans.append((f"rule.{spec.name}", time.time_ns() - int(elapsed * 1e9), int(elapsed * 1e9), {"outcome": outcome, "score": result.score}))
+
+    def _extract_data_from_pdf(self):
+        try: self.extracted["age"] = relativedelta(datetime.now(), date_parse(self.abha.dob, dayfirst=True)).years
+        except: pass
+        self.extracted["file_hash"] = hashlib.sha256(self.pdf_content).hexdigest()
+        # One pass over the text; the checks below only read self.extracted and self.signals
+        self.signals = scan_bill_text(self.pdf_text, self.pdf_lower)
+        for field in ("provider_name", "total_amount", "bill_date", "doc_reg_id", "diagnoses", "medications"):
+            self.extracted[field] = self.signals.pop(field)
+        self.extracted["line_items"] = extract_line_items(self.pdf_text)
+
+
+    # --- Rules: each declares its inputs and weights, and writes findings to its RuleResult ---
+    @rule("identity", 1, inputs=("pdf_text", "abha.name", "abha.dob", "abha.address"), weights={"mismatch": 70})
+    def _check_identity(self, r: RuleResult): # Rule 1
+        alerts = [];
+        if self.abha.name.lower() not in self.pdf_lower: alerts.append("Name Mismatch")
+        if self.abha.dob not in self.pdf_text: alerts.append("DOB Mismatch")
+        try:
+            abha_city = self.abha.address.split(',')[-1].strip().lower()
+            if abha_city not in self.pdf_lower: alerts.append(f"City Mismatch ('{abha_city}')")
+        except: pass
+        if alerts: r.flag("mismatch", f"Identity Fail: {', '.join(alerts)}.")
+        r.note("Analysis (Rule 1): Checked Bill vs ABHA identity (Name, DOB, City).")
+
+    @rule("medical_history", 2, inputs=("extracted.diagnoses", "extracted.medications", "abha.past_diagnoses", "abha.medications"),
+          weights={"diagnosis_mismatch": 15, "medication_mismatch": 10})
+    def _check_medical_history(self, r: RuleResult): # Rule 2
+        abha_diags_desc = [d.description.lower() for d in self.abha.past_diagnoses]; abha_meds = [m.lower() for m in self.abha.medications]; alerts_diag = []; alerts_med = []
+        pdf_diags_found = {diag: False for diag in self.extracted["diagnoses"]}
+        for pdf_diag in self.extracted["diagnoses"]:
+            found_in_abha = any(pdf_diag in abha_diag for abha_diag in abha_diags_desc);
+            if not found_in_abha: alerts_diag.append(pdf_diag)
+            pdf_diags_found[pdf_diag] = found_in_abha
+        if alerts_diag: r.flag("diagnosis_mismatch", f"History Mismatch (Diagnosis): '{', '.join(alerts_diag)}' not in ABHA history.")
+        r.note(f"Analysis (Rule 2a - Diagnoses): Checked PDF diagnoses vs ABHA. Matches: {pdf_diags_found}")
+        pdf_meds_found = {med: False for med in self.extracted["medications"]}
+        for pdf_med in self.extracted["medications"]:
+             found_in_abha = pdf_med in abha_meds;
+             if not found_in_abha: alerts_med.append(pdf_med)
+             pdf_meds_found[pdf_med] = found_in_abha
+        if alerts_med: r.flag("medication_mismatch", f"History Mismatch (Medication): '{', '.join(alerts_med)}' not in ABHA history.")
+        r.note(f"Analysis (Rule 2b - Medications): Checked PDF medications vs ABHA. Matches: {pdf_meds_found}")
+
+    @rule("medication_disease_consistency", 5, inputs=("extracted.medications", "extracted.diagnoses"), weights={"mismatch": 10})
+    def _check_medication_disease_consistency(self, r: RuleResult): # Rule 5
+        if not self.extracted["medications"] or not self.extracted["diagnoses"]: return
+        unsupported = get_knowledge_base().unsupported_drugs(self.extracted["medications"], self.extracted["diagnoses"])
+        alerts = [f"'{med}' vs {self.extracted['diagnoses']}" for med in unsupported]
+        if alerts: r.flag("mismatch", f"Logic Warn (Drug-Disease): Mismatches found - {'; '.join(alerts)}.")
+        r.note("Analysis (Rule 5): Checked Medication vs. Diagnosis consistency on the bill.")
+
+    @rule("age_vs_disease", 19, inputs=("extracted.age", "extracted.diagnoses"), weights={"implausible": 40})
+    def _check_age_vs_disease(self, r: RuleResult): # Rule 19
+        age = self.extracted["age"];
+        if not age or not self.extracted["diagnoses"]: return;
+        main_diag = self.extracted["diagnoses"][0]; age_range = get_knowledge_base().age_range(main_diag)
+        if age_range:
+            term, min_age, max_age = age_range
+            if not (min_age <= age <= max_age): r.flag("implausible", f"Logic Fail (Age-Disease): Patient age ({age}) is not plausible for '{term}' (Expected: {min_age}-{max_age}).")
+        r.note(f"Analysis (Rule 19): Checked Age ({age}) vs. Primary Diagnosis ('{main_diag}').")
+
+    @rule("treatment_duration", 6, inputs=("signals.keywords", "extracted.admission_date", "extracted.discharge_date"), weights={"unclear": 5})
+    def _check_treatment_duration(self, r: RuleResult): # Rule 6
+        if self.signals["keywords"] & {"opd", "outpatient", "consultation"}: r.note("Analysis (Rule 6): Treatment duration identified as 'OPD' (plausible).")
+        elif self.extracted["admission_date"] and self.extracted["discharge_date"]: r.note("Analysis (Rule 6): SKIPPED - In-patient duration logic vs diagnosis not yet implemented.")
+        else: r.flag("unclear", "Logic Warn: Treatment type (OPD/In-patient) is unclear from PDF."); r.note("Analysis (Rule 6): Could not clearly determine treatment duration type (OPD/Inpatient).")
+
+    @rule("invoice_structure", 22, inputs=("signals.keywords", "signals.has_bill_id", "extracted.total_amount", "extracted.provider_name", "abha.dob"),
+          weights={"missing_fields": 10})
+    def _check_invoice_structure(self, r: RuleResult): # Rule 22
+        missing = []; keywords = self.signals["keywords"]
+        if not self.signals["has_bill_id"]: missing.append("Bill ID")
+        if "patient name" not in keywords: missing.append("Patient Name")
+        if self.extracted["total_amount"] == 0: missing.append("Total Amount")
+        if not keywords & {"doctor", "dr."}: missing.append("Doctor Details")
+        if self.extracted["provider_name"] == "UNKNOWN": missing.append("Provider Name")
+        if not keywords & {"date of birth", "dob"} and self.abha.dob not in self.pdf_text: missing.append("Patient DOB")
+        if missing: r.flag("missing_fields", f"Authenticity Warn (Invoice Structure): Missing standard fields: {', '.join(missing)}.");
+        r.note("Analysis (Rule 22): Checked basic invoice structure.")
+
+    @rule("lab_result_consistency", 20, inputs=("extracted.diagnoses", "signals.keywords"), weights={"missing_tests": 5})
+    def _check_lab_result_consistency(self, r: RuleResult): # Rule 20
+        alerts = []; has_asthma = any("asthma" in d for d in self.extracted["diagnoses"]); has_hypertension = any("hypertension" in d for d in self.extracted["diagnoses"]); has_diabetes = any("diabetes" in d for d in self.extracted["diagnoses"]);
+        keywords = self.signals["keywords"]; mentions_spirometry = bool(keywords & {"spirometry", "pft"}); mentions_bp = bool(keywords & {"blood pressure", " bp "}); mentions_hba1c = bool(keywords & {"hba1c", "glycated hemoglobin"});
+        if has_asthma and not mentions_spirometry: alerts.append("Spirometry/PFT for Asthma")
+        if has_hypertension and not mentions_bp: alerts.append("BP Check for Hypertension")
+        if has_diabetes and not mentions_hba1c: alerts.append("HbA1c for Diabetes")
+        if alerts: r.flag("missing_tests", f"Logic Warn (Lab Consistency): Expected tests missing: {', '.join(alerts)}.");
+        r.note("Analysis (Rule 20): Checked for expected tests based on diagnosis.")
+
+    @rule("icd_code_consistency", 15, inputs=("signals.icd_codes", "extracted.diagnoses"), weights={"no_codes": 5, "mismatch": 10})
+    def _check_icd_code_consistency(self, r: RuleResult): # Rule 15
+        catalogue = get_icd10_catalogue(); codes: Dict[str, dict] = {}
+        for code in self.signals["icd_codes"]:
+            if code not in codes:
+                entry = catalogue.lookup(code)
+                if entry: codes[code] = entry
+        if not codes: r.flag("no_codes", "Authenticity Warn: No valid ICD-10 codes found."); r.note("Analysis (Rule 15): No ICD codes found."); return
+        alerts = [f"{code} code present but '{entry['description']}' diagnosis missing/mismatched"
+                  for code, entry in codes.items() if icd_description_matches(entry, self.extracted["diagnoses"]) is False]
+        if alerts: r.flag("mismatch", f"Logic Warn (ICD Consistency): Issues found - {'; '.join(alerts)}.");
+        found = [f"{code} (Ch. {entry['chapter']})" for code, entry in codes.items()]
+        r.note(f"Analysis (Rule 15): Checked ICD codes vs diagnosis text. Codes Found: {found}")
+
+    @rule("policy_compliance", 29, inputs=("policy", "extracted.bill_date", "extracted.total_amount"), weights={"violation": 100})
+    def _check_policy_compliance(self, r: RuleResult): # Rule 29
+        if not self.policy: r.note("Analysis (Rule 29): SKIPPED - Policy data not found for user in Mock DB."); return
+        alerts = []
+        try:
+            wait_days = self.policy.get("waiting_period_days", 30); policy_start = date_parse(self.policy.get("start_date", "1900-01-01"), dayfirst=True); claim_date = self.extracted["bill_date"] or datetime.now(); sum_insured = self.policy.get("sum_insured", float('inf'));
+            if (claim_date - policy_start).days < wait_days: alerts.append(f"Claim within {wait_days}-day waiting period")
+            if self.extracted["total_amount"] > sum_insured: alerts.append(f"Amount > Sum Insured (₹{sum_insured})")
+            if alerts: r.flag("violation", f"Policy Fail: {'; '.join(alerts)}.");
+            r.note("Analysis (Rule 29): Checked policy compliance (Waiting Period, Sum Insured).")
+        except Exception as e: r.note(f"Analysis (Rule 29): ERROR during policy check - {e}")
+
+    @rule("prescriber_authenticity", 14, inputs=("extracted.doc_reg_id",), weights={"unverified": 10, "suspended": 50})
+    def _check_prescriber_authenticity(self, r: RuleResult): # Rule 14
+        reg_id = self.extracted["doc_reg_id"];
+        if not reg_id: r.note("Analysis (Rule 14): SKIPPED - Doctor Registration ID not found on PDF."); return;
+        try: registered_id, doc_info = provider_registry.find_doctor(reg_id)
+        except Exception as e: r.note(f"Analysis (Rule 14): SKIPPED - Medical council registry unavailable ({e})."); return
+        if not doc_info: r.flag("unverified", f"Authenticity Warn: Doctor's license ({reg_id}) could not be verified in the medical council registry.")
+        elif doc_info.get("status") == "SUSPENDED": r.flag("suspended", f"Authenticity Fail: Doctor's license ({registered_id} - {doc_info.get('name')}) is SUSPENDED.")
+        matched = f", matched {registered_id}" if registered_id and registered_id != reg_id else ""
+        r.note(f"Analysis (Rule 14): Checked doctor's license status ({reg_id}{matched}) via the medical council registry.")
+
+    @rule("provider_behavior", 7, inputs=("extracted.provider_name",), weights={"unknown": 5, "high_risk": 30, "moderate_risk": 15})
+    def _check_provider_behavior(self, r: RuleResult): # Rule 7
+        provider = self.extracted["provider_name"];
+        if provider == "UNKNOWN": r.note("Analysis (Rule 7): SKIPPED - Provider name not clearly extracted from PDF."); return;
+        try: registered_name, risk_data, similarity = provider_registry.find_provider(provider)
+        except Exception as e: r.note(f"Analysis (Rule 7): SKIPPED - Provider registry unavailable ({e})."); return
+        if not risk_data: r.flag("unknown", f"External Warn: Provider '{provider}' not found in the provider registry.")
+        else:
+            provider_risk = risk_data.get("risk_score", 0);
+            if provider_risk > 80: r.flag("high_risk", f"External Risk: Provider '{registered_name}' has a high fraud risk score ({provider_risk}).")
+            elif provider_risk > 50: r.flag("moderate_risk", f"External Warn: Provider '{registered_name}' has moderate fraud risk ({provider_risk}).")
+        matched = f", matched '{registered_name}' at {similarity:.0%} similarity" if risk_data and similarity < 1.0 else ""
+        r.note(f"Analysis (Rule 7): Checked provider '{provider}' risk score via the provider registry{matched}.")
+
+    @rule("outlier_pricing", 26, inputs=("extracted.line_items", "abha.address"), weights={"overpriced": 15})
+    def _check_outlier_pricing(self, r: RuleResult): # Rule 26
+        items = self.extracted["line_items"]; table = get_price_table()
+        if table is None or not items:
+            r.note("Analysis (Rule 26): SKIPPED - Outlier line-item pricing (No price table or no line items found)."); return
+        scored = table.score(items, _city_of(self.abha.address))
+        outliers = [s for s in scored if s["z"] >= PRICE_Z_THRESHOLD]
+        if outliers:
+            details = "; ".join(f"'{s['item']}' at ₹{s['unit_price']:,.2f}/unit vs typical ₹{s['typical_price']:,.2f} ({s['scope']})" for s in outliers[:5])
+            r.flag("overpriced", f"Cost Warn (Outlier Pricing): {details}.")
+        r.note(f"Analysis (Rule 26): Priced {len(scored)} of {len(items)} line item(s) against the price table.")
+
+    @rule("claim_frequency", 4, inputs=("abha.abha_id", "extracted.bill_date"), weights={"high_frequency": 20})
+    def _check_claim_frequency(self, r: RuleResult): # Rule 4
+        history = get_claim_history(); bill_date = self.extracted["bill_date"]
+        if history is None or not bill_date: r.note("Analysis (Rule 4): Checked claim frequency (No claim history or bill date)."); return
+        # Claims billed 1..N days before this one; same-day re-verifications of this bill don't count
+        claims_in_window, _ = history.claims_between(self.abha.abha_id, bill_date - timedelta(days=CLAIM_FREQUENCY_WINDOW_DAYS), bill_date - timedelta(days=1))
+        if claims_in_window >= 2: r.flag("high_frequency", f"History Risk: High claim frequency ({claims_in_window + 1} claims within ~{CLAIM_FREQUENCY_WINDOW_DAYS} days).")
+        r.note(f"Analysis (Rule 4): Checked claim frequency ({claims_in_window} other claims in ~{CLAIM_FREQUENCY_WINDOW_DAYS} days found in claim history).")
+
+    @rule("previous_diagnosis_conflict", 12, inputs=("extracted.diagnoses", "abha.past_diagnoses"), weights={"unrelated": 10})
+    def _check_previous_diagnosis_conflict(self, r: RuleResult): # Rule 12
+        abha_diags_str = " ".join(d.description.lower() for d in self.abha.past_diagnoses); pdf_diags_str = " ".join(self.extracted["diagnoses"]); is_unrelated = False
+        if "arthritis" in pdf_diags_str and "arthritis" not in abha_diags_str and "diabetes" in abha_diags_str: is_unrelated = True
+        if "cancer" in pdf_diags_str and "cancer" not in abha_diags_str and "hypertension" in abha_diags_str: is_unrelated = True
+        if is_unrelated: r.flag("unrelated", "History Warn: Claim diagnosis seems unrelated to known chronic conditions in ABHA.");
+        r.note("Analysis (Rule 12): Basic check for conflict between new claim and chronic history.")
+
+    @rule("medication_refill_velocity", 13, inputs=("abha.abha_id", "extracted.bill_date", "extracted.medications"), weights={"early_refill": 10})
+    def _check_medication_refill_velocity(self, r: RuleResult): # Rule 13
+        history = get_claim_history(); bill_date = self.extracted["bill_date"]
+        if history is None or not bill_date or not self.extracted["medications"]:
+            r.note("Analysis (Rule 13): SKIPPED - Medication refill velocity (No claim history, bill date or medications)."); return
+        early = []
+        for med in self.extracted["medications"]:
+            fills = history.fill_days_before(self.abha.abha_id, med, bill_date)
+            if not fills.size: continue
+            since_last = bill_date.toordinal() - int(fills[-1])
+            if fills.size >= 3: # Two or more past intervals: compare with this patient's usual pace
+                usual = float(np.median(np.diff(fills)))
+                if since_last < REFILL_EARLY_FRACTION * usual: early.append(f"{med} after {since_last} days (usual ~{usual:.0f})")
+            elif since_last < REFILL_MIN_DAYS:
+                early.append(f"{med} after {since_last} days")
+        if early: r.flag("early_refill", f"History Warn (Refill Velocity): Early refill of {'; '.join(early)}.")
+        r.note(f"Analysis (Rule 13): Checked refill intervals for {len(self.extracted['medications'])} medication(s) against claim history.")
+
+    @rule("document_tampering", 8, inputs=("signals.non_ascii_count",), weights={"unusual_characters": 5})
+    def _check_document_tampering(self, r: RuleResult): # Rule 8
+        non_ascii_count = self.signals["non_ascii_count"];
+        if non_ascii_count > 20: r.flag("unusual_characters", f"Authenticity Warn (Tampering?): High count ({non_ascii_count}) of unusual characters found.");
+        r.note("Analysis (Rule 8): Basic check for signs of document tampering (unusual character count).")
+
+    @rule("duplicate_document", 10, inputs=("extracted.file_hash", "abha.abha_id", "claim_ref"), weights={"duplicate": 100})
+    def _check_duplicate_document(self, r: RuleResult): # Rule 10
+        file_hash = self.extracted["file_hash"]; index = get_duplicate_index()
+        if index is None:
+            r.note("Analysis (Rule 10): SKIPPED - Duplicate document index unavailable."); return
+        seen = index.lookup(file_hash)
+        # Only a re-verification of the claim the document was first submitted with is exempt; any other claim on it, same patient or not, is a duplicate
+        reverification = seen is not None and self.claim_ref is not None and (seen[0], seen[1]) == (self.abha.abha_id, self.claim_ref)
+        if seen and not reverification:
+            first_seen = datetime.fromtimestamp(seen[2]).strftime("%d-%m-%Y") if seen[2] else "unknown date"
+            r.flag("duplicate", f"Authenticity Fail (Duplicate): Document hash {file_hash[:8]}... already submitted (Claim {seen[1] or 'unknown'}, first seen {first_seen}).")
+        r.note("Analysis (Rule 10): Checked document hash against the duplicate document index.")
+
+    @rule("narrative_similarity", 23, inputs=("pdf_text", "abha.abha_id", "extracted.file_hash"), weights={"near_duplicate": 30})
+    def _check_narrative_similarity(self, r: RuleResult): # Rule 23
+        index = get_near_duplicate_index()
+        if index is None:
+            r.note("Analysis (Rule 23): SKIPPED - Near-duplicate index unavailable."); return
+        signature = minhash_signature(self.pdf_text, index.permutations)
+        if signature is None:
+            r.note("Analysis (Rule 23): SKIPPED - No words to compare."); return
+        self.artifacts["minhash"] = signature.tobytes() # Stored by the API process once the claim is scored
+        matches = index.query(signature, self.extracted["file_hash"], NEAR_DUP_TOP_K)
+        if matches and matches[0][0] >= NEAR_DUP_THRESHOLD:
+            similarity, abha_id, file_hash, added = matches[0]
+            patient = "this patient" if abha_id == self.abha.abha_id else "another patient"
+            r.flag("near_duplicate", f"Authenticity Warn (Near-Duplicate): Bill text is {similarity:.0%} similar to a document submitted by {patient} on {datetime.fromtimestamp(added).strftime('%d-%m-%Y')} (hash {(file_hash or 'unknown')[:8]}...).")
+        closest = ", ".join(f"{m[0]:.0%}" for m in matches) or "none"
+        r.note(f"Analysis (Rule 23): Compared bill text with indexed claims via MinHash/LSH (closest: {closest}).")
+
+    @rule("skipped_rule_placeholders", 30)
+    def _add_placeholders_for_other_rules(self, r: RuleResult):
+        skipped_rules = {9: "Geolocation consistency", 11: "Voice/video verification", 16: "Network graph analysis", 17: "Unusual payment flow", 18: "Incapacity vs. activity check", 21: "Imaging authenticity", 24: "Disease progression plausibility", 25: "Cross-product claims", 27: "Device fingerprinting", 28: "Social network/family claims"};
+        for rule_num, desc in skipped_rules.items(): r.note(f"Analysis (Rule {rule_num}): SKIPPED - {desc} (Requires external data or advanced analysis).")
+        r.note("Analysis (Rule 30): PASSED - Explainability provided via this detailed analysis.")
+
+
+
+# --- NEW Helper: Rule Engine execution (inline / thread / process pool) ---
+RULE_ENGINE_MODE = os.getenv("RULE_ENGINE_MODE", "thread") # "inline", "thread" or "process"
+RULE_ENGINE_WORKERS = int(os.getenv("RULE_ENGINE_WORKERS", str(os.cpu_count() or 1)))
+RULE_ENGINE_MAX_PENDING = int(os.getenv("RULE_ENGINE_MAX_PENDING", str(RULE_ENGINE_WORKERS * 4)))
+RULE_ENGINE_START_METHOD = os.getenv("RULE_ENGINE_START_METHOD", "spawn")
+RULE_ENGINE_SHUTDOWN_TIMEOUT = float(os.getenv("RULE_ENGINE_SHUTDOWN_TIMEOUT", "30"))
+
+def _run_rule_engine(pdf_content: bytes, abha_dict: dict, ocr_pages: Optional[Dict[int, str]] = None, trace: bool = False, claim_ref: Optional[str] = None) -> Tuple[int, List[str], List[str], Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
+    """Extracts and evaluates one claim. Module-level so process-pool workers can unpickle it."""
+    engine = RuleEngine(pdf_content, AbhaRecord(**abha_dict), ocr_pages, trace=trace, claim_ref=claim_ref)
+    pre_risk_score, detailed_analysis, red_flags = engine.run_all_checks()
+    artifacts = {**engine.artifacts, "rule_timings": engine.rule_timings}
+    if trace: artifacts["trace_spans"] = engine.trace_spans
+    return pre_risk_score, detailed_analysis, red_flags, engine.extracted, engine.extraction_report, artifacts
+
+def _rule_worker_warmup() -> int:
+    """Pays PyMuPDF start-up and regex compilation once per worker, before real claims arrive."""
+    try:
+        with fitz.open() as doc:
+            doc.new_page().insert_text((72, 72), "WARMUP HOSPITAL\nPatient Name: Warm Up\nBill Date: 01-01-2024\nTotal Amount: 1.00")
+            pdf_bytes = doc.tobytes()
+        _run_rule_engine(pdf_bytes, {"abha_id": "warmup", "name": "Warm Up", "dob": "01-01-1990", "address": "Mumbai"})
+    except Exception as e:
+        print(f"Warning: Rule worker warmup failed: {e}")
+    return os.getpid()
+
+
+class RuleEngineExecutor:
+    """
+    Runs `_run_rule_engine` inline, on a thread, or in a process pool.
+
+    At most `max_pending` claims may be queued or running; beyond that `run`
+    rejects with HTTP 429 so callers back off instead of piling up. Once
+    `shutdown` starts, new work is refused with HTTP 503 while in-flight claims
+    are allowed to finish.
+    """
+
+    def __init__(self, mode: str = "thread", workers: int = 1, max_pending: int = 4, start_method: str = "spawn"):
+        if mode not in ("inline", "thread", "process"):
+            raise ValueError(f"Unknown rule engine mode '{mode}'.")
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.start_method = start_method
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._shutting_down = False
+        self._idle: Optional[asyncio.Event] = None
+        self._slot_freed: Optional[asyncio.Condition] = None
+
+    async def start(self):
+        if self.mode != "process" or self._pool is not None:
+            return
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(self.start_method))
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(*(loop.run_in_executor(self._pool, _rule_worker_warmup) for _ in range(self.workers)), return_exceptions=True)
+        print(f"Rule engine process pool ready ({len({p for p in pids if isinstance(p, int)})} warm worker(s)).")
+
+    async def run(self, pdf_content: bytes, abha_dict: dict, wait: bool = False, ocr_pages: Optional[Dict[int, str]] = None, claim_ref: Optional[str] = None) -> Tuple[int, List[str], List[str], Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
+        """Evaluates one claim. With `wait`, queues for a free slot instead of rejecting (used by batch jobs)."""
+        if self._shutting_down:
+            raise HTTPException(status_code=503, detail="Claim verifier is shutting down; retry shortly.")
+        if self.pending >= self.max_pending:
+            if not wait:
+                self.rejected += 1
+                raise HTTPException(status_code=429, detail="Rule engine is saturated; retry shortly.", headers={"Retry-After": "1"})
+            if self._slot_freed is None:
+                self._slot_freed = asyncio.Condition()
+            async with self._slot_freed:
+                await self._slot_freed.wait_for(lambda: self.pending < self.max_pending or self._shutting_down)
+            if self._shutting_down:
+                raise HTTPException(status_code=503, detail="Claim verifier is shutting down; retry shortly.")
+        self.pending += 1
+        trace = current_trace()
+        try:
+            if self.mode == "inline":
+                result = _run_rule_engine(pdf_content, abha_dict, ocr_pages, trace is not None, claim_ref)
+            elif self.mode == "thread":
+                result = await asyncio.to_thread(_run_rule_engine, pdf_content, abha_dict, ocr_pages, trace is not None, claim_ref)
+            else:
+                if self._pool is None:
+                    await self.start()
+                try:
+                    result = await asyncio.get_running_loop().run_in_executor(self._pool, _run_rule_engine, pdf_content, abha_dict, ocr_pages, trace is not None, claim_ref)
+                except BrokenProcessPool:
+                    self._pool = None # Rebuilt on the next claim
+                    raise HTTPException(status_code=503, detail="Rule engine worker crashed; retry shortly.")
+            *verdict, artifacts = result
+            RULE_STATS.record(artifacts.pop("rule_timings")) # Recorded here so process-pool timings reach this process's stats
+            if trace is not None: trace.graft(artifacts.pop("trace_spans", ()))
+            return (*verdict, artifacts)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+            if self.pending == 0 and self._idle is not None:
+                self._idle.set()
+            if self._slot_freed is not None:
+                async with self._slot_freed:
+                    self._slot_freed.notify()
+
+    async def shutdown(self, timeout: float = 30.0):
+        """Stops accepting claims, waits up to `timeout` for in-flight ones, then stops the workers."""
+        self._shutting_down = True
+        if self._slot_freed is not None:
+            async with self._slot_freed:
+                self._slot_freed.notify_all()
+        if self.pending:
+            self._idle = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                print(f"Warning: {self.pending} claim(s) still running at shutdown.")
+        if self._pool is not None:
+            await asyncio.to_thread(self._pool.shutdown, wait=True, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {"mode": self.mode, "workers": self.workers if self.mode == "process" else None, "pending": self.pending,
+                "max_pending": self.max_pending, "completed": self.completed, "rejected": self.rejected}
+
+
+@app.get("/rules")
+def list_rules():
+    stats = RULE_STATS.snapshot()
+    return {"parallelism": RULE_PARALLELISM, "config_path": RULE_REGISTRY.config_path,
+            "rules": [{**r, "stats": stats.get(r["name"])} for r in RULE_REGISTRY.describe()]}
+
+
+rule_engine_executor = RuleEngineExecutor(RULE_ENGINE_MODE, RULE_ENGINE_WORKERS, RULE_ENGINE_MAX_PENDING, RULE_ENGINE_START_METHOD)
+
+
+@app.on_event("startup")
+async def start_rule_engine_executor():
+    await rule_engine_executor.start()
+
+
+@app.on_event("shutdown")
+async def stop_rule_engine_executor():
+    await rule_engine_executor.shutdown(RULE_ENGINE_SHUTDOWN_TIMEOUT)
+
+
+# --- NEW: OCR fallback for pages without a text layer (local Tesseract via PyMuPDF) ---
+OCR_ENABLED = os.getenv("OCR_ENABLED", "true").lower() in ("1", "true", "yes")
+OCR_MODE = os.getenv("OCR_MODE", "process") # "thread" or "process"
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+OCR_MAX_CONCURRENCY = int(os.getenv("OCR_MAX_CONCURRENCY", str(OCR_WORKERS))) # Page batches OCR'd at once, across all claims
+OCR_PAGES_PER_TASK = int(os.getenv("OCR_PAGES_PER_TASK", "4"))
+OCR_MAX_PAGES = int(os.getenv("OCR_MAX_PAGES", "50")) # Per document; further text-less pages stay unread
+OCR_LANGUAGE = os.getenv("OCR_LANGUAGE", "eng")
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", os.path.join(DATA_DIR, "ocr-cache"))
+OCR_JOB_TTL_SECONDS = float(os.getenv("OCR_JOB_TTL_SECONDS", "3600"))
+OCR_MAX_JOBS = int(os.getenv("OCR_MAX_JOBS", "1000"))
+
+def _ocr_pdf_pages(pdf_content: bytes, pages: List[int], language: str, dpi: int) -> Dict[int, str]:
+    """Renders and OCRs the given pages. Module-level so process-pool workers can unpickle it."""
+    texts = {}
+    with fitz.open(stream=pdf_content, filetype="pdf") as doc:
+        for page_number in pages:
+            page = doc.load_page(page_number)
+            textpage = page.get_textpage_ocr(language=language, dpi=dpi, full=True) # Needs Tesseract + tessdata installed
+            texts[page_number] = page.get_text("text", textpage=textpage) or ""
+    return texts
+
+
+class OcrService:
+    """
+    OCRs text-less PDF pages on a dedicated worker pool.
+
+    Pages are split into batches of `pages_per_task`, and at most
+    `max_concurrency` batches run at once across all claims, so a burst of
+    scanned bills queues here instead of starving the rule engine. Results are
+    cached in memory and on disk by the PDF's SHA-256 (plus language and DPI),
+    and concurrent requests for the same document share one OCR pass.
+    """
+
+    def __init__(self, mode: str = "process", workers: int = 1, max_concurrency: int = 1, pages_per_task: int = 4,
+                 cache_dir: Optional[str] = None, language: str = "eng", dpi: int = 300, memory_entries: int = 256):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown OCR mode '{mode}'.")
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.max_concurrency = max(1, max_concurrency)
+        self.pages_per_task = max(1, pages_per_task)
+        self.cache_dir = cache_dir
+        self.language = language
+        self.dpi = dpi
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, Dict[int, str]]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, Tuple[int, ...]], asyncio.Task] = {}
+        self._pool = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.counters = {"cache_hits": 0, "cache_misses": 0, "coalesced": 0, "pages_ocr": 0, "failures": 0, "ocr_ms": 0.0}
+
+    def _key(self, file_hash: str) -> str:
+        return f"{file_hash}-{self.language}-{self.dpi}"
+
+    def _path(self, key: str) -> Optional[str]:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json") if self.cache_dir else None
+
+    async def _cached(self, key: str) -> Dict[int, str]:
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+        pages = await asyncio.to_thread(self._load, key) # A scanned document's entry can be large; keep the read off the event loop
+        if pages is None: return {}
+        self._remember(key, pages)
+        return pages
+
+    def _load(self, key: str) -> Optional[Dict[int, str]]:
+        path = self._path(key)
+        if not path or not os.path.exists(path): return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return {int(n): text for n, text in json.load(f).items()}
+        except (OSError, ValueError) as e:
+            print(f"Warning: Ignoring unreadable OCR cache entry {path}: {e}")
+            return None
+
+    def _remember(self, key: str, pages: Dict[int, str]):
+        self._memory[key] = pages
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _store(self, key: str, pages: Dict[int, str]):
+        path = self._path(key)
+        if not path: return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(pages, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: Could not write OCR cache entry for {key}: {e}")
+
+    async def cached_pages(self, file_hash: str, pages: Optional[List[int]] = None) -> Optional[Dict[int, str]]:
+        """Returns cached OCR text if every page in `pages` is cached (with no `pages`: if any page is), else None. Never starts OCR."""
+        cached = await self._cached(self._key(file_hash))
+        if not cached or (pages is not None and not all(n in cached for n in pages)): return None
+        self.counters["cache_hits"] += 1
+        return cached
+
+    def _get_pool(self):
+        if self._pool is None:
+            if self.mode == "process":
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(RULE_ENGINE_START_METHOD))
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ocr")
+        return self._pool
+
+    async def _ocr_batch(self, pdf_content: bytes, pages: List[int]) -> Dict[int, str]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            start = time.perf_counter()
+            try:
+                texts = await asyncio.get_running_loop().run_in_executor(self._get_pool(), _ocr_pdf_pages, pdf_content, pages, self.language, self.dpi)
+            except BrokenProcessPool:
+                self._pool = None # Rebuilt on the next batch
+                raise
+            self.counters["ocr_ms"] += (time.perf_counter() - start) * 1000
+            self.counters["pages_ocr"] += len(pages)
+            return texts
+
+    async def _ocr(self, pdf_content: bytes, key: str, pages: List[int]) -> Dict[int, str]:
+        cached = await self._cached(key)
+        todo = [n for n in pages if n not in cached]
+        if not todo:
+            self.counters["cache_hits"] += 1
+            return cached
+        self.counters["cache_misses"] += 1
+        batches = [todo[i:i + self.pages_per_task] for i in range(0, len(todo), self.pages_per_task)]
+        try:
+            results = await asyncio.gather(*(self._ocr_batch(pdf_content, batch) for batch in batches))
+        except Exception:
+            self.counters["failures"] += 1
+            raise
+        merged = dict(cached)
+        for texts in results: merged.update(texts)
+        self._remember(key, merged)
+        await asyncio.to_thread(self._store, key, merged)
+        return merged
+
+    async def ocr(self, pdf_content: bytes, file_hash: str, pages: List[int]) -> Dict[int, str]:
+        """Returns {page number: OCR text} covering `pages`, from cache where possible."""
+        key = self._key(file_hash)
+        inflight_key = (key, tuple(sorted(pages)))
+        task = self._inflight.get(inflight_key)
+        if task is None:
+            task = asyncio.ensure_future(self._ocr(pdf_content, key, sorted(pages)))
+            self._inflight[inflight_key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(inflight_key, None))
+        else:
+            self.counters["coalesced"] += 1
+        return await asyncio.shield(task) # One waiter disconnecting must not cancel the shared pass
+
+    async def shutdown(self):
+        if self._pool is not None:
+            await asyncio.to_thread(self._pool.shutdown, wait=True, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {**self.counters, "mode": self.mode, "workers": self.workers, "max_concurrency": self.max_concurrency,
+                "inflight": len(self._inflight), "memory_entries": len(self._memory), "cache_dir": self.cache_dir,
+                "language": self.language, "dpi": self.dpi}
+
+
+class ClaimJobStore:
+    """Claims scored in the background (async OCR mode). Finished jobs are kept for `ttl` seconds, at most `max_jobs`."""
+
+    def __init__(self, ttl: float = 3600.0, max_jobs: int = 1000):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, dict]" = OrderedDict()
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def _prune(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            expired = job["status"] != "pending" and now - job["updated_at"] > self.ttl
+            if expired or (len(self._jobs) > self.max_jobs and job["status"] != "pending"):
+                del self._jobs[job_id]
+
+    def submit(self, coro) -> dict:
+        self._prune()
+        if sum(1 for job in self._jobs.values() if job["status"] == "pending") >= self.max_jobs:
+            coro.close()
+            raise HTTPException(status_code=429, detail="Too many claims are waiting for OCR; retry shortly.", headers={"Retry-After": "5"})
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._jobs[job_id] = {"job_id": job_id, "status": "pending", "created_at": now, "updated_at": now}
+        self._tasks[job_id] = asyncio.ensure_future(self._run(job_id, coro))
+        return self._jobs[job_id]
+
+    async def _run(self, job_id: str, coro):
+        job = self._jobs[job_id]
+        try:
+            job["result"] = await coro
+            job["status"] = "done"
+        except HTTPException as e:
+            job["status"] = "failed"; job["error"] = {"status_code": e.status_code, "detail": e.detail}
+        except Exception as e:
+            job["status"] = "failed"; job["error"] = {"status_code": 500, "detail": f"Error during claim verification: {e}"}
+        finally:
+            job["updated_at"] = time.time()
+            self._tasks.pop(job_id, None)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self._jobs.get(job_id)
+
+    async def shutdown(self):
+        for task in list(self._tasks.values()): task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def stats(self) -> dict:
+        statuses = [job["status"] for job in self._jobs.values()]
+        return {status: statuses.count(status) for status in ("pending", "done", "failed")}
+
+
+class _OcrDeferred(Exception):
+    """Raised by `_score_claim(defer_ocr=True)` when the claim needs an uncached OCR pass."""
+
+
+async def _run_rules_with_ocr(pdf_content: bytes, abha_dict: dict, wait_for_slot: bool = False, defer_ocr: bool = False, claim_ref: Optional[str] = None):
+    """Runs the rule engine; if pages lack a text layer, OCRs them and runs it again on the recovered text."""
+    file_hash = hashlib.sha256(pdf_content).hexdigest() if OCR_ENABLED else None
+    known_pages = await ocr_service.cached_pages(file_hash) if file_hash else None # A document OCR'd before is read once, with its cached text
+    verdict, image_only = None, None
+    try:
+        verdict = await rule_engine_executor.run(pdf_content, abha_dict, wait=wait_for_slot, ocr_pages=known_pages, claim_ref=claim_ref)
+        missing = verdict[4]["pages_without_text"]
+    except ImageOnlyPdfError as e:
+        image_only, missing = e, e.pages
+    if not missing or not OCR_ENABLED:
+        if image_only is not None: raise ValueError(str(image_only))
+        return verdict
+    missing = missing[:OCR_MAX_PAGES] if OCR_MAX_PAGES else missing
+    ocr_pages = await ocr_service.cached_pages(file_hash, missing)
+    if ocr_pages is None:
+        if defer_ocr: raise _OcrDeferred()
+        print(f"OCR fallback for {len(missing)} page(s) without text...")
+        try:
+            ocr_pages = await ocr_service.ocr(pdf_content, file_hash, missing)
+        except Exception as e:
+            print(f"Error: OCR fallback failed: {e}")
+            if image_only is not None:
+                raise ValueError(f"{image_only} OCR fallback failed: {e}")
+            verdict[4]["ocr_error"] = str(e) # Mixed document: keep the verdict from the text pages
+            return verdict
+    return await rule_engine_executor.run(pdf_content, abha_dict, wait=wait_for_slot, ocr_pages=ocr_pages, claim_ref=claim_ref)
+
+
+@app.get("/ocr")
+def get_ocr_stats():
+    return {"enabled": OCR_ENABLED, "service": ocr_service.stats(), "jobs": claim_jobs.stats()}
+
+
+@app.get("/verify-claim/jobs/{job_id}")
+def get_claim_job(job_id: str):
+    job = claim_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Claim job '{job_id}' not found (unknown or expired).")
+    return job
+
+
+ocr_service = OcrService(OCR_MODE, OCR_WORKERS, OCR_MAX_CONCURRENCY, OCR_PAGES_PER_TASK, OCR_CACHE_DIR, OCR_LANGUAGE, OCR_DPI)
+claim_jobs = ClaimJobStore(OCR_JOB_TTL_SECONDS, OCR_MAX_JOBS)
+
+
+@app.on_event("shutdown")
+async def stop_ocr_service():
+    await claim_jobs.shutdown()
+    await ocr_service.shutdown()
+
+
+# --- NEW: Compact prompt builder (cached static preamble + token-budgeted claim payload) ---
+LLM_CLAIM_TOKEN_BUDGET = int(os.getenv("LLM_CLAIM_TOKEN_BUDGET", "350"))
+# Most useful first; file_hash and other bookkeeping fields never reach the prompt
+_PROMPT_FIELDS = ("total_amount", "diagnoses", "medications", "age", "bill_date", "provider_name", "doc_reg_id", "admission_date", "discharge_date")
+_PROMPT_REQUIRED_FIELDS = ("total_amount", "diagnoses") # Needed for the cost-plausibility check, kept even over budget
+_PROMPT_LIST_LIMIT = 5
+_PROMPT_TEXT_LIMIT = 200
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English and JSON), used for budgets and rate limiting."""
+    return (len(text) + 3) // 4
+
+def _prompt_json(value: Any) -> str:
+    return json.dumps(value, default=str, separators=(",", ":"), ensure_ascii=False)
+
+_VERDICT_GUIDE = """
+**Scoring Guide (Low Score = Good):**
+* 0-30: APPROVE (Low risk)
+* 31-70: PENDING REVIEW (Moderate risk or requires human check)
+* 71-100: REJECT (High risk or rule failures)
+
+**Claim fields:** pre_risk_score is the Rule Engine Risk Score (0=Low, 100+=Very High); red_flags are the Red Flags Found; extracted_data is data extracted from the bill PDF; notes are selected rule analysis steps; skipped_rules counts rules that could not be evaluated.
+
+**Your Task:**
+1.  **Cost Plausibility:** Assess if 'total_amount' (in ₹) is reasonable for the primary diagnosis (first entry of 'diagnoses'). Use general medical cost knowledge. Add this to your reasoning.
+2.  **Recommendation Logic:**
+    * If any "Fail" (Identity Fail, Logic Fail, Policy Fail, Authenticity Fail) red flags exist OR pre_risk_score >= 100: Recommend REJECT.
+    * If pre_risk_score == 0 AND there are NO red flags AND cost seems plausible: Recommend APPROVE.
+    * Otherwise (Warn flags, History Mismatch, External Risk/Warn, cost seems slightly high/low): Recommend PENDING REVIEW.
+3.  **Final Score:** Assign a score (0-100) consistent with your recommendation.
+4.  **Reasoning:** Summarize the key factors (especially red flags and cost plausibility) driving your recommendation. Mention skipped rules if relevant.
+"""
+
+@functools.lru_cache(maxsize=None)
+def llm_preamble(packed: bool) -> str:
+    """Static system instructions, built once. Identical bytes on every call, so providers can reuse the cached prefix."""
+    if packed:
+        return ("Analyze each insurance claim in the user message (a JSON list; every claim has an \"id\") independently, based on "
+                "that claim's Rule Engine findings. For every claim provide an aggregate_score (0-100), reasoning, and recommendation "
+                "('APPROVE', 'REJECT', 'PENDING REVIEW').\n" + _VERDICT_GUIDE +
+                '\n**Output (JSON only, exactly one verdict per claim id):**\n'
+                '{"verdicts": [{"id": "<claim id>", "aggregate_score": <score>, "reasoning": "<your_summary>", "recommendation": "<RECOMMENDATION>"}]}')
+    return ("Analyze the insurance claim in the user message (JSON) based on the Rule Engine's findings. Provide a final "
+            "aggregate_score (0-100), reasoning, and recommendation ('APPROVE', 'REJECT', 'PENDING REVIEW').\n" + _VERDICT_GUIDE +
+            '\n**Output (JSON only):**\n{"aggregate_score": <score>, "reasoning": "<your_summary>", "recommendation": "<RECOMMENDATION>"}')
+
+@functools.lru_cache(maxsize=None)
+def llm_prompt_version() -> str:
+    """Changes whenever the instructions change, so cached verdicts from older prompts are not reused."""
+    return hashlib.sha256((llm_preamble(False) + llm_preamble(True)).encode("utf-8")).hexdigest()[:16]
+
+def _compact_value(value: Any) -> Any:
+    if isinstance(value, datetime): return value.date().isoformat()
+    if isinstance(value, str): return value.strip()[:_PROMPT_TEXT_LIMIT]
+    if isinstance(value, (list, tuple, set)): return [_compact_value(v) for v in list(value)[:_PROMPT_LIST_LIMIT]]
+    if isinstance(value, float) and value.is_integer(): return int(value)
+    return value
+
+def build_claim_payload(pre_risk_score: int, detailed_analysis: List[str], red_flags: List[str], extracted_data: Dict[str, Any],
+                        budget: int = LLM_CLAIM_TOKEN_BUDGET) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Returns the compact claim payload the LLM sees, plus token counts for it.
+
+    Fills `budget` (estimated tokens) in priority order: risk score, red flags,
+    extracted fields, then non-placeholder analysis lines. SKIPPED placeholder
+    lines are collapsed into a count. At least one red flag and the fields the
+    cost check needs are always kept, even over budget.
+    """
+    payload: Dict[str, Any] = {"pre_risk_score": pre_risk_score, "red_flags": [], "extracted_data": {}}
+    used = estimate_tokens(_prompt_json(payload))
+    dropped = {"red_flags": 0, "fields": [], "notes": 0}
+
+    for flag in red_flags:
+        cost = estimate_tokens(_prompt_json(flag[:_PROMPT_TEXT_LIMIT])) + 1
+        if payload["red_flags"] and used + cost > budget:
+            dropped["red_flags"] += 1; continue
+        payload["red_flags"].append(flag[:_PROMPT_TEXT_LIMIT]); used += cost
+
+    for field in _PROMPT_FIELDS:
+        value = _compact_value(extracted_data.get(field))
+        if value is None or value == [] or value == "": continue
+        cost = estimate_tokens(_prompt_json({field: value}))
+        if used + cost > budget and field not in _PROMPT_REQUIRED_FIELDS:
+            dropped["fields"].append(field); continue
+        payload["extracted_data"][field] = value; used += cost
+
+    skipped = sum(1 for line in detailed_analysis if "SKIPPED" in line)
+    if skipped:
+        payload["skipped_rules"] = skipped; used += estimate_tokens(f',"skipped_rules":{skipped}')
+    for line in detailed_analysis:
+        if "SKIPPED" in line or "Explainability provided" in line: continue
+        note = line[len("Analysis "):] if line.startswith("Analysis ") else line
+        note = note[:_PROMPT_TEXT_LIMIT]
+        cost = estimate_tokens(_prompt_json(note)) + 1
+        if used + cost > budget:
+            dropped["notes"] += 1; continue
+        payload.setdefault("notes", []).append(note); used += cost
+
+    raw = estimate_tokens(json.dumps(red_flags) + json.dumps(extracted_data, default=str) + "\n".join(detailed_analysis))
+    stats = {"preamble_tokens": estimate_tokens(llm_preamble(False)), "claim_tokens": estimate_tokens(_prompt_json(payload)),
+             "claim_token_budget": budget, "uncompacted_claim_tokens": raw, "skipped_placeholders_collapsed": skipped, "dropped": dropped}
+    return payload, stats
+
+
+class LlmUsage:
+    """Provider-reported token usage across all Groq calls."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+    def record(self, usage: Any):
+        if usage is None: return
+        with self._lock:
+            self.totals["calls"] += 1
+            self.totals["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+            self.totals["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            calls = self.totals["calls"]
+            return {**self.totals, "avg_prompt_tokens": (self.totals["prompt_tokens"] / calls) if calls else None}
+
+
+LLM_USAGE = LlmUsage()
+
+
+# --- NEW: LLM verdict cache (canonical input hash + in-flight coalescing) ---
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.1-8b-instant")
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", "900")) # 0 = no caching (identical calls still coalesce)
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+LLM_MAX_TOKENS_PER_CLAIM = int(os.getenv("LLM_MAX_TOKENS_PER_CLAIM", "400"))
+
+def llm_cache_key(model: str, payload: Dict[str, Any]) -> str:
+    """SHA-256 over a canonical (key-sorted) JSON of the model, prompt version and compact claim payload."""
+    canonical = json.dumps({"model": model, "prompt": llm_prompt_version(), "claim": payload},
+                           sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LlmVerdictCache:
+    """
+    TTL + LRU cache of AI verdicts, safe to share between worker threads.
+
+    Concurrent callers with the same key wait on the first caller's upstream
+    call instead of issuing their own. Only successful verdicts are stored;
+    if the upstream call raises, every waiter sees the error and falls back.
+    """
+
+    def __init__(self, ttl: float = 900.0, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Tuple[int, str, str]]]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "coalesced": 0, "expired": 0, "evictions": 0, "errors": 0}
+
+    def get(self, key: str) -> Optional[Tuple[int, str, str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            self._entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return entry[1]
+
+    def put(self, key: str, verdict: Tuple[int, str, str]):
+        if self.ttl <= 0: return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, verdict)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False); self.counters["evictions"] += 1
+
+    def get_or_compute(self, key: str, compute) -> Tuple[int, str, str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.counters["hits"] += 1
+                    return entry[1]
+                del self._entries[key]; self.counters["expired"] += 1
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+                self.counters["misses"] += 1
+            else:
+                self.counters["coalesced"] += 1
+        if not owner:
+            return future.result()
+        try:
+            verdict = compute()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None); self.counters["errors"] += 1
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._inflight.pop(key, None)
+            if self.ttl > 0:
+                self._entries[key] = (time.monotonic() + self.ttl, verdict)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False); self.counters["evictions"] += 1
+        future.set_result(verdict)
+        return verdict
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"] + self.counters["coalesced"]
+            return {**self.counters, "hit_rate": (self.counters["hits"] / lookups) if lookups else None,
+                    "upstream_saved_rate": ((self.counters["hits"] + self.counters["coalesced"]) / lookups) if lookups else None,
+                    "entries": len(self._entries), "inflight": len(self._inflight), "ttl_seconds": self.ttl, "max_entries": self.max_entries}
+
+
+llm_verdict_cache = LlmVerdictCache(LLM_CACHE_TTL_SECONDS, LLM_CACHE_MAX_ENTRIES)
+
+
+@app.get("/llm/cache")
+def get_llm_cache_stats():
+    return {"model": GROQ_MODEL, "prompt_version": llm_prompt_version(), **llm_verdict_cache.stats()}
+
+
+# --- Helper Function 4: Groq AI (Updated Prompt) ---
+def _normalize_verdict(response_json: dict) -> Tuple[int, str, str]:
+    rec = response_json.get("recommendation", "REJECT").upper()
+    score = int(response_json.get("aggregate_score", 99))
+    reason = response_json.get("reasoning", "AI did not provide reasoning.")
+
+    # Adjust score to fit recommendation range if AI output is inconsistent
+    if rec == "APPROVE" and score > 30: score = 25
+    elif rec == "PENDING REVIEW" and (score < 31 or score > 70): score = 50
+    elif rec == "REJECT" and score < 71: score = 85
+
+    return score, reason, rec
+
+
+def _rule_only_verdict(pre_risk_score: int, red_flags: List[str], error: Any) -> Tuple[int, str, str]:
+    """Fallback when the AI verdict is unavailable: recommendation from the rule score alone."""
+    rec = "PENDING REVIEW"
+    if pre_risk_score >= 100 or any("Fail" in flag for flag in red_flags): rec = "REJECT"
+    elif pre_risk_score == 0 and not red_flags: rec = "APPROVE"
+    # Return pre_risk_score if AI fails, clamped to 0-100
+    fail_score = max(0, min(100, pre_risk_score))
+    return fail_score, f"AI Error: {error}. Recommendation based on rule score.", rec
+
+
+def _groq_chat(system: str, user: str, max_tokens: int, llm_client=None) -> dict:
+    """One Groq JSON-mode chat completion. Raises on any upstream or parsing error."""
+    chat_completion = (llm_client or client).chat.completions.create(
+        messages=[{"role": "system", "content": system}, {"role": "user", "content": user}],
+        model=GROQ_MODEL, # Use current model
+        response_format={"type": "json_object"},
+        temperature=0.1,
+        max_tokens=max_tokens
+    )
+    LLM_USAGE.record(getattr(chat_completion, "usage", None))
+    return json.loads(chat_completion.choices[0].message.content)
+
+
+def _groq_verdict(payload: Dict[str, Any], llm_client=None) -> Tuple[int, str, str]:
+    """Scores one compact claim payload (see build_claim_payload)."""
+    return _normalize_verdict(_groq_chat(llm_preamble(False), _prompt_json(payload), LLM_MAX_TOKENS_PER_CLAIM, llm_client))
+
+
+def get_ai_score_and_reasoning(
+    pre_risk_score: int,
+    detailed_analysis: List[str],
+    red_flags: List[str],
+    extracted_data: Dict[str, Any]
+) -> Tuple[int, str, str]:
+
+    if not client:
+        rec = "PENDING REVIEW"; score = pre_risk_score
+        if pre_risk_score >= 100 or any("Fail" in flag for flag in red_flags): rec = "REJECT"; score = max(score, 85)
+        elif pre_risk_score == 0 and not red_flags: rec = "APPROVE"; score = min(score, 25)
+        return score, "AI Error: Client not initialized. Recommendation based on rule score.", rec
+
+    try:
+        payload, _ = build_claim_payload(pre_risk_score, detailed_analysis, red_flags, extracted_data)
+        return llm_verdict_cache.get_or_compute(llm_cache_key(GROQ_MODEL, payload), lambda: _groq_verdict(payload))
+
+    except Exception as e:
+        print(f"Groq API error: {e}")
+        return _rule_only_verdict(pre_risk_score, red_flags, e)
+
+
+# --- NEW: LLM scheduler (token bucket, priority queue, micro-batched verdicts) ---
+LLM_SCHEDULER_ENABLED = os.getenv("LLM_SCHEDULER_ENABLED", "1") != "0"
+LLM_RPM = float(os.getenv("LLM_RPM", "30")) # Requests per minute; 0 = unlimited
+LLM_TPM = float(os.getenv("LLM_TPM", "6000")) # Estimated tokens per minute; 0 = unlimited
+LLM_BATCH_MAX_CLAIMS = int(os.getenv("LLM_BATCH_MAX_CLAIMS", "4"))
+LLM_BATCH_WINDOW_MS = float(os.getenv("LLM_BATCH_WINDOW_MS", "25"))
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "20"))
+LLM_MAX_CONCURRENT_CALLS = int(os.getenv("LLM_MAX_CONCURRENT_CALLS", "4"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "1000"))
+
+
+def _groq_batch_verdicts(claims: List[dict], llm_client=None) -> Dict[str, Tuple[int, str, str]]:
+    """One Groq call scoring several compact claim payloads (each with an "id"); returns id -> verdict."""
+    response_json = _groq_chat(llm_preamble(True), _prompt_json(claims), LLM_MAX_TOKENS_PER_CLAIM * len(claims), llm_client)
+    verdicts = {}
+    for item in response_json.get("verdicts", []):
+        if isinstance(item, dict) and item.get("id") is not None:
+            try: verdicts[str(item["id"])] = _normalize_verdict(item)
+            except (TypeError, ValueError): pass # A malformed verdict is retried on its own
+    return verdicts
+
+
+def _llm_retry_after(error: Exception) -> Optional[float]:
+    """Seconds to back off if `error` is an upstream 429, else None."""
+    if getattr(error, "status_code", None) != 429:
+        return None
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try: return max(0.0, float(headers.get("retry-after", 1)))
+    except (TypeError, ValueError): return 1.0
+
+
+class LlmUnavailable(Exception):
+    """The AI verdict could not be obtained in time; the caller falls back to the rule score."""
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate_per_minute` (0 = unlimited), with an explicit pause for upstream 429s."""
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = rate_per_minute
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, cost: float) -> float:
+        """Seconds until `cost` tokens are available (costs above capacity are capped at capacity)."""
+        paused = max(0.0, self._paused_until - time.monotonic())
+        if not self.rate: return paused
+        self._refill()
+        shortfall = min(cost, self.capacity) - self.tokens
+        return max(paused, shortfall / self.rate if shortfall > 0 else 0.0)
+
+    def take(self, cost: float):
+        if self.rate:
+            self._refill(); self.tokens -= min(cost, self.capacity)
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class _LlmJob:
+    __slots__ = ("id", "key", "priority", "deadline", "claim", "tokens", "solo", "future")
+
+    def __init__(self, job_id: str, key: str, priority: int, deadline: float, claim: dict, future: asyncio.Future):
+        self.id = job_id
+        self.key = key
+        self.priority = priority
+        self.deadline = deadline
+        self.claim = claim # Compact payload from build_claim_payload
+        self.tokens = estimate_tokens(_prompt_json(claim)) + LLM_MAX_TOKENS_PER_CLAIM
+        self.solo = False # Set when a packed call dropped this claim; it is then retried alone
+        self.future = future
+
+
+class LlmScheduler:
+    """
+    Queues AI scoring requests in front of Groq.
+
+    Requests wait in a priority queue (0 = interactive, 1 = batch/background)
+    and are released only while the requests-per-minute and tokens-per-minute
+    buckets allow. Up to `batch_max` queued claims are packed into one
+    structured-output call. A 429 pauses both buckets for Retry-After and
+    requeues the claims. A claim that cannot be scored before its deadline
+    falls back to the rule-only verdict instead of waiting on the LLM.
+    """
+
+    def __init__(self, rpm: float = 30, tpm: float = 6000, batch_max: int = 4, batch_window_ms: float = 25,
+                 deadline_seconds: float = 20, max_concurrent_calls: int = 4, max_queue: int = 1000):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.batch_max = max(1, batch_max)
+        self.batch_window = batch_window_ms / 1000.0
+        self.deadline_seconds = deadline_seconds
+        self.max_concurrent_calls = max(1, max_concurrent_calls)
+        self.max_queue = max_queue
+        self.latency_ewma: Optional[float] = None # Seconds per upstream call
+        self._heap: List[Tuple[int, float, int, _LlmJob]] = []
+        self._seq = 0
+        self._inflight: Dict[str, _LlmJob] = {}
+        self._sending: set = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._calls: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self._llm_client = None
+        self.counters = {"submitted": 0, "cache_hits": 0, "coalesced": 0, "calls": 0, "packed_calls": 0, "claims_sent": 0,
+                         "rate_limited": 0, "errors": 0, "deadline_fallbacks": 0, "expired_in_queue": 0, "queue_full": 0}
+
+    def _client(self):
+        if self._llm_client is None and client is not None:
+            # Retries are the scheduler's job: the SDK's own 429 retries would sleep past deadlines on a worker thread
+            self._llm_client = client.with_options(max_retries=0) if hasattr(client, "with_options") else client
+        return self._llm_client
+
+    def _push(self, job: _LlmJob):
+        self._seq += 1
+        heapq.heappush(self._heap, (job.priority, job.deadline, self._seq, job))
+        self._wakeup.set()
+
+    async def score(self, pre_risk_score: int, red_flags: List[str], payload: Dict[str, Any],
+                    priority: int = 0, deadline_seconds: Optional[float] = None) -> Tuple[int, str, str]:
+        """Scores one compact claim payload; `pre_risk_score` and `red_flags` drive the rule-only fallback."""
+        if not client:
+            return get_ai_score_and_reasoning(pre_risk_score, [], red_flags, {})
+        self.counters["submitted"] += 1
+        key = llm_cache_key(GROQ_MODEL, payload)
+        cached = llm_verdict_cache.get(key)
+        if cached is not None:
+            self.counters["cache_hits"] += 1
+            return cached
+        deadline = time.monotonic() + (deadline_seconds if deadline_seconds is not None else self.deadline_seconds)
+        job = self._inflight.get(key)
+        if job is not None:
+            self.counters["coalesced"] += 1
+            job.deadline = max(job.deadline, deadline)
+        else:
+            if len(self._heap) >= self.max_queue:
+                self.counters["queue_full"] += 1
+                return _rule_only_verdict(pre_risk_score, red_flags, "LLM queue is full")
+            if self._task is None or self._task.done():
+                self._wakeup, self._calls = asyncio.Event(), asyncio.Semaphore(self.max_concurrent_calls)
+                self._task = asyncio.ensure_future(self._dispatch_loop())
+            job = _LlmJob(key[:12], key, priority, deadline, payload, asyncio.get_running_loop().create_future())
+            self._inflight[key] = job
+            job.future.add_done_callback(lambda f, job=job: self._finish(job))
+            self._push(job)
+        try:
+            return await asyncio.wait_for(asyncio.shield(job.future), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self.counters["deadline_fallbacks"] += 1
+            return _rule_only_verdict(pre_risk_score, red_flags, "LLM deadline exceeded")
+        except LlmUnavailable as e:
+            return _rule_only_verdict(pre_risk_score, red_flags, e)
+
+    def _finish(self, job: _LlmJob):
+        if self._inflight.get(job.key) is job:
+            del self._inflight[job.key]
+        if not job.future.cancelled(): job.future.exception() # Mark retrieved; waiters may have timed out already
+
+    def _expire(self):
+        """Drops finished jobs and fails fast on ones that can no longer be answered before their deadline."""
+        now, expected = time.monotonic(), self.latency_ewma or 0.0
+        keep = []
+        for entry in self._heap:
+            job = entry[3]
+            if job.future.done(): continue
+            if job.deadline - now <= expected:
+                self.counters["expired_in_queue"] += 1
+                job.future.set_exception(LlmUnavailable("LLM deadline would be exceeded"))
+                continue
+            keep.append(entry)
+        if len(keep) != len(self._heap):
+            heapq.heapify(keep); self._heap = keep
+
+    def _take_pack(self) -> List[_LlmJob]:
+        pack, deferred, tokens = [], [], estimate_tokens(llm_preamble(True))
+        while self._heap and len(pack) < self.batch_max:
+            entry = heapq.heappop(self._heap); job = entry[3]
+            if job.solo and pack:
+                deferred.append(entry); continue
+            if pack and self.tokens.rate and tokens + job.tokens > self.tokens.capacity:
+                deferred.append(entry); break
+            pack.append(job); tokens += job.tokens
+            if job.solo: break
+        for entry in deferred: heapq.heappush(self._heap, entry)
+        return pack
+
+    def _requeue(self, jobs: List[_LlmJob]):
+        for job in jobs:
+            if not job.future.done(): self._push(job)
+
+    async def _dispatch_loop(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if len(self._heap) < self.batch_max and self.batch_window:
+                await asyncio.sleep(self.batch_window) # Let a burst of claims share one call
+            self._expire()
+            pack = self._take_pack()
+            if not pack: continue
+            cost = estimate_tokens(llm_preamble(len(pack) > 1)) + sum(job.tokens for job in pack)
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(cost))
+            if wait > 0:
+                self._requeue(pack)
+                await asyncio.sleep(min(wait, 0.25)) # Re-check often so deadlines and new priorities are honoured
+                continue
+            await self._calls.acquire()
+            self.requests.take(1); self.tokens.take(cost)
+            task = asyncio.ensure_future(self._send(pack))
+            self._sending.add(task); task.add_done_callback(self._sending.discard)
+
+    async def _send(self, pack: List[_LlmJob]):
+        start = time.perf_counter()
+        try:
+            self.counters["calls"] += 1; self.counters["claims_sent"] += len(pack)
+            if len(pack) == 1:
+                verdicts = {pack[0].id: await asyncio.to_thread(_groq_verdict, pack[0].claim, self._client())}
+            else:
+                self.counters["packed_calls"] += 1
+                verdicts = await asyncio.to_thread(_groq_batch_verdicts, [{"id": job.id, **job.claim} for job in pack], self._client())
+        except Exception as e:
+            retry_after = _llm_retry_after(e)
+            if retry_after is not None:
+                print(f"Groq rate limited; pausing {retry_after:.1f}s and requeueing {len(pack)} claim(s).")
+                self.counters["rate_limited"] += 1
+                self.requests.pause(retry_after); self.tokens.pause(retry_after)
+                self._requeue(pack)
+                return
+            print(f"Groq API error: {e}")
+            self.counters["errors"] += 1
+            for job in pack:
+                if not job.future.done(): job.future.set_exception(LlmUnavailable(e))
+            return
+        finally:
+            self._calls.release()
+        elapsed = time.perf_counter() - start
+        self.latency_ewma = elapsed if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * elapsed
+        for job in pack:
+            verdict = verdicts.get(job.id)
+            if verdict is None and len(pack) > 1:
+                job.solo = True; self._requeue([job]) # Dropped from the packed answer; retry it alone
+            elif verdict is None:
+                if not job.future.done(): job.future.set_exception(LlmUnavailable("LLM returned no verdict"))
+            else:
+                llm_verdict_cache.put(job.key, verdict)
+                if not job.future.done(): job.future.set_result(verdict)
+
+    async def shutdown(self):
+        if self._task is not None: self._task.cancel()
+        for task in list(self._sending): task.cancel()
+        for _, _, _, job in self._heap:
+            if not job.future.done(): job.future.set_exception(LlmUnavailable("Claim verifier is shutting down"))
+        self._heap = []
+
+    def stats(self) -> dict:
+        return {**self.counters, "queued": len(self._heap), "inflight_calls": len(self._sending),
+                "latency_ewma_ms": self.latency_ewma * 1000 if self.latency_ewma is not None else None,
+                "rpm": self.requests.capacity, "tpm": self.tokens.capacity, "batch_max": self.batch_max, "usage": LLM_USAGE.snapshot()}
+
+
+llm_scheduler = LlmScheduler(LLM_RPM, LLM_TPM, LLM_BATCH_MAX_CLAIMS, LLM_BATCH_WINDOW_MS, LLM_DEADLINE_SECONDS, LLM_MAX_CONCURRENT_CALLS, LLM_MAX_QUEUE)
+
+
+@app.get("/llm/scheduler")
+def get_llm_scheduler_stats():
+    return {"enabled": LLM_SCHEDULER_ENABLED, **llm_scheduler.stats()}
+
+
+@app.on_event("shutdown")
+async def stop_llm_scheduler():
+    await llm_scheduler.shutdown()
+
+
+# --- NEW: Tracing spans, per-request sampling profiler and Prometheus metrics ---
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "1") != "0" # Honor the X-Trace header / ?trace=1
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0")) # Fraction of requests traced without asking
+TRACE_STORE_MAX = int(os.getenv("TRACE_STORE_MAX", "200")) # Finished traces kept for GET /traces
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0") == "1" # Honor the X-Profile header / ?profile=1; off by default, as any client could trigger it
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_STORE_MAX = int(os.getenv("PROFILE_STORE_MAX", "20"))
+PROFILE_DIR = os.getenv("PROFILE_DIR") or None # Also write each profile here as <id>.folded
+_current_trace: "contextvars.ContextVar[Optional[Trace]]" = contextvars.ContextVar("trace", default=None)
+_current_span: "contextvars.ContextVar[Optional[int]]" = contextvars.ContextVar("trace_span", default=None)
+
+class Trace:
+    """Spans recorded for one request. Span times are wall-clock ns, so spans from rule engine worker processes line up."""
+
+    def __init__(self, method: str, path: str):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.method, self.path = method, path
+        self.started_ns = time.time_ns()
+        self.status: Optional[int] = None
+        self.duration_ms: Optional[float] = None
+        self.spans: List[dict] = []
+        self._ids = iter(range(1, 1 << 62))
+
+    def add(self, name: str, start_ns: int, duration_ns: int, parent: Optional[int], attrs: dict, span_id: Optional[int] = None) -> int:
+        span_id = span_id or next(self._ids)
+        self.spans.append({"id": span_id, "parent": parent, "name": name, "start_ms": round((start_ns - self.started_ns) / 1e6, 3),
+                           "duration_ms": round(duration_ns / 1e6, 3), "attrs": attrs})
+        return span_id
+
+    def graft(self, spans: Iterable[Tuple[str, int, int, dict]]):
+        """Adds spans recorded elsewhere (e.g. by a RuleEngine in a worker process) under the current span."""
+        parent = _current_span.get()
+        for name, start_ns, duration_ns, attrs in spans:
+            self.add(name, start_ns, duration_ns, parent, attrs)
+
+    def summary(self) -> dict:
+        return {"trace_id": self.trace_id, "method": self.method, "path": self.path, "status": self.status,
+                "started_at": datetime.fromtimestamp(self.started_ns / 1e9).isoformat(), "duration_ms": self.duration_ms, "spans": len(self.spans)}
+
+    def as_dict(self) -> dict:
+        return {**self.summary(), "spans": sorted(self.spans, key=lambda s: s["start_ms"])}
+
+    def as_chrome_trace(self) -> dict:
+        """Chrome trace-event JSON (chrome://tracing, Perfetto). Each top-level stage gets its own row so concurrent stages don't overlap."""
+        parents = {s["id"]: s["parent"] for s in self.spans}
+        roots = {s["id"] for s in self.spans if s["parent"] is None}
+        def lane(span_id: int) -> int:
+            while parents.get(span_id) is not None and parents[span_id] not in roots: span_id = parents[span_id]
+            return span_id
+        return {"traceEvents": [{"name": s["name"], "ph": "X", "pid": 1, "tid": lane(s["id"]), "ts": int(self.started_ns / 1e3 + s["start_ms"] * 1e3),
+                                 "dur": int(s["duration_ms"] * 1e3), "args": s["attrs"]} for s in self.spans], "displayTimeUnit": "ms"}
+
+
+class _Span:
+    __slots__ = ("trace", "name", "attrs", "span_id", "parent", "start_ns", "_start", "_token")
+
+    def __init__(self, trace: Trace, name: str, attrs: dict):
+        self.trace, self.name, self.attrs = trace, name, attrs
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        self.span_id = next(self.trace._ids)
+        self._token = _current_span.set(self.span_id)
+        self.start_ns, self._start = time.time_ns(), time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and "error" not in self.attrs: self.attrs["error"] = exc_type.__name__
+        self.trace.add(self.name, self.start_ns, time.perf_counter_ns() - self._start, self.parent, self.attrs, self.span_id)
+        _current_span.reset(self._token)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+class _NoopSpan:
+    __slots__ = ()
+    def __enter__(self): return self
+    def __exit__(self, exc_type, exc, tb): return False
+    def set(self, **attrs): pass
+
+_NOOP_SPAN = _NoopSpan()
+
+def span(name: str, **attrs):
+    """Context manager timing a block as a child of the current span. Without an active trace it is a shared no-op."""
+    trace = _current_trace.get()
+    return _NOOP_SPAN if trace is None else _Span(trace, name, attrs)
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+class SamplingProfiler:
+    """
+    Samples every thread's Python stack each `interval_ms` from a daemon thread
+    and folds the samples into collapsed stacks ("thread;outer;...;leaf count"
+    lines), the input format of flamegraph.pl and speedscope. It sees the whole
+    process, so concurrent requests show up too; rule engine worker processes
+    are not sampled. Threads parked in select/wait or idle pool workers are skipped.
+    """
+
+    IDLE_LEAVES = frozenset({"select", "wait", "_worker", "_wait_for_tstate_lock"})
+
+    def __init__(self, interval_ms: float = 5.0):
+        self.interval = max(0.001, interval_ms / 1000)
+        self.stacks: Dict[str, int] = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started = 0.0
+        self.duration_ms = 0.0
+
+    def _sample(self):
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own or frame.f_code.co_name in self.IDLE_LEAVES: continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            key = ";".join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self) -> "SamplingProfiler":
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="trustlynk-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> str:
+        self._stop.set()
+        if self._thread is not None: self._thread.join()
+        self.duration_ms = round((time.perf_counter() - self._started) * 1000, 2)
+        return self.folded()
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+
+class RecentItems:
+    """Bounded, insertion-ordered store of the most recent traces or profiles."""
+
+    def __init__(self, max_items: int):
+        self.max_items = max(1, max_items)
+        self.recorded = 0
+        self._items: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key: str, item: Any):
+        with self._lock:
+            self._items[key] = item
+            self.recorded += 1
+            while len(self._items) > self.max_items: self._items.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Any]:
+        return self._items.get(key)
+
+    def values(self) -> List[Any]:
+        with self._lock:
+            return list(reversed(self._items.values()))
+
+
+recent_traces = RecentItems(TRACE_STORE_MAX)
+recent_profiles = RecentItems(PROFILE_STORE_MAX)
+_profiler_lock = threading.Lock() # One profile at a time; a second request runs unprofiled
+
+def _wants(scope: dict, header: bytes, param: bytes) -> bool:
+    for name, value in scope.get("headers", ()):
+        if name == header: return value not in (b"0", b"false", b"")
+    query = scope.get("query_string", b"")
+    return bool(query) and param in query and parse_qs(query.decode("latin-1")).get(param.decode(), ["0"])[-1] not in ("0", "false", "")
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware that starts a Trace and/or SamplingProfiler for requests that
+    ask for one (X-Trace / X-Profile header, ?trace=1 / ?profile=1) or are picked
+    by TRACE_SAMPLE_RATE. The response carries X-Trace-Id / X-Profile-Id; fetch
+    the results from /traces/{id} and /profiles/{id}. Other requests pass straight through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        trace_on = TRACING_ENABLED and (_wants(scope, b"x-trace", b"trace") or (TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE))
+        profile_on = PROFILER_ENABLED and _wants(scope, b"x-profile", b"profile")
+        if not (trace_on or profile_on):
+            return await self.app(scope, receive, send)
+
+        trace = Trace(scope["method"], scope["path"]) if trace_on else None
+        profiler = SamplingProfiler(PROFILE_INTERVAL_MS) if profile_on and _profiler_lock.acquire(blocking=False) else None
+        profile_id = uuid.uuid4().hex[:16] if profiler else None
+        extra_headers = []
+        if trace: extra_headers.append((b"x-trace-id", trace.trace_id.encode()))
+        if profile_id: extra_headers.append((b"x-profile-id", profile_id.encode()))
+        elif profile_on: extra_headers.append((b"x-profile-id", b"busy")) # Another request is being profiled
+
+        async def send_with_ids(message):
+            if message["type"] == "http.response.start":
+                if trace: trace.status = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), *extra_headers]}
+            await send(message)
+
+        token = _current_trace.set(trace) if trace else None
+        if profiler: profiler.start()
+        try:
+            with span(f"{scope['method']} {scope['path']}"):
+                await self.app(scope, receive, send_with_ids)
+        finally:
+            if token is not None: _current_trace.reset(token)
+            if trace:
+                trace.duration_ms = round((time.time_ns() - trace.started_ns) / 1e6, 3)
+                recent_traces.put(trace.trace_id, trace)
+            if profiler:
+                try:
+                    folded = profiler.stop()
+                    recent_profiles.put(profile_id, {"profile_id": profile_id, "method": scope["method"], "path": scope["path"], "samples": profiler.samples,
+                                                     "interval_ms": PROFILE_INTERVAL_MS, "duration_ms": profiler.duration_ms, "folded": folded})
+                    if PROFILE_DIR:
+                        os.makedirs(PROFILE_DIR, exist_ok=True)
+                        with open(os.path.join(PROFILE_DIR, f"{profile_id}.folded"), "w", encoding="utf-8") as f: f.write(folded)
+                finally:
+                    _profiler_lock.release()
+
+
+if TRACING_ENABLED or PROFILER_ENABLED:
+    app.add_middleware(TracingMiddleware)
+
+
+@app.get("/traces")
+def list_traces():
+    return {"enabled": TRACING_ENABLED, "sample_rate": TRACE_SAMPLE_RATE, "recorded": recent_traces.recorded,
+            "traces": [t.summary() for t in recent_traces.values()]}
+
+
+@app.get("/traces/{trace_id}")
+def get_trace(trace_id: str, format: str = "json"):
+    trace = recent_traces.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"Trace '{trace_id}' not found (only the last {TRACE_STORE_MAX} are kept).")
+    return trace.as_chrome_trace() if format == "chrome" else trace.as_dict()
+
+
+@app.get("/profiles")
+def list_profiles():
+    return {"enabled": PROFILER_ENABLED, "interval_ms": PROFILE_INTERVAL_MS, "recorded": recent_profiles.recorded,
+            "profiles": [{k: v for k, v in p.items() if k != "folded"} for p in recent_profiles.values()]}
+
+
+@app.get("/profiles/{profile_id}", response_class=PlainTextResponse)
+def get_profile(profile_id: str):
+    """Collapsed stacks; e.g. `curl .../profiles/<id> | flamegraph.pl > claim.svg`, or open the file in speedscope."""
+    profile = recent_profiles.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Profile '{profile_id}' not found (only the last {PROFILE_STORE_MAX} are kept).")
+    return profile["folded"]
+
+
+def _prom_labels(**labels) -> str:
+    escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34)).replace(chr(10), chr(92) + "n")}"' for k, v in labels.items())
+    return "{" + ",".join(escaped) + "}"
+
+def render_prometheus_metrics() -> str:
+    """Pipeline, rule engine, IPFS and tracing counters in the Prometheus text exposition format."""
+    lines = []
+    def metric(name: str, kind: str, help_text: str, samples: Iterable[Tuple[str, dict, float]]):
+        lines.append(f"# HELP {name} {help_text}"); lines.append(f"# TYPE {name} {kind}")
+        lines.extend(f"{name}{suffix}{_prom_labels(**labels) if labels else ''} {value:g}" for suffix, labels, value in samples)
+
+    stages = list(pipeline_metrics.stages.items())
+    def histogram_samples():
+        for name, stage in stages:
+            h = stage["histogram"]; cumulative = 0
+            for bound, count in zip(h.buckets, h.counts):
+                cumulative += count
+                yield "_bucket", {"stage": name, "le": f"{bound / 1000:g}"}, cumulative
+            yield "_bucket", {"stage": name, "le": "+Inf"}, h.count
+            yield "_sum", {"stage": name}, h.sum_ms / 1000
+            yield "_count", {"stage": name}, h.count
+    metric("trustlynk_stage_duration_seconds", "histogram", "Claim pipeline stage latency.", histogram_samples())
+    metric("trustlynk_stage_outcomes_total", "counter", "Claim pipeline stage outcomes.",
+           (("", {"stage": name, "outcome": outcome}, n) for name, stage in stages for outcome, n in stage["outcomes"].items()))
+    metric("trustlynk_stage_in_flight", "gauge", "Claim pipeline stages currently running.", (("", {"stage": name}, stage["in_flight"]) for name, stage in stages))
+
+    rules = RULE_STATS.snapshot()
+    metric("trustlynk_rule_evaluations_total", "counter", "Rule evaluations by outcome.",
+           (("", {"rule": name, "outcome": outcome}, s[outcome]) for name, s in rules.items() for outcome in RuleStats.OUTCOMES))
+    metric("trustlynk_rule_duration_seconds_total", "counter", "Wall time spent in each rule.", (("", {"rule": name}, s["total_ms"] / 1000) for name, s in rules.items()))
+    executor = rule_engine_executor.stats()
+    metric("trustlynk_rule_engine_pending", "gauge", "Claims queued or running in the rule engine.", [("", {}, executor["pending"])])
+    metric("trustlynk_rule_engine_completed_total", "counter", "Claims the rule engine finished.", [("", {}, executor["completed"])])
+    metric("trustlynk_rule_engine_rejected_total", "counter", "Claims rejected with 429 because the rule engine was saturated.", [("", {}, executor["rejected"])])
+
+    gateways = ipfs_fetcher.gateway_stats()
+    metric("trustlynk_ipfs_requests_total", "counter", "IPFS gateway requests by result.",
+           (("", {"gateway": g, "result": result}, s[key]) for g, s in gateways.items() for result, key in (("success", "successes"), ("failure", "failures"), ("cancelled", "cancelled"))))
+    metric("trustlynk_traces_recorded_total", "counter", "Request traces recorded.", [("", {}, recent_traces.recorded)])
+    metric("trustlynk_profiles_recorded_total", "counter", "Request profiles recorded.", [("", {}, recent_profiles.recorded)])
+    return "\n".join(lines) + "\n"
+
+
+@app.get("/health")
+def health_check():
+    return {"status": "ok"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(render_prometheus_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# --- NEW: Claim pipeline stages (timeouts, cancellation, latency histograms, in-flight gauges) ---
+def _stage_timeout(name: str, default: float) -> Optional[float]:
+    value = float(os.getenv(name, str(default)))
+    return value if value > 0 else None # 0 = no timeout
+
+PIPELINE_FETCH_TIMEOUT = _stage_timeout("PIPELINE_FETCH_TIMEOUT", IPFS_FETCH_TIMEOUT + 5)
+PIPELINE_ABHA_TIMEOUT = _stage_timeout("PIPELINE_ABHA_TIMEOUT", 10)
+PIPELINE_RULES_TIMEOUT = _stage_timeout("PIPELINE_RULES_TIMEOUT", 300) # Includes an OCR fallback pass
+PIPELINE_LLM_TIMEOUT = _stage_timeout("PIPELINE_LLM_TIMEOUT", LLM_DEADLINE_SECONDS + 10) # On timeout: rule-only verdict
+PIPELINE_RECORD_TIMEOUT = _stage_timeout("PIPELINE_RECORD_TIMEOUT", 10) # On timeout: the response is still returned
+_LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000, 300000)
+
+
+class StageTimeout(HTTPException):
+    """A pipeline stage ran past its timeout; surfaces as HTTP 504 unless the caller has a fallback."""
+
+    def __init__(self, stage: str, timeout: float):
+        super().__init__(status_code=504, detail=f"Claim verification stage '{stage}' timed out after {timeout:g}s.")
+        self.stage = stage
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram; quantiles are interpolated within the bucket they fall in."""
+
+    def __init__(self, buckets: Tuple[float, ...] = _LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Last slot: above the largest bucket
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, elapsed_ms: float):
+        self.counts[bisect.bisect_left(self.buckets, elapsed_ms)] += 1
+        self.count += 1; self.sum_ms += elapsed_ms; self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count: return None
+        rank, seen = q * self.count, 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max_ms
+                return round(min(self.max_ms, lower + (upper - lower) * (rank - seen) / n), 2)
+            seen += n
+        return self.max_ms
+
+    def snapshot(self) -> dict:
+        return {"count": self.count, "mean_ms": round(self.sum_ms / self.count, 2) if self.count else None,
+                "p50_ms": self.quantile(0.5), "p95_ms": self.quantile(0.95), "p99_ms": self.quantile(0.99), "max_ms": round(self.max_ms, 2),
+                "buckets": {**{f"le_{b}": n for b, n in zip(self.buckets, self.counts)}, "le_inf": self.counts[-1]}}
+
+
+class PipelineMetrics:
+    """Per-stage latency histograms, outcome counters and in-flight gauges for the claim pipeline."""
+
+    def __init__(self):
+        self.stages: Dict[str, dict] = {}
+
+    def _stage(self, name: str) -> dict:
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = {"in_flight": 0, "histogram": LatencyHistogram(), "outcomes": {}}
+        return stage
+
+    async def run(self, name: str, awaitable, timeout: Optional[float] = None):
+        """Awaits one stage under its timeout, recording latency and outcome. Cancellation propagates into the stage."""
+        stage = self._stage(name); stage["in_flight"] += 1
+        start = time.perf_counter(); outcome = "ok"
+        with span(f"stage.{name}") as stage_span:
+            try:
+                return await (asyncio.wait_for(awaitable, timeout) if timeout else awaitable)
+            except asyncio.TimeoutError:
+                outcome = "timeout"
+                raise StageTimeout(name, timeout)
+            except asyncio.CancelledError:
+                outcome = "cancelled"; raise
+            except _OcrDeferred:
+                outcome = "deferred"; raise
+            except HTTPException as e:
+                outcome = f"http_{e.status_code}"; raise
+            except Exception:
+                outcome = "error"; raise
+            finally:
+                stage_span.set(outcome=outcome)
+                stage["in_flight"] -= 1
+                stage["histogram"].observe((time.perf_counter() - start) * 1000)
+                stage["outcomes"][outcome] = stage["outcomes"].get(outcome, 0) + 1
+
+    def snapshot(self) -> dict:
+        return {name: {"in_flight": s["in_flight"], "outcomes": dict(s["outcomes"]), **s["histogram"].snapshot()} for name, s in self.stages.items()}
+
+    def reset(self):
+        """Starts new histograms and counters; stages already running finish against the old ones."""
+        self.stages = {}
+
+
+async def run_stages_concurrently(*stages) -> List[Any]:
+    """Runs independent stages together. The first failure cancels the others and is raised; otherwise returns results in order."""
+    tasks = [asyncio.ensure_future(stage) for stage in stages]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in tasks:
+            if task.done() and not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+        return [task.result() for task in tasks]
+    finally:
+        for task in tasks:
+            if not task.done(): task.cancel() # A failed sibling, or the client went away
+
+
+pipeline_metrics = PipelineMetrics()
+
+
+@app.get("/pipeline/metrics")
+def get_pipeline_metrics():
+    return {"stages": pipeline_metrics.snapshot(),
+            "timeouts_seconds": {"fetch": PIPELINE_FETCH_TIMEOUT, "abha": PIPELINE_ABHA_TIMEOUT, "rules": PIPELINE_RULES_TIMEOUT,
+                                 "llm": PIPELINE_LLM_TIMEOUT, "record": PIPELINE_RECORD_TIMEOUT}}
+
+
+@app.post("/pipeline/metrics/reset")
+def reset_pipeline_metrics():
+    pipeline_metrics.reset() # e.g. between a load test's warm-up and its measured run
+    return {"status": "reset"}
+
+
+# --- MAIN API ENDPOINT ---
+async def _lookup_abha(identifier: str) -> dict:
+    simplified_abha_dict = await lookup_abha_record(identifier)
+    if not simplified_abha_dict:
+        print(f"Error: ABHA Identifier '{identifier}' not found.")
+        raise HTTPException(status_code=404, detail=f"ABHA Identifier '{identifier}' not found.")
+    abha_data = AbhaRecord(**simplified_abha_dict) # Validate before handing it to the rule engine
+    print(f"Successfully fetched and parsed ABHA data for {abha_data.name}.")
+    return simplified_abha_dict
+
+
+async def _record_verified_claim(simplified_abha_dict: dict, extracted_data: dict, artifacts: dict, final_recommendation: str, claim_ref: Optional[str] = None):
+    """Adds a scored claim to the shared indexes later claims are checked against. The updates are independent and run together."""
+    async def record(description: str, func, *args):
+        try: await asyncio.to_thread(func, *args)
+        except Exception as e: print(f"Warning: Could not {description}: {e}")
+
+    updates = []
+    abha_id = simplified_abha_dict.get("abha_id")
+    # Remember the document and the claim it came with, so any other claim reusing it is caught by Rule 10
+    duplicate_index = get_duplicate_index()
+    if duplicate_index is not None and extracted_data.get("file_hash"):
+        updates.append(record("record document hash", duplicate_index.add, extracted_data["file_hash"], abha_id, claim_ref))
+    # ...and its MinHash signature, so an edited copy of it is caught by Rule 23
+    near_duplicate_index = get_near_duplicate_index()
+    if near_duplicate_index is not None and artifacts.get("minhash"):
+        updates.append(record("record document signature", near_duplicate_index.add, artifacts["minhash"], abha_id, extracted_data.get("file_hash")))
+    # ...and add the claim to the history Rules 4 and 13 read
+    claim_history = get_claim_history()
+    if claim_history is not None:
+        updates.append(record("record claim history", claim_history.record_claim, abha_id, extracted_data.get("bill_date"),
+                              extracted_data.get("total_amount") or 0.0, extracted_data.get("medications") or [], extracted_data.get("file_hash")))
+    # Approved bills feed the price distributions Rule 26 compares against
+    price_table = get_price_table()
+    if price_table is not None and final_recommendation == "APPROVE" and extracted_data.get("line_items"):
+        updates.append(record("update price table", price_table.add_claim, extracted_data["line_items"], _city_of(simplified_abha_dict.get("address", ""))))
+    await asyncio.gather(*updates)
+
+
+async def _score_claim(pdf_content: bytes, simplified_abha_dict: dict, wait_for_slot: bool = False, defer_ocr: bool = False, claim_ref: Optional[str] = None) -> dict:
+    """Steps 3-6 of claim verification: rules (with OCR fallback), AI score, hard-failure override, response."""
+    # Step 3: Run Rule Engine
+    try:
+        print(f"Running all checks ({rule_engine_executor.mode} mode)...")
+        pre_risk_score, detailed_analysis, red_flags, extracted_data, text_extraction, artifacts = await pipeline_metrics.run(
+            "rules", _run_rules_with_ocr(pdf_content, simplified_abha_dict, wait_for_slot, defer_ocr, claim_ref), PIPELINE_RULES_TIMEOUT)
+        print(f"Rule Engine finished. Pre-risk score: {pre_risk_score}, Red Flags: {len(red_flags)}")
+    except (HTTPException, _OcrDeferred):
+        raise # Backpressure (429) or shutdown (503) from the executor; async OCR hand-off
+    except ValueError as e: # Catch PDF text extraction error specifically
+        print(f"Error: Rule Engine failed on PDF extraction: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Error: Unexpected error during rule execution: {e}")
+        # Consider logging the full traceback here for debugging
+        raise HTTPException(status_code=500, detail=f"Error during rule execution: {e}")
+
+    # Step 4: Get AI Score
+    print("Getting AI score and reasoning...")
+    llm_payload, llm_prompt_stats = build_claim_payload(pre_risk_score, detailed_analysis, red_flags, extracted_data)
+    if LLM_SCHEDULER_ENABLED: # Background/batch claims (wait_for_slot) queue behind interactive ones
+        llm_stage = llm_scheduler.score(pre_risk_score, red_flags, llm_payload, priority=1 if wait_for_slot else 0)
+    else:
+        llm_stage = asyncio.to_thread(get_ai_score_and_reasoning, pre_risk_score, detailed_analysis, red_flags, extracted_data)
+    try:
+        final_score, final_reasoning, final_recommendation = await pipeline_metrics.run("llm", llm_stage, PIPELINE_LLM_TIMEOUT)
+    except StageTimeout as e:
+        final_score, final_reasoning, final_recommendation = _rule_only_verdict(pre_risk_score, red_flags, e.detail)
+    print(f"AI Result - Score: {final_score}, Recommendation: {final_recommendation}")
+
+
+    # Step 5: Final consistency check based on hard failures
+    hard_failure = pre_risk_score >= 100 or any("Fail" in flag for flag in red_flags)
+    if hard_failure and final_recommendation != "REJECT":
+        print(f"Overriding AI recommendation. Hard failure detected (Score: {pre_risk_score}, Flags: {red_flags})")
+        final_score = max(final_score, 85) # Ensure reject score
+        final_recommendation = "REJECT"
+        final_reasoning = f"[AUTO-REJECTED due to hard rule failure]. AI Reason: {final_reasoning}"
+
+    # Feed the duplicate, similarity, history and price indexes; a slow index never holds up the response past its timeout
+    try: await pipeline_metrics.run("record", _record_verified_claim(simplified_abha_dict, extracted_data, artifacts, final_recommendation, claim_ref), PIPELINE_RECORD_TIMEOUT)
+    except StageTimeout as e: print(f"Warning: {e.detail}")
+
+    # Step 6: Return comprehensive response
+    return {
+        "aggregate_score": final_score,
+        "reasoning": final_reasoning,
+        "recommendation": final_recommendation,
+        "pre_risk_score": pre_risk_score,
+        "red_flags": red_flags,
+        "detailed_analysis_steps": detailed_analysis,
+        "extracted_data_points": extracted_data,
+        "text_extraction": text_extraction, # Pages read, pages without text, early-stop reason
+        "llm_prompt": llm_prompt_stats, # Estimated prompt tokens for this claim
+        "simplified_abha_data_used": simplified_abha_dict # Include the ABHA data used
+    }
+
+
+@app.post("/verify-claim/")
+# MODIFIED: Accepts JSON input via ClaimRequest model
+async def verify_claim(request: ClaimRequest):
+    print(f"Received request for ABHA ID: {request.abha_identifier}, IPFS Hash: {request.ipfs_hash}")
+    return await pipeline_metrics.run("request", _verify_claim_stages(request))
+
+
+async def _verify_claim_stages(request: ClaimRequest):
+    try:
+        # Steps 1-2 don't depend on each other: fetch the PDF from IPFS while the ABHA record is looked up
+        pdf_content, simplified_abha_dict = await run_stages_concurrently(
+            pipeline_metrics.run("fetch", fetch_pdf_from_ipfs(request.ipfs_hash), PIPELINE_FETCH_TIMEOUT),
+            pipeline_metrics.run("abha", _lookup_abha(request.abha_identifier), PIPELINE_ABHA_TIMEOUT),
+        )
+
+    except HTTPException as e:
+        raise e # Re-raise HTTP exceptions from helpers
+    except Exception as e:
+        print(f"Error during input processing: {e}")
+        raise HTTPException(status_code=400, detail=f"Invalid Input or DB Error: {e}")
+
+    try:
+        result = await _score_claim(pdf_content, simplified_abha_dict, defer_ocr=request.ocr_async, claim_ref=request.claim_id)
+    except _OcrDeferred:
+        # Scanned bill: finish it in the background instead of holding the connection open
+        job = claim_jobs.submit(_score_claim(pdf_content, simplified_abha_dict, wait_for_slot=True, claim_ref=request.claim_id))
+        print(f"Claim needs OCR; queued as job {job['job_id']}.")
+        return JSONResponse(status_code=202, content={"job_id": job["job_id"], "status": job["status"], "poll": f"/verify-claim/jobs/{job['job_id']}"})
+    print("Sending final response.")
+    return result
+
+
+# --- NEW: Batch verification endpoint ---
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+BATCH_MAX_CLAIMS = int(os.getenv("BATCH_MAX_CLAIMS", "100000"))
+
+def _parse_batch_payload(body: bytes, content_type: str) -> List[Any]:
+    """Returns one entry per claim: a ClaimRequest, or an HTTPException describing why that entry is invalid."""
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        try: text = body.decode("utf-8")
+        except UnicodeDecodeError as e: raise HTTPException(status_code=400, detail=f"Invalid NDJSON body: not UTF-8 ({e})")
+        raw_items = []
+        for line_no, line in enumerate(text.splitlines(), start=1):
+            if not line.strip(): continue
+            try: raw_items.append(json.loads(line))
+            except ValueError as e: raw_items.append(HTTPException(status_code=400, detail=f"Line {line_no}: invalid JSON ({e})"))
+    else:
+        try: payload = json.loads(body or b"[]")
+        except ValueError as e: raise HTTPException(status_code=400, detail=f"Invalid JSON body: {e}")
+        raw_items = payload.get("claims") if isinstance(payload, dict) else payload
+        if not isinstance(raw_items, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON list of claims, {\"claims\": [...]}, or an NDJSON upload.")
+    if len(raw_items) > BATCH_MAX_CLAIMS:
+        raise HTTPException(status_code=413, detail=f"Batch has {len(raw_items)} claims; the limit is {BATCH_MAX_CLAIMS}.")
+    claims = []
+    for item in raw_items:
+        if isinstance(item, HTTPException): claims.append(item); continue
+        try: claims.append(ClaimRequest(**item))
+        except Exception as e: claims.append(HTTPException(status_code=422, detail=f"Invalid claim: {e}"))
+    return claims
+
+
+class _BatchVerifier:
+    """
+    Verifies one batch with bounded parallelism, sharing work between claims.
+
+    Each distinct CID is fetched once and each distinct identifier is looked up
+    once; fetched PDFs are dropped as soon as the last claim using them is scored.
+    Claims with the same (CID, identifier, claim id) are verified once and the
+    result is reported for every occurrence.
+    """
+
+    def __init__(self, claims: List[Any], max_concurrency: int):
+        self.claims = claims
+        self.semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self.pdf_tasks: Dict[str, asyncio.Task] = {}
+        self.abha_tasks: Dict[str, asyncio.Task] = {}
+        self.cid_users: Dict[str, int] = {}
+        for claim in claims:
+            if isinstance(claim, ClaimRequest):
+                self.cid_users[claim.ipfs_hash] = self.cid_users.get(claim.ipfs_hash, 0) + 1
+
+    def _shared(self, tasks: Dict[str, asyncio.Task], key: str, factory) -> "asyncio.Task":
+        task = tasks.get(key)
+        if task is None:
+            task = tasks[key] = asyncio.ensure_future(factory())
+        return task
+
+    def _release_pdf(self, cid: str, count: int):
+        self.cid_users[cid] -= count
+        if self.cid_users[cid] <= 0:
+            self.pdf_tasks.pop(cid, None)
+
+    async def _verify_pair(self, cid: str, identifier: str, claim_id: Optional[str]) -> dict:
+        async with self.semaphore:
+            pdf_task = self._shared(self.pdf_tasks, cid, lambda: pipeline_metrics.run("fetch", fetch_pdf_from_ipfs(cid), PIPELINE_FETCH_TIMEOUT))
+            abha_task = self._shared(self.abha_tasks, identifier, lambda: pipeline_metrics.run("abha", _lookup_abha(identifier), PIPELINE_ABHA_TIMEOUT))
+            # Stages that don't depend on each other run together
+            pdf_content, simplified_abha_dict = await asyncio.gather(asyncio.shield(pdf_task), asyncio.shield(abha_task))
+            return await _score_claim(pdf_content, simplified_abha_dict, wait_for_slot=True, claim_ref=claim_id)
+
+    async def _run_group(self, cid: str, identifier: str, claim_id: Optional[str], indexes: List[int]) -> Tuple[List[int], dict]:
+        try:
+            result = await self._verify_pair(cid, identifier, claim_id)
+            line = {"status": 200, "result": result}
+        except HTTPException as e:
+            line = {"status": e.status_code, "error": e.detail}
+        except Exception as e:
+            print(f"Error: Unexpected error verifying batch claim ({cid}, {identifier}): {e}")
+            line = {"status": 500, "error": f"Error during claim verification: {e}"}
+        finally:
+            self._release_pdf(cid, len(indexes))
+        return indexes, line
+
+    async def stream(self):
+        groups: Dict[Tuple[str, str, Optional[str]], List[int]] = {}
+        for index, claim in enumerate(self.claims):
+            if isinstance(claim, HTTPException):
+                yield json.dumps({"index": index, "status": claim.status_code, "error": claim.detail}) + "\n"
+            else:
+                groups.setdefault((claim.ipfs_hash, claim.abha_identifier, claim.claim_id), []).append(index)
+        print(f"Batch: {len(self.claims)} claims, {len(groups)} unique claims, {len(self.cid_users)} unique CIDs.")
+        pending = {asyncio.ensure_future(self._run_group(cid, identifier, claim_id, indexes)) for (cid, identifier, claim_id), indexes in groups.items()}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    indexes, line = task.result()
+                    for index in indexes:
+                        claim = self.claims[index]
+                        yield json.dumps({"index": index, "ipfs_hash": claim.ipfs_hash, "abha_identifier": claim.abha_identifier, **line}, default=str) + "\n"
+        finally:
+            for task in list(pending) + list(self.pdf_tasks.values()) + list(self.abha_tasks.values()):
+                task.cancel() # Client went away or the stream was closed early
+
+
+@app.post("/verify-claims/batch")
+async def verify_claims_batch(request: Request):
+    """
+    Verifies many claims in one call. Accepts a JSON list of ClaimRequests (or
+    {"claims": [...]}), an NDJSON body, or an NDJSON file uploaded as form field
+    `file`. Results stream back as NDJSON, one line per input claim in completion
+    order, each tagged with the claim's `index` in the input.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None:
+            raise HTTPException(status_code=400, detail="Multipart batch uploads must use the form field 'file'.")
+        body = await upload.read()
+        content_type = "application/x-ndjson"
+    else:
+        body = await request.body()
+    claims = _parse_batch_payload(body, content_type)
+    print(f"Received batch of {len(claims)} claims.")
+    return StreamingResponse(_BatchVerifier(claims, BATCH_MAX_CONCURRENCY).stream(), media_type="application/x-ndjson")
 
-    # Step 6: Return comprehensive response
-    print("Sending final response.")
-    return {
-        "aggregate_score": final_score,
-        "reasoning": final_reasoning,
-        "recommendation": final_recommendation,
-        "pre_risk_score": pre_risk_score,
-        "red_flags": red_flags,
-        "detailed_analysis_steps": detailed_analysis,
-        "extracted_data_points": engine.extracted,
-        "simplified_abha_data_used": simplified_abha_dict # Include the ABHA data used
-    }
 
 # --- Server Run Command ---
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "import-hashes":
+        # Bulk-load historical document hashes: python index.py import-hashes archive.csv [more.ndjson ...] ("-" = stdin)
+        index = get_duplicate_index()
+        if index is None: sys.exit("Duplicate document index is disabled or unavailable.")
+        for source in sys.argv[2:] or ["-"]:
+            with (sys.stdin if source == "-" else open(source, "r", encoding="utf-8")) as lines:
+                added = index.add_many(_iter_hash_import(lines))
+            print(f"{source}: {added} new hash(es) imported.")
+        print(json.dumps(index.stats(), indent=2))
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "import-prices":
+        # Seed Rule 26 price distributions: python index.py import-prices prices.csv (rows: item,city,amount[,qty]; "-" = stdin)
+        table = get_price_table()
+        if table is None: sys.exit("Price table is disabled or unavailable.")
+        for source in sys.argv[2:] or ["-"]:
+            with (sys.stdin if source == "-" else open(source, "r", encoding="utf-8")) as lines:
+                by_city: Dict[str, List[Tuple[str, int, float]]] = {}
+                for item, city, qty, amount in _iter_price_import(lines): by_city.setdefault(city, []).append((item, qty, amount))
+                added = sum(table.add_claim(items, city) for city, items in by_city.items())
+            print(f"{source}: {added} price observation(s) imported.")
+        print(json.dumps(table.stats(), indent=2))
+        sys.exit(0)
     import uvicorn
-    # Make sure dummy_abha_database.json is in the same directory
-    db_file = "dummy_abha_database.json"
+    # Make sure dummy_abha_database.json is in the same directory (or set ABHA_DB_PATH)
+    db_file = ABHA_DB_PATH
     if not os.path.exists(db_file):
         print(f"\nERROR: '{db_file}' file not found.")
-        print("Please create it with the large JSON data provided earlier.\n")
+        print("Please create it with the large JSON data provided earlier,")
+        print("or generate one: python benchmarks/generate_dataset.py --out dataset (then set ABHA_DB_PATH).\n")
     else:
         print(f"Found '{db_file}'. Starting server...")
         uvicorn.run(app, host="0.0.0.0", port=8000)
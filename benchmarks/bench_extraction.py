@@ -0,0 +1,132 @@
+"""
+Benchmark: anchored `scan_bill_text` vs the original per-pattern regex extraction.
+
+Builds synthetic multi-page hospital bills, checks both extractors agree on every
+field, then times them.
+
+    python benchmarks/bench_extraction.py --pages 1 10 50 200 --iterations 20
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+import index  # noqa: E402
+
+
+# --- Baseline: the extraction the rule engine used before scan_bill_text ---
+def legacy_extract(pdf_text: str) -> dict:
+    pdf_lower = pdf_text.lower()
+    out = {"provider_name": "UNKNOWN", "total_amount": 0.0, "bill_date": None, "doc_reg_id": None}
+    lines = pdf_text.split('\n'); provider_found = False
+    for i in range(min(5, len(lines))):
+        line_upper = lines[i].strip().upper()
+        if "CLINIC" in line_upper or "HOSPITAL" in line_upper or "MEDICAL CENTER" in line_upper:
+            out["provider_name"] = line_upper; provider_found = True; break
+    if not provider_found and len(lines) > 1: out["provider_name"] = lines[1].strip().upper()
+    total_match = re.search(r"(net amount|total amount|net payable).*?([\d,]+\.?\d{2})", pdf_lower, re.DOTALL | re.IGNORECASE)
+    if total_match:
+        try: out["total_amount"] = float(total_match.group(2).replace(",", ""))
+        except: pass
+    date_match = re.search(r"(?:bill|invoice)\s*date:?\s*(\d{1,2}[-/]\d{1,2}[-/]\d{4})", pdf_lower)
+    if date_match:
+        try: out["bill_date"] = index.date_parse(date_match.group(1).replace('/', '-'), dayfirst=True)
+        except: pass
+    reg_match = re.search(r"reg(?:istration)?\.?\s*id:?\s*([A-Za-z0-9/\-]+)", pdf_text, re.IGNORECASE)
+    if reg_match: out["doc_reg_id"] = reg_match.group(1).upper()
+    diag_patterns = [r"diagnosis:?\s*(?:[A-Z]\d{2}(?:\.\d+)?)\s*-\s*([\w\s\(\),/\-]+)", r"primary diagnosis:?\s*([\w\s\(\),/\-]+)", r"secondary diagnosis:?\s*([\w\s\(\),/\-]+)", r"provisional diagnosis:?\s*([\w\s\(\),/\-]+)"]
+    found_diags = set()
+    for pattern in diag_patterns:
+        for match in re.finditer(pattern, pdf_text, re.IGNORECASE):
+            diag_text = match.group(1).strip().lower(); diag_text = re.sub(r'\((primary|secondary)\)', '', diag_text).strip()
+            if diag_text and len(diag_text) > 3: found_diags.add(diag_text)
+    out["diagnoses"] = found_diags
+    med_patterns = [r"medicine:?\s*([\w\s\-\(\)\+]+?)\s*(?:\(|tab|mg|inj|unit|cream|suspension|\d)", r"rx only\s*([\w\s\-\+]+)", r"prescribed_medications\":\s*\[\"([\w\s\d]+)"]
+    found_meds = set(); ignore_words = index._MED_IGNORE_WORDS
+    for pattern in med_patterns:
+        for match in re.finditer(pattern, pdf_text, re.IGNORECASE):
+            med_name = match.group(1).strip().lower(); med_name_cleaned = re.sub(r'\s*\d+.*', '', med_name).strip()
+            is_ignored = any(word == med_name_cleaned for word in ignore_words) or any(word in med_name_cleaned.split() for word in ignore_words)
+            if med_name_cleaned and len(med_name_cleaned) > 3 and not is_ignored: found_meds.add(med_name_cleaned)
+    out["medications"] = found_meds
+    # Signals the _check_* methods used to re-derive from the full text
+    out["icd_codes"] = re.findall(r"\b([A-Z]\d{2}(?:\.[0-9A-Z]{1,4})?)\b", pdf_text)
+    out["has_bill_id"] = bool(re.search(r"bill id|invoice no", pdf_lower))
+    out["non_ascii_count"] = len(re.findall(r'[^\x00-\x7F\s]', pdf_text))
+    flags = {}
+    flags["opd"] = "opd" in pdf_lower or "outpatient" in pdf_lower or "consultation" in pdf_lower
+    flags["patient name"] = bool(re.search(r"patient name", pdf_lower))
+    flags["doctor"] = bool(re.search(r"doctor|dr\.", pdf_lower))
+    flags["dob"] = bool(re.search(r"date of birth|dob", pdf_lower))
+    flags["spirometry"] = "spirometry" in pdf_lower or "pft" in pdf_lower
+    flags["bp"] = "blood pressure" in pdf_lower or " bp " in pdf_lower
+    flags["hba1c"] = "hba1c" in pdf_lower or "glycated hemoglobin" in pdf_lower
+    out["flags"] = flags
+    return out
+
+
+def scan_extract(pdf_text: str) -> dict:
+    fields = index.scan_bill_text(pdf_text)
+    kw = fields.pop("keywords")
+    fields["diagnoses"] = set(fields["diagnoses"]); fields["medications"] = set(fields["medications"])
+    fields["flags"] = {
+        "opd": bool(kw & {"opd", "outpatient", "consultation"}), "patient name": "patient name" in kw,
+        "doctor": bool(kw & {"doctor", "dr."}), "dob": bool(kw & {"date of birth", "dob"}),
+        "spirometry": bool(kw & {"spirometry", "pft"}), "bp": bool(kw & {"blood pressure", " bp "}),
+        "hba1c": bool(kw & {"hba1c", "glycated hemoglobin"}),
+    }
+    return fields
+
+
+# --- Synthetic hospital bills ---
+_DIAGNOSES = [("I10", "Essential Hypertension"), ("J45", "Bronchial Asthma"), ("E11", "Type 2 Diabetes Mellitus"), ("M08.0", "Juvenile Rheumatoid Arthritis")]
+_MEDICINES = ["Losartan 50mg Tab", "Metformin 500mg Tab", "Albuterol Inhaler (100mcg)", "Methotrexate 7.5mg Tab", "Pantoprazole 40mg Inj"]
+_SERVICES = ["Room Charges (General Ward)", "Nursing Charges", "CBC Test", "HbA1c Test", "Blood Pressure Monitoring", "Spirometry (PFT)", "Physiotherapy Sessions", "X-Ray Chest PA View"]
+
+def make_bill(pages: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    code, diag = rng.choice(_DIAGNOSES)
+    page_texts = [
+        "INVOICE\nMUMBAI ARTHRITIS & HEART CLINIC\n12 Marine Drive, Mumbai 400001\n"
+        f"Bill ID: INV-{rng.randint(10000, 99999)}   Bill Date: {rng.randint(1, 28):02d}-{rng.randint(1, 12):02d}-2025\n"
+        "Patient Name: Aarav Sharma   DOB: 01-01-1981   Mumbai\n"
+        "Consulting Doctor: Dr. Alok Deshpande   Reg. ID: MH-MC-11223\n"
+        f"Primary Diagnosis: {code} - {diag}\nAdmission: In-patient\n"
+    ]
+    for p in range(1, pages):
+        rows = [f"{i + 1}. {rng.choice(_SERVICES)}  Qty {rng.randint(1, 5)}  Amount {rng.randint(100, 9000)}.00" for i in range(40)]
+        if p % 3 == 0: rows.append(f"Medicine: {rng.choice(_MEDICINES)}  Qty 10")
+        if p % 7 == 0: rows.append("Progress note: patient stable, vitals within range. Registration desk updated.")
+        page_texts.append(f"Page {p + 1}\n" + "\n".join(rows) + "\n")
+    page_texts.append(f"Medicine: {rng.choice(_MEDICINES)}\nTotal Amount: {rng.randint(1000, 500000):,}.00\nNet Payable: Rs. 12,345.00\n")
+    return "".join(page_texts)
+
+
+def _time(fn, text: str, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations): fn(text)
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 50, 200])
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'pages':>6} {'chars':>9} {'legacy ms':>10} {'scan ms':>9} {'speedup':>8}")
+    for pages in args.pages:
+        text = make_bill(pages, seed=pages)
+        legacy, scanned = legacy_extract(text), scan_extract(text)
+        if legacy != scanned:
+            diff = {k: (legacy.get(k), scanned.get(k)) for k in set(legacy) | set(scanned) if legacy.get(k) != scanned.get(k)}
+            raise SystemExit(f"Extractors disagree on a {pages}-page bill: {diff}")
+        legacy_ms, scan_ms = _time(legacy_extract, text, args.iterations), _time(scan_extract, text, args.iterations)
+        print(f"{pages:>6} {len(text):>9} {legacy_ms:>10.2f} {scan_ms:>9.2f} {legacy_ms / scan_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
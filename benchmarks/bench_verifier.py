@@ -0,0 +1,339 @@
+"""
+Benchmark and load test for the claim verifier.
+
+    micro    times ABHA lookups, each extraction step and each RuleEngine rule on generated bills
+    load     starts stub IPFS and LLM servers and the API (uvicorn), drives /verify-claim/ at each
+             --concurrency level, and reports throughput, client latency and the per-stage
+             p50/p95/p99 from /pipeline/metrics
+    compare  diffs two result files and exits 1 if any latency or throughput regressed past --threshold
+
+Both runs use a dataset from generate_dataset.py (--dataset), or generate a small one. Each
+run keeps its duplicate, history and cache stores in a scratch directory, so runs start
+from the same state. --json saves the results, tagged with the git commit.
+
+    python benchmarks/bench_verifier.py micro --bills 20 --iterations 10 --json base-micro.json
+    python benchmarks/bench_verifier.py load --concurrency 1 8 32 --requests 300 --json base-load.json
+    python benchmarks/bench_verifier.py compare base-load.json head-load.json --threshold 0.15
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_API_DIR = os.path.join(_HERE, "..", "api")
+sys.path.insert(0, _HERE)
+sys.path.insert(0, _API_DIR)
+
+# State the API keeps on disk; pointed into the run's scratch directory
+_STATE_ENV = {"DUPLICATE_INDEX_PATH": "duplicates/doc-hashes", "NEAR_DUP_PATH": "duplicates/near-dup", "CLAIM_HISTORY_PATH": "duplicates/claim-history",
+              "PRICE_TABLE_PATH": "duplicates/price-table", "PDF_CACHE_DIR": "pdf-cache", "OCR_CACHE_DIR": "ocr-cache", "KB_CACHE_DIR": "kb-cache"}
+
+
+def summarize(samples_ms: list) -> dict:
+    """Count, mean and interpolated p50/p95/p99 of latency samples."""
+    if not samples_ms: return {"count": 0}
+    ordered = sorted(samples_ms)
+    def quantile(q: float) -> float:
+        pos = q * (len(ordered) - 1)
+        low = int(pos); high = min(low + 1, len(ordered) - 1)
+        return round(ordered[low] + (ordered[high] - ordered[low]) * (pos - low), 3)
+    return {"count": len(ordered), "mean_ms": round(sum(ordered) / len(ordered), 3),
+            "p50_ms": quantile(0.5), "p95_ms": quantile(0.95), "p99_ms": quantile(0.99), "max_ms": round(ordered[-1], 3)}
+
+
+def run_metadata(command: str, args: argparse.Namespace) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=_HERE, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"command": command, "commit": commit, "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "args": vars(args)}
+
+
+def state_env(directory: str) -> dict:
+    return {name: os.path.join(directory, path) for name, path in _STATE_ENV.items()}
+
+
+def prepare_dataset(args: argparse.Namespace, scratch: str) -> str:
+    if args.dataset:
+        return args.dataset
+    import generate_dataset
+    out = os.path.join(scratch, "dataset")
+    generate_dataset.generate(out, args.records, args.claims, (1, args.max_pages), generate_dataset.DEFAULT_RATES, seed=0, workers=os.cpu_count() or 1)
+    return out
+
+
+def load_claims(dataset: str) -> list:
+    with open(os.path.join(dataset, "claims.jsonl"), "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def print_table(title: str, rows: dict):
+    print(f"\n{title}")
+    print(f"{'':<34} {'count':>7} {'mean ms':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for name, s in rows.items():
+        if not s.get("count"): continue
+        print(f"{name:<34} {s['count']:>7} {s['mean_ms']:>10.3f} {s['p50_ms']:>10.3f} {s['p95_ms']:>10.3f} {s['p99_ms']:>10.3f}")
+
+
+# --- micro: extraction steps and rules, in process ---
+def run_micro(args: argparse.Namespace, dataset: str) -> dict:
+    import index
+    db_path = os.path.join(dataset, "dummy_abha_database.json")
+    claims = load_claims(dataset)[:args.bills]
+    samples = {}
+    def timed(name: str, fn, *a):
+        start = time.perf_counter()
+        result = fn(*a)
+        samples.setdefault(name, []).append((time.perf_counter() - start) * 1000)
+        return result
+
+    timed("abha.store_load", index.get_abha_store(db_path).ensure_loaded)
+    plan = index.RULE_REGISTRY.plan()
+    for claim in claims:
+        with open(os.path.join(dataset, "ipfs", claim["ipfs_hash"]), "rb") as f: pdf = f.read()
+        for _ in range(args.iterations):
+            abha_dict = timed("abha.get_simplified_abha_data", index.get_simplified_abha_data, db_path, claim["abha_identifier"])
+            abha = index.AbhaRecord(**abha_dict)
+            engine = timed("extract.pdf_text", index.RuleEngine, pdf, abha)
+            timed("extract.scan_bill_text", index.scan_bill_text, engine.pdf_text, engine.pdf_lower)
+            timed("extract.line_items", index.extract_line_items, engine.pdf_text)
+            timed("extract.all", engine._extract_data_from_pdf)
+            for spec in plan.order:
+                if spec.name in plan.disabled: continue
+                timed(f"rule.{spec.name}", spec.func, engine, index.RuleResult(plan.weights[spec.name]))
+            timed("engine.total", index._run_rule_engine, pdf, abha_dict)
+    results = {name: summarize(values) for name, values in samples.items()}
+    print_table(f"Micro benchmarks ({len(claims)} bills x {args.iterations} iterations)", results)
+    return results
+
+
+# --- load: the API under concurrent /verify-claim/ traffic ---
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve_ipfs(directory: str, port: int, latency_ms: float, jitter_ms: float) -> ThreadingHTTPServer:
+    """Stub IPFS gateway: GET /ipfs/<cid> returns the file named <cid> in `directory` after a simulated delay."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            cid = self.path.rsplit("/", 1)[-1]
+            path = os.path.join(directory, cid)
+            time.sleep(max(0.0, latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000)
+            if not cid.isalnum() or not os.path.isfile(path):
+                self.send_response(404); self.send_header("Content-Length", "0"); self.end_headers()
+                return
+            with open(path, "rb") as f: data = f.read()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/pdf")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_api(env: dict, port: int, log_path: str) -> subprocess.Popen:
+    log = open(log_path, "ab")
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "index:app", "--app-dir", _API_DIR, "--host", "127.0.0.1", "--port", str(port),
+                             "--log-level", "warning"], env=env, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    return proc
+
+
+async def wait_ready(client, base_url: str, proc: subprocess.Popen, timeout: float = 120.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"API exited with code {proc.returncode} during startup")
+        try:
+            if (await client.get(f"{base_url}/pipeline/metrics")).status_code == 200: return
+        except Exception:
+            pass
+        await asyncio.sleep(0.25)
+    raise RuntimeError(f"API not ready after {timeout:.0f}s")
+
+
+async def drive(client, base_url: str, claims: list, requests: int, concurrency: int) -> dict:
+    """Closed loop: `concurrency` workers each send their next claim as soon as the previous one is answered."""
+    latencies, statuses = [], {}
+    next_index = 0
+    async def worker():
+        nonlocal next_index
+        while next_index < requests:
+            claim = claims[next_index % len(claims)]; next_index += 1
+            start = time.perf_counter()
+            try:
+                response = await client.post(f"{base_url}/verify-claim/", json={"ipfs_hash": claim["ipfs_hash"], "abha_identifier": claim["abha_identifier"]})
+                status = str(response.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    return {"wall_s": round(wall, 3), "throughput_rps": round(requests / wall, 3), "status": statuses, "client": summarize(latencies)}
+
+
+async def load_level(args: argparse.Namespace, claims: list, env: dict, concurrency: int, scratch: str) -> dict:
+    import httpx
+    level_dir = os.path.join(scratch, f"c{concurrency}")
+    env = {**env, **state_env(level_dir)}
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    proc = start_api(env, port, os.path.join(scratch, "api.log"))
+    try:
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(timeout=args.request_timeout, limits=limits) as client:
+            await wait_ready(client, base_url, proc)
+            if args.warmup:
+                await drive(client, base_url, claims[-args.warmup:], args.warmup, min(concurrency, args.warmup))
+                (await client.post(f"{base_url}/pipeline/metrics/reset")).raise_for_status()
+            result = await drive(client, base_url, claims, args.requests, concurrency)
+            metrics = (await client.get(f"{base_url}/pipeline/metrics")).json()
+            rules = (await client.get(f"{base_url}/rules")).json()
+    finally:
+        proc.terminate()
+        try: proc.wait(timeout=30)
+        except subprocess.TimeoutExpired: proc.kill()
+    stages = {name: {k: v for k, v in s.items() if k != "buckets"} for name, s in metrics.get("stages", {}).items()}
+    rule_stats = {r["name"]: r["stats"] for r in rules.get("rules", []) if r.get("stats")} # Includes warm-up claims
+    return {"concurrency": concurrency, "requests": args.requests, **result, "stages": stages, "rules": rule_stats}
+
+
+def run_load(args: argparse.Namespace, dataset: str, scratch: str) -> list:
+    import fake_llm_server
+    claims = load_claims(dataset)
+    ipfs_port, llm_port = free_port(), free_port()
+    ipfs = serve_ipfs(os.path.join(dataset, "ipfs"), ipfs_port, args.ipfs_latency_ms, args.ipfs_jitter_ms)
+    llm = fake_llm_server.serve(llm_port, latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms)
+    env = {**os.environ,
+           "ABHA_DB_PATH": os.path.abspath(os.path.join(dataset, "dummy_abha_database.json")),
+           "POLICY_DB_PATH": os.path.abspath(os.path.join(dataset, "policies.json")),
+           "IPFS_GATEWAYS": f"http://127.0.0.1:{ipfs_port}/ipfs/",
+           "GROQ_API_KEY": "fake", "GROQ_BASE_URL": f"http://127.0.0.1:{llm_port}",
+           "LLM_RPM": str(args.llm_rpm), "LLM_TPM": "0"}
+    if args.no_pdf_cache: env["PDF_CACHE_ENABLED"] = "0"
+    levels = []
+    try:
+        for concurrency in args.concurrency:
+            level = asyncio.run(load_level(args, claims, env, concurrency, scratch))
+            levels.append(level)
+            print(f"\nconcurrency {concurrency}: {level['requests']} requests in {level['wall_s']}s = {level['throughput_rps']} req/s, status {level['status']}")
+            print_table("Client latency, then per stage from /pipeline/metrics", {"client": level["client"], **level["stages"]})
+    finally:
+        ipfs.shutdown(); llm.shutdown()
+    return levels
+
+
+# --- compare: regressions between two result files ---
+_QUANTILE_KEYS = ("mean_ms", "p50_ms", "p95_ms", "p99_ms")
+
+def flatten(results: dict) -> dict:
+    """Comparable metrics as {name: (value, higher_is_better)}."""
+    flat = {}
+    for name, s in results.get("micro", {}).items():
+        for key in _QUANTILE_KEYS:
+            if s.get(key) is not None: flat[f"micro.{name}.{key}"] = (s[key], False)
+    for level in results.get("load", []):
+        prefix = f"load.c{level['concurrency']}"
+        flat[f"{prefix}.throughput_rps"] = (level["throughput_rps"], True)
+        for name, s in {"client": level["client"], **level.get("stages", {})}.items():
+            for key in _QUANTILE_KEYS:
+                if s.get(key) is not None: flat[f"{prefix}.{name}.{key}"] = (s[key], False)
+    return flat
+
+
+def run_compare(args: argparse.Namespace) -> int:
+    with open(args.base, "r", encoding="utf-8") as f: base = json.load(f)
+    with open(args.head, "r", encoding="utf-8") as f: head = json.load(f)
+    old, new = flatten(base), flatten(head)
+    print(f"base {base.get('meta', {}).get('commit')} -> head {head.get('meta', {}).get('commit')} (threshold {args.threshold:.0%})")
+    regressions = 0
+    for name in sorted(set(old) & set(new)):
+        (before, higher_is_better), (after, _) = old[name], new[name]
+        if not before: continue
+        change = (after - before) / before
+        worse = -change if higher_is_better else change
+        if abs(change) < args.threshold and not args.all: continue
+        marker = "REGRESSION" if worse >= args.threshold else ("improved" if -worse >= args.threshold else "")
+        regressions += marker == "REGRESSION"
+        print(f"{name:<60} {before:>12.3f} {after:>12.3f} {change:>+8.1%}  {marker}")
+    print(f"{regressions} regression(s)")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name in ("micro", "load"):
+        sub = commands.add_parser(name)
+        sub.add_argument("--dataset", help="Directory written by generate_dataset.py (default: generate a small one)")
+        sub.add_argument("--records", type=int, default=5000, help="ABHA records when generating")
+        sub.add_argument("--claims", type=int, default=200, help="Claims when generating")
+        sub.add_argument("--max-pages", type=int, default=5, help="Pages per generated bill: 1 to this")
+        sub.add_argument("--json", help="Write results here")
+        sub.add_argument("--keep-scratch", action="store_true", help="Keep the scratch directory (API log, stores)")
+    micro = commands.choices["micro"]
+    micro.add_argument("--bills", type=int, default=20)
+    micro.add_argument("--iterations", type=int, default=10)
+    load = commands.choices["load"]
+    load.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    load.add_argument("--requests", type=int, default=200, help="Requests per concurrency level")
+    load.add_argument("--warmup", type=int, default=10, help="Requests sent before measuring")
+    load.add_argument("--request-timeout", type=float, default=120.0)
+    load.add_argument("--ipfs-latency-ms", type=float, default=50)
+    load.add_argument("--ipfs-jitter-ms", type=float, default=20)
+    load.add_argument("--llm-latency-ms", type=float, default=300)
+    load.add_argument("--llm-jitter-ms", type=float, default=100)
+    load.add_argument("--llm-rpm", type=float, default=0, help="LLM_RPM for the API (0 = no client-side rate limit)")
+    load.add_argument("--no-pdf-cache", action="store_true", help="Fetch every PDF from the stub gateway")
+    compare = commands.add_parser("compare")
+    compare.add_argument("base")
+    compare.add_argument("head")
+    compare.add_argument("--threshold", type=float, default=0.10, help="Relative change that counts (0.10 = 10%%)")
+    compare.add_argument("--all", action="store_true", help="Print every metric, not just changed ones")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        sys.exit(run_compare(args))
+    scratch = tempfile.mkdtemp(prefix="trustlynk-bench-")
+    os.environ.update(state_env(os.path.join(scratch, "micro"))) # Before index is imported
+    try:
+        dataset = prepare_dataset(args, scratch)
+        results = {"meta": run_metadata(args.command, args)}
+        if args.command == "micro":
+            results["micro"] = run_micro(args, dataset)
+        else:
+            results["load"] = run_load(args, dataset, scratch)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f: json.dump(results, f, indent=2)
+            print(f"\nResults written to {args.json}")
+    finally:
+        if args.keep_scratch: print(f"Scratch directory: {scratch}")
+        else: shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Fake Groq (OpenAI-compatible) chat completion server for exercising the LLM scheduler.
+
+Answers POST /openai/v1/chat/completions with a JSON verdict. Packed prompts get
+one verdict per claim id. The server can add latency, return 429 with
+Retry-After above a requests-per-minute limit, and fail a fraction of calls.
+
+    python benchmarks/fake_llm_server.py --port 8099 --latency-ms 400 --rpm 30
+    GROQ_API_KEY=fake GROQ_BASE_URL=http://127.0.0.1:8099 uvicorn index:app --app-dir api
+"""
+import argparse
+import collections
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_CLAIM_ID_RE = re.compile(r'"id":\s*"([^"<][^"]*)"') # Skips the "<claim id>" placeholder in the output spec
+_RISK_SCORE_RE = re.compile(r'"pre_risk_score":\s*(\d+)')
+
+
+def fake_verdict(pre_risk_score: int) -> dict:
+    if pre_risk_score >= 100: return {"aggregate_score": 90, "reasoning": "Fake: hard rule failure.", "recommendation": "REJECT"}
+    if pre_risk_score == 0: return {"aggregate_score": 10, "reasoning": "Fake: no rule findings.", "recommendation": "APPROVE"}
+    return {"aggregate_score": 50, "reasoning": "Fake: warnings need a human check.", "recommendation": "PENDING REVIEW"}
+
+
+class FakeLlm:
+    def __init__(self, latency_ms: float, jitter_ms: float, rpm: int, fail_rate: float, retry_after: float):
+        self.latency_ms, self.jitter_ms, self.rpm = latency_ms, jitter_ms, rpm
+        self.fail_rate, self.retry_after = fail_rate, retry_after
+        self.recent = collections.deque()
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()
+
+    def admit(self) -> bool:
+        """Sliding one-minute window, like a provider-side RPM limit."""
+        if not self.rpm: return True
+        now = time.monotonic()
+        with self.lock:
+            while self.recent and now - self.recent[0] > 60: self.recent.popleft()
+            if len(self.recent) >= self.rpm: return False
+            self.recent.append(now)
+            return True
+
+    def complete(self, body: dict) -> dict:
+        prompt = "".join(m.get("content", "") for m in body.get("messages", []))
+        ids = _CLAIM_ID_RE.findall(prompt)
+        scores = [int(score) for score in _RISK_SCORE_RE.findall(prompt)]
+        if ids:
+            content = {"verdicts": [{"id": claim_id, **fake_verdict(scores[i] if i < len(scores) else 50)} for i, claim_id in enumerate(ids)]}
+        else:
+            content = fake_verdict(scores[0] if scores else 50)
+        prompt_tokens = len(prompt) // 4
+        return {
+            "id": f"fake-{random.getrandbits(48):x}", "object": "chat.completion", "created": int(time.time()), "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": json.dumps(content)}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 60 * max(1, len(ids)), "total_tokens": prompt_tokens + 60 * max(1, len(ids))},
+        }
+
+
+def make_handler(llm: FakeLlm):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, payload: dict, headers: dict = None):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items(): self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._reply(200, dict(llm.counters))
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.endswith("/chat/completions"):
+                return self._reply(404, {"error": {"message": f"Unknown path {self.path}"}})
+            if not llm.admit():
+                llm.counters["rate_limited"] += 1
+                return self._reply(429, {"error": {"message": "Rate limit reached (fake)", "type": "rate_limit_exceeded"}},
+                                   {"Retry-After": str(llm.retry_after)})
+            time.sleep(max(0.0, llm.latency_ms + random.uniform(-llm.jitter_ms, llm.jitter_ms)) / 1000)
+            if random.random() < llm.fail_rate:
+                llm.counters["failed"] += 1
+                return self._reply(500, {"error": {"message": "Internal error (fake)"}})
+            llm.counters["completed"] += 1
+            self._reply(200, llm.complete(body))
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(port: int = 8099, latency_ms: float = 300, jitter_ms: float = 100, rpm: int = 0, fail_rate: float = 0.0, retry_after: float = 2.0) -> ThreadingHTTPServer:
+    """Starts the fake server on a daemon thread and returns it (call .shutdown() to stop; .llm holds its settings and counters)."""
+    llm = FakeLlm(latency_ms, jitter_ms, rpm, fail_rate, retry_after)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(llm))
+    server.llm = llm
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--rpm", type=int, default=0, help="Return 429 above this many requests per minute (0 = never)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of calls answered with HTTP 500")
+    parser.add_argument("--retry-after", type=float, default=2.0)
+    args = parser.parse_args()
+    server = serve(args.port, args.latency_ms, args.jitter_ms, args.rpm, args.fail_rate, args.retry_after)
+    print(f"Fake LLM listening on http://127.0.0.1:{args.port} (GET / for counters)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+Scale-test dataset for /verify-claim/: ABHA records, policies and synthetic bill PDFs.
+
+Writes into --out:
+
+    dummy_abha_database.json  ABDM responses in the `api_examples.requests` layout AbhaStore reads
+    policies.json             policy terms for every claimant (POLICY_DB_PATH)
+    ipfs/<cid>                one bill PDF per distinct document, named by its CIDv1; serve it as a fake gateway
+    claims.jsonl              {"ipfs_hash", "abha_identifier", "pages", "fraud": [...]} per claim
+
+Records come from the ABDM mock's generate_dummy_health_record, seeded per
+identifier so they don't repeat. Bills are written to match the patient's ABHA
+record (name, DOB, address, past diagnoses and medications). A share of claims
+gets a fraud signal instead: the same PDF resubmitted for another patient
+(duplicate), an edited copy of an earlier bill (near_duplicate), another
+person's name on the bill (name_mismatch), or a bill dated inside the policy's
+waiting period (waiting_period).
+
+    python benchmarks/generate_dataset.py --out dataset --records 1000000 --claims 20000 --pages 1 20
+    python -m http.server 8080 --directory dataset/ipfs &
+    ABHA_DB_PATH=dataset/dummy_abha_database.json POLICY_DB_PATH=dataset/policies.json \\
+        IPFS_GATEWAYS=http://127.0.0.1:8080/ uvicorn index:app --app-dir api
+"""
+import argparse
+import base64
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(_ROOT, "api"))
+sys.path.insert(0, os.path.join(_ROOT, "ABDM"))
+import fitz  # noqa: E402
+import index  # noqa: E402
+from records import generate_dummy_health_record  # noqa: E402
+
+FRAUD_KINDS = ("duplicate", "near_duplicate", "name_mismatch", "waiting_period")
+DEFAULT_RATES = {"duplicate": 0.02, "near_duplicate": 0.02, "name_mismatch": 0.03, "waiting_period": 0.03}
+_CHUNK = 1000 # Records per worker task
+
+_ICD_CODES = {
+    "Type 2 Diabetes Mellitus": "E11", "Essential Hypertension": "I10", "Coronary Artery Disease": "I25.1",
+    "Hypothyroidism": "E03.9", "Tuberculosis": "A15", "Dengue Fever": "A90", "Chronic Kidney Disease": "N18",
+    "COPD": "J44", "Bronchial Asthma": "J45", "Rheumatoid Arthritis": "M06", "Anemia": "D64.9",
+    "Fatty Liver Disease": "K76.0", "Vitamin D Deficiency": "E55.9", "Vitamin B12 Deficiency": "E53.8",
+}
+# (description, unit price range) for bill line items
+_SERVICES = [
+    ("Room Charges (General Ward)", 1500, 4000), ("Nursing Charges", 500, 1500), ("Consultation Fee", 500, 1500),
+    ("CBC Test", 250, 600), ("HbA1c Test", 400, 900), ("Lipid Profile", 500, 1200), ("X-Ray Chest PA View", 400, 1000),
+    ("ECG", 200, 600), ("Blood Pressure Monitoring", 100, 300), ("Physiotherapy Sessions", 500, 1200),
+    ("Pharmacy Charges", 200, 3000), ("Ultrasound Abdomen", 1000, 2500),
+]
+_OTHER_NAMES = ["Rohan Kapoor", "Sneha Nair", "Vikram Joshi", "Ananya Bose", "Karan Chopra", "Meera Pillai"]
+
+
+def identifier_for(i: int) -> str:
+    return f"ABHA{i:010d}"
+
+
+def record_for(identifier: str, seed: int) -> dict:
+    return generate_dummy_health_record(identifier, random.Random(f"{seed}:{identifier}"))
+
+
+def cid_for(data: bytes) -> str:
+    """CIDv1 (raw codec, sha2-256) in base32, as an IPFS node would name a single-block file."""
+    digest = bytes([0x01, 0x55, 0x12, 0x20]) + hashlib.sha256(data).digest()
+    return "b" + base64.b32encode(digest).decode("ascii").lower().rstrip("=")
+
+
+# --- ABHA database ---
+def _records_chunk(args) -> str:
+    start, stop, seed = args
+    items = []
+    for i in range(start, stop):
+        identifier = identifier_for(i)
+        items.append(json.dumps({
+            "name": f"Get Health Records - Patient {i + 1}",
+            "description": "Retrieve health records using ABHA",
+            "curl_command": f"curl -X GET 'http://localhost:5000/api/v1/health-records?identifier={identifier}'",
+            "example_response": {"status": "success", "message": "Health records retrieved successfully", "data": record_for(identifier, seed)},
+        }))
+    return ",\n".join(items)
+
+
+def write_abha_database(path: str, records: int, seed: int, pool) -> None:
+    """Streams the records out chunk by chunk, so millions of them never sit in memory at once."""
+    chunks = [(start, min(start + _CHUNK, records), seed) for start in range(0, records, _CHUNK)]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"api_examples": {"base_url": "http://localhost:5000", "requests": [\n')
+        for n, text in enumerate(pool.imap(_records_chunk, chunks)):
+            if n: f.write(",\n")
+            f.write(text)
+        f.write("\n]}}\n")
+
+
+# --- Bills ---
+def bill_pages(spec: dict, seed: int) -> list:
+    """Page texts for a claim spec, in the layout scan_bill_text reads."""
+    abha = index._simplify_abha_record(record_for(spec["abha_identifier"], seed))
+    rng = random.Random(f"{seed}:bill:{spec['bill_seed']}")
+    provider = rng.choice(list(index.MOCK_PROVIDER_RISK_DB))
+    reg_id, doctor = rng.choice(list(index.MOCK_MEDICAL_COUNCIL_DB.items()))
+    diagnosis = rng.choice([d["description"] for d in abha["past_diagnoses"] if d["description"] in _ICD_CODES] or ["Essential Hypertension"])
+    medicines = abha["medications"] or ["Telmisartan"]
+    patient_name = spec.get("bill_name") or abha["name"]
+
+    rows = []
+    for i in range(max(4, 40 * (spec["pages"] - 1))):
+        desc, low, high = rng.choice(_SERVICES)
+        qty = rng.randint(1, 3)
+        rows.append((desc, qty, round(rng.uniform(low, high), 0) * qty))
+    bill_no = rng.randint(10000, 99999)
+    if spec["kind"] == "near_duplicate":
+        # Same bill with a new number and a couple of inflated amounts
+        edit = random.Random(f"{seed}:edit:{spec['claim']}")
+        bill_no = edit.randint(10000, 99999)
+        for i in edit.sample(range(len(rows)), min(2, len(rows))):
+            desc, qty, amount = rows[i]
+            rows[i] = (desc, qty, amount + edit.randint(1, 20) * 100)
+
+    header = (
+        f"{provider}\nINVOICE\n"
+        f"Bill ID: INV-{bill_no}   Bill Date: {spec['bill_date']}\n"
+        f"Patient Name: {patient_name}   DOB: {abha['dob']}\nAddress: {abha['address']}\n"
+        f"Consulting Doctor: {doctor}   Reg. ID: {reg_id}\n"
+        f"Visit Type: OPD Consultation\nDiagnosis: {_ICD_CODES.get(diagnosis, 'I10')} - {diagnosis}\n"
+        + "=" * 60 + "\n" # Ends the diagnosis text before the line items
+    )
+    lines = [f"{i + 1}. {desc}  Qty {qty}  Amount {amount:.2f}" for i, (desc, qty, amount) in enumerate(rows)]
+    pages = [header + ("\n".join(lines) + "\n" if spec["pages"] == 1 else "")]
+    if spec["pages"] > 1:
+        pages += [f"Page {p + 2}\n" + "\n".join(lines[p * 40:(p + 1) * 40]) + "\n" for p in range(spec["pages"] - 1)]
+    footer = "".join(f"Medicine: {m} Tab  Qty 10\n" for m in medicines[:3])
+    pages[-1] += footer + f"Total Amount: {sum(r[2] for r in rows):,.2f}\nNet Payable: Rs. {sum(r[2] for r in rows):,.2f}\n"
+    return pages
+
+
+def render_pdf(pages: list) -> bytes:
+    doc = fitz.open()
+    for text in pages:
+        page = doc.new_page()
+        page.insert_text((40, 40), text, fontsize=8)
+    data = doc.tobytes(deflate=True)
+    doc.close()
+    return data
+
+
+def _render_claim(args):
+    spec, seed = args
+    if spec["kind"] == "duplicate":
+        return None # Reuses the source claim's PDF
+    return render_pdf(bill_pages(spec, seed))
+
+
+def plan_claims(claims: int, records: int, pages: tuple, rates: dict, seed: int) -> list:
+    """Claim specs in submission order. Duplicates and near-duplicates always point at an earlier clean claim."""
+    rng = random.Random(f"{seed}:claims")
+    today = datetime.now()
+    specs, originals = [], []
+    for n in range(claims):
+        roll, kind = rng.random(), "clean"
+        for k in FRAUD_KINDS:
+            if roll < rates[k]:
+                kind = k
+                break
+            roll -= rates[k]
+        if kind in ("duplicate", "near_duplicate") and not originals:
+            kind = "clean"
+        spec = {"claim": n, "kind": kind, "abha_identifier": identifier_for(rng.randrange(records)), "bill_seed": n,
+                "pages": rng.randint(*pages), "bill_date": (today - timedelta(days=rng.randint(1, 180))).strftime("%d-%m-%Y")}
+        if kind in ("duplicate", "near_duplicate"):
+            source = specs[rng.choice(originals)]
+            spec.update(source=source["claim"], pages=source["pages"],
+                        bill_seed=source["bill_seed"], bill_date=source["bill_date"])
+            if kind == "near_duplicate": spec["abha_identifier"] = source["abha_identifier"] # Same patient, edited bill
+        elif kind == "name_mismatch":
+            spec["bill_name"] = rng.choice(_OTHER_NAMES)
+        if kind == "clean": originals.append(n)
+        specs.append(spec)
+    return specs
+
+
+def policies_for(specs: list, seed: int) -> dict:
+    """One policy per claimant. Patients with a waiting_period claim get a policy that started just before it."""
+    rng = random.Random(f"{seed}:policies")
+    policies = {}
+    for spec in specs:
+        identifier = spec["abha_identifier"]
+        if identifier in policies and spec["kind"] != "waiting_period": continue
+        wait = rng.choice([30, 90])
+        bill_date = datetime.strptime(spec["bill_date"], "%d-%m-%Y")
+        days_before = rng.randint(1, wait - 1) if spec["kind"] == "waiting_period" else rng.randint(400, 2000)
+        policies[identifier] = {"policy_id": f"POL-{len(policies):07d}", "waiting_period_days": wait, "sum_insured": rng.choice([500000, 1000000, 2000000]),
+                                "start_date": (bill_date - timedelta(days=days_before)).strftime("%d-%m-%Y")}
+    return policies
+
+
+def fraud_labels(spec: dict, policy: dict) -> list:
+    labels = [] if spec["kind"] == "clean" else [spec["kind"]]
+    start = datetime.strptime(policy["start_date"], "%d-%m-%Y")
+    if "waiting_period" not in labels and (datetime.strptime(spec["bill_date"], "%d-%m-%Y") - start).days < policy["waiting_period_days"]:
+        labels.append("waiting_period") # Another claim moved this patient's policy start
+    return labels
+
+
+def write_claims(out: str, specs: list, policies: dict, seed: int, pool) -> int:
+    ipfs_dir = os.path.join(out, "ipfs")
+    os.makedirs(ipfs_dir, exist_ok=True)
+    cids, documents = {}, 0
+    with open(os.path.join(out, "claims.jsonl"), "w", encoding="utf-8") as manifest:
+        for spec, pdf in zip(specs, pool.imap(_render_claim, [(spec, seed) for spec in specs], chunksize=16)):
+            if pdf is None:
+                cid = cids[spec["source"]]
+            else:
+                cid = cid_for(pdf)
+                path = os.path.join(ipfs_dir, cid)
+                if not os.path.exists(path):
+                    with open(path, "wb") as f: f.write(pdf)
+                    documents += 1
+            cids[spec["claim"]] = cid
+            line = {"ipfs_hash": cid, "abha_identifier": spec["abha_identifier"], "pages": spec["pages"],
+                    "fraud": fraud_labels(spec, policies[spec["abha_identifier"]])}
+            manifest.write(json.dumps(line) + "\n")
+    return documents
+
+
+def generate(out: str, records: int, claims: int, pages: tuple = (1, 5), rates: dict = None, seed: int = 0, workers: int = 1) -> None:
+    """Writes a dataset into `out` (see the module docstring for the layout)."""
+    rates = rates or {kind: 0.0 for kind in FRAUD_KINDS}
+    os.makedirs(out, exist_ok=True)
+    with multiprocessing.Pool(workers) as pool:
+        start = time.perf_counter()
+        write_abha_database(os.path.join(out, "dummy_abha_database.json"), records, seed, pool)
+        print(f"{records} ABHA records in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        specs = plan_claims(claims, records, pages, rates, seed)
+        policies = policies_for(specs, seed)
+        with open(os.path.join(out, "policies.json"), "w", encoding="utf-8") as f: json.dump(policies, f)
+        documents = write_claims(out, specs, policies, seed, pool)
+        kinds = {kind: sum(spec["kind"] == kind for spec in specs) for kind in ("clean",) + FRAUD_KINDS}
+        print(f"{claims} claims ({documents} PDFs, {len(policies)} policies) in {time.perf_counter() - start:.1f}s: {kinds}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="dataset")
+    parser.add_argument("--records", type=int, default=100000, help="ABHA records to write")
+    parser.add_argument("--claims", type=int, default=1000, help="Claims (bill PDFs and manifest lines) to write")
+    parser.add_argument("--pages", type=int, nargs=2, default=[1, 5], metavar=("MIN", "MAX"), help="Pages per bill")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    for kind in FRAUD_KINDS:
+        parser.add_argument(f"--{kind.replace('_', '-')}-rate", type=float, default=DEFAULT_RATES[kind], help=f"Share of claims with a {kind} signal")
+    args = parser.parse_args()
+    if args.records < 1: parser.error("--records must be at least 1")
+    if not 1 <= args.pages[0] <= args.pages[1]: parser.error("--pages needs 1 <= MIN <= MAX")
+    rates = {kind: getattr(args, f"{kind}_rate") for kind in FRAUD_KINDS}
+    if sum(rates.values()) > 1: parser.error("Fraud rates add up to more than 1")
+
+    generate(args.out, args.records, args.claims, tuple(args.pages), rates, args.seed, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "api"), os.path.join(ROOT, "benchmarks")]
+
+# api/index.py reads its configuration at import time; keep every on-disk store out of the real temp dir
+_STATE_DIR = tempfile.mkdtemp(prefix="trustlynk-tests-")
+for name in ("DATA_DIR", "PDF_CACHE_DIR", "DUPLICATE_INDEX_PATH", "NEAR_DUP_PATH", "CLAIM_HISTORY_PATH", "PRICE_TABLE_PATH", "KB_CACHE_DIR", "OCR_CACHE_DIR"):
+    os.environ.setdefault(name, os.path.join(_STATE_DIR, name.lower()))
+os.environ.setdefault("GROQ_API_KEY", "")
@@ -0,0 +1,104 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import index
+
+
+def record_line(identifier: str) -> str:
+    return json.dumps({"status": "success", "data": {"patient_info": {"identifier": identifier, "name": f"Patient {identifier[-4:]}", "dob": "01-01-1990"}}}) + "\n"
+
+
+def error_line(identifier: str) -> str:
+    return json.dumps({"status": "error", "identifier": identifier, "error": "Invalid identifier format"}) + "\n"
+
+
+class StubAbdm:
+    """MockTransport handler for the bulk endpoint that records every batch it is sent."""
+
+    def __init__(self, respond=None, delay: float = 0.01):
+        self.batches, self.delay = [], delay
+        self.respond = respond or (lambda ids: httpx.Response(200, text="".join(error_line(i) if i.startswith("BAD") else record_line(i) for i in ids)))
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        assert request.url.path == index.AbdmClient.BULK_PATH
+        identifiers = json.loads(request.content)["identifiers"]
+        self.batches.append(identifiers)
+        await asyncio.sleep(self.delay)
+        return self.respond(identifiers)
+
+
+def make_client(stub: StubAbdm, **kwargs) -> index.AbdmClient:
+    http = httpx.AsyncClient(base_url="http://abdm", transport=httpx.MockTransport(stub))
+    return index.AbdmClient("http://abdm", client=http, **{"batch_window_ms": 20, **kwargs})
+
+
+def test_lookups_within_the_window_share_one_batch():
+    stub = StubAbdm()
+    client = make_client(stub)
+    async def scenario():
+        return await asyncio.gather(*(client.lookup(f"ABHA{i:010d}") for i in range(5)))
+    records = asyncio.run(scenario())
+    assert [r["abha_id"] for r in records] == [f"ABHA{i:010d}" for i in range(5)]
+    assert stub.batches == [[f"ABHA{i:010d}" for i in range(5)]]
+
+
+def test_full_batch_is_sent_without_waiting_for_the_window():
+    stub = StubAbdm()
+    client = make_client(stub, batch_max=2, batch_window_ms=10_000)
+    async def scenario():
+        return await asyncio.wait_for(asyncio.gather(*(client.lookup(f"ABHA{i:010d}") for i in range(4))), 2)
+    asyncio.run(scenario())
+    assert stub.batches == [["ABHA0000000000", "ABHA0000000001"], ["ABHA0000000002", "ABHA0000000003"]]
+
+
+def test_concurrent_lookups_of_one_identifier_are_sent_once():
+    stub = StubAbdm(delay=0.3)
+    client = make_client(stub)
+    async def scenario():
+        first = asyncio.ensure_future(client.lookup("ABHA0000000001"))
+        await asyncio.sleep(0.1) # Batch already sent, response not back yet
+        second = await client.lookup("ABHA0000000001")
+        return await first, second
+    first, second = asyncio.run(scenario())
+    assert first == second and first["abha_id"] == "ABHA0000000001"
+    assert stub.batches == [["ABHA0000000001"]]
+    assert client.stats["shared"] == 1
+
+
+def test_unknown_and_unanswered_identifiers_resolve_to_none():
+    stub = StubAbdm(lambda ids: httpx.Response(200, text=record_line(ids[0]) + error_line(ids[1])))
+    client = make_client(stub)
+    async def scenario():
+        return await asyncio.gather(client.lookup("ABHA0000000001"), client.lookup("BAD1"), client.lookup("ABHA0000000003"))
+    found, invalid, missing = asyncio.run(scenario())
+    assert found["abha_id"] == "ABHA0000000001"
+    assert invalid is None and missing is None
+
+
+@pytest.mark.parametrize("respond, status", [
+    (lambda ids: httpx.Response(500), 503),
+    (lambda ids: httpx.Response(200, text='{"data": {"patient_info": {"ident'), 502),
+    (lambda ids: httpx.Response(200, text="[1, 2]\n"), 502),
+])
+def test_batch_failure_fans_out_to_every_caller(monkeypatch, respond, status):
+    stub = StubAbdm(respond)
+    monkeypatch.setattr(index, "abdm_client", make_client(stub))
+    async def scenario():
+        return await asyncio.gather(*(index.lookup_abha_record(f"ABHA{i:010d}") for i in range(3)), return_exceptions=True)
+    results = asyncio.run(scenario())
+    assert len(stub.batches) == 1
+    assert all(isinstance(r, HTTPException) and r.status_code == status for r in results)
+    assert index.abdm_client.stats["failed_batches"] == 1
+
+
+def test_timeout_maps_to_504(monkeypatch):
+    def respond(ids):
+        raise httpx.ReadTimeout("ABDM timed out")
+    monkeypatch.setattr(index, "abdm_client", make_client(StubAbdm(respond)))
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(index.lookup_abha_record("ABHA0000000001"))
+    assert excinfo.value.status_code == 504
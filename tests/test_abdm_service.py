@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("flask")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ABDM"))
+from app import app  # noqa: E402
+
+BULK = "/api/v1/health-records/bulk"
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def test_bulk_streams_one_line_per_identifier_in_order(client):
+    response = client.post(BULK, json={"identifiers": ["ABHA0000000001", "nope", "123456789012"]})
+    assert response.status_code == 200 and response.mimetype == "application/x-ndjson"
+    lines = [line for line in response.get_data(as_text=True).splitlines() if line]
+    assert len(lines) == 3
+    assert '"status": "error"' in lines[1] and '"identifier": "nope"' in lines[1]
+    assert lines[0].encode() + b"\n" == client.get("/api/v1/health-records", query_string={"identifier": "ABHA0000000001"}).data
+
+
+@pytest.mark.parametrize("body", [["ABHA0000000001"], "ABHA0000000001", None, {}, {"identifiers": []}])
+def test_bulk_rejects_bodies_without_an_identifier_list(client, body):
+    response = client.post(BULK, json=body)
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Missing identifiers"
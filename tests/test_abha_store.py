@@ -0,0 +1,56 @@
+import json
+import os
+
+import pytest
+
+import index
+
+
+def write_db(path, names):
+    """Dummy ABHA database with one record per (identifier, name), in the given order."""
+    requests = [{"example_response": {"data": {"patient_info": {"identifier": identifier, "name": name, "dob": "01-01-1990"}}}}
+                for identifier, name in names]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"api_examples": {"requests": requests}}, f)
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 1_000_000)) # Distinct mtime even on coarse clocks
+
+
+def ids(n):
+    return [f"ABHA{i:010d}" for i in range(n)]
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "db.json")
+    write_db(path, [(i, f"first-{i}") for i in ids(50)])
+    return path
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_lookup(tmp_path, db, indexed):
+    store = index.AbhaStore(db, str(tmp_path / "abha.idx") if indexed else None)
+    assert store.get("ABHA0000000007")["name"] == "first-ABHA0000000007"
+    assert store.get("ABHA9999999999") is None
+    assert len(store) == 50
+
+
+def test_index_is_reused_by_a_second_store(tmp_path, db):
+    index.AbhaStore(db, str(tmp_path / "abha.idx")).ensure_loaded()
+    second = index.AbhaStore(db, str(tmp_path / "abha.idx"))
+    second._build_index = None # Must not be needed
+    assert second.get("ABHA0000000003")["name"] == "first-ABHA0000000003"
+
+
+def test_rebuild_by_another_worker_never_returns_another_patient(tmp_path, db):
+    index_path = str(tmp_path / "abha.idx")
+    first = index.AbhaStore(db, index_path, reload_check_seconds=3600)
+    assert first.get("ABHA0000000000")["name"] == "first-ABHA0000000000"
+
+    write_db(db, [(i, f"second-{i}") for i in reversed(ids(100))]) # Every offset moves
+    other_worker = index.AbhaStore(db, index_path, reload_check_seconds=3600)
+    assert other_worker.get("ABHA0000000099")["name"] == "second-ABHA0000000099"
+
+    # `first` hasn't reached its reload check, but must not read the new file at its old offsets
+    for identifier in ids(50):
+        assert first.get(identifier)["name"] == f"second-{identifier}"
+    assert [name for name in os.listdir(tmp_path) if name.startswith("abha.idx")] == [os.path.basename(other_worker._index[0])]
@@ -0,0 +1,92 @@
+import asyncio
+import json
+from collections import Counter
+
+import httpx
+from fastapi import HTTPException
+
+import index
+
+
+class StubPipeline:
+    """Stands in for the fetch, ABHA lookup and scoring stages, counting calls and the PDFs held at each scoring."""
+
+    def __init__(self, monkeypatch):
+        self.fetches, self.lookups, self.scored, self.held = Counter(), Counter(), [], []
+        self.verifier = None
+        monkeypatch.setattr(index, "fetch_pdf_from_ipfs", self.fetch)
+        monkeypatch.setattr(index, "_lookup_abha", self.lookup)
+        monkeypatch.setattr(index, "_score_claim", self.score)
+
+    async def fetch(self, cid):
+        self.fetches[cid] += 1
+        await asyncio.sleep(0.01)
+        if cid == "QmMissing": raise HTTPException(status_code=503, detail="Could not fetch PDF from IPFS")
+        return f"pdf:{cid}".encode()
+
+    async def lookup(self, identifier):
+        self.lookups[identifier] += 1
+        return {"abha_id": identifier}
+
+    async def score(self, pdf_content, abha_dict, wait_for_slot=False, defer_ocr=False, claim_ref=None):
+        self.scored.append((pdf_content.decode(), abha_dict["abha_id"], claim_ref))
+        if self.verifier is not None: self.held.append(sorted(self.verifier.pdf_tasks))
+        return {"recommendation": "APPROVE", "pdf": pdf_content.decode()}
+
+
+def claim(cid, identifier, **extra):
+    return {"ipfs_hash": cid, "abha_identifier": identifier, **extra}
+
+
+def post_batch(content, content_type):
+    async def scenario():
+        transport = httpx.ASGITransport(app=index.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://api") as client:
+            return await client.post("/verify-claims/batch", content=content, headers={"content-type": content_type})
+    response = asyncio.run(scenario())
+    assert response.status_code == 200 and response.headers["content-type"].startswith("application/x-ndjson")
+    return sorted((json.loads(line) for line in response.text.splitlines()), key=lambda line: line["index"])
+
+
+def test_shared_cids_and_identifiers_are_fetched_once(monkeypatch):
+    stub = StubPipeline(monkeypatch)
+    claims = [claim("QmA", "ABHA1"), claim("QmA", "ABHA2"), claim("QmB", "ABHA1"), claim("QmA", "ABHA1"), claim("QmA", "ABHA1", claim_id="c-9")]
+    lines = post_batch(json.dumps({"claims": claims}), "application/json")
+    assert stub.fetches == {"QmA": 1, "QmB": 1}
+    assert stub.lookups == {"ABHA1": 1, "ABHA2": 1}
+    # (QmA, ABHA1) appears twice without a claim id: verified once, reported for both
+    assert Counter(stub.scored) == {("pdf:QmA", "ABHA1", None): 1, ("pdf:QmA", "ABHA1", "c-9"): 1, ("pdf:QmA", "ABHA2", None): 1, ("pdf:QmB", "ABHA1", None): 1}
+    assert [line["index"] for line in lines] == [0, 1, 2, 3, 4]
+    assert all(line["status"] == 200 for line in lines)
+    assert lines[0]["result"] == lines[3]["result"]
+    assert [(line["ipfs_hash"], line["abha_identifier"]) for line in lines] == [(c["ipfs_hash"], c["abha_identifier"]) for c in claims]
+
+
+def test_bad_ndjson_entries_get_their_own_error_lines(monkeypatch):
+    stub = StubPipeline(monkeypatch)
+    body = "\n".join([json.dumps(claim("QmA", "ABHA1")), "{not json", json.dumps({"ipfs_hash": "QmA"}), "", json.dumps(claim("QmMissing", "ABHA1"))])
+    lines = post_batch(body, "application/x-ndjson")
+    assert [(line["index"], line["status"]) for line in lines] == [(0, 200), (1, 400), (2, 422), (3, 503)]
+    assert "Line 2" in lines[1]["error"]
+    assert "abha_identifier" in lines[2]["error"]
+    assert stub.fetches == {"QmA": 1, "QmMissing": 1}
+
+
+def test_non_utf8_ndjson_is_rejected(monkeypatch):
+    StubPipeline(monkeypatch)
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=index.app), base_url="http://api") as client:
+            return await client.post("/verify-claims/batch", content=b"\xff\xfe", headers={"content-type": "application/x-ndjson"})
+    assert asyncio.run(scenario()).status_code == 400
+
+
+def test_fetched_pdfs_are_released_after_their_last_claim(monkeypatch):
+    stub = StubPipeline(monkeypatch)
+    claims = [index.ClaimRequest(**claim("QmA", "ABHA1")), index.ClaimRequest(**claim("QmB", "ABHA2")), index.ClaimRequest(**claim("QmA", "ABHA3"))]
+    stub.verifier = verifier = index._BatchVerifier(claims, max_concurrency=1)
+    async def scenario():
+        return [line async for line in verifier.stream()]
+    assert len(asyncio.run(scenario())) == 3
+    # QmA is kept for its second claim; QmB is dropped as soon as its only claim is scored
+    assert stub.held == [["QmA"], ["QmA", "QmB"], ["QmA"]]
+    assert verifier.pdf_tasks == {} and verifier.cid_users == {"QmA": 0, "QmB": 0}
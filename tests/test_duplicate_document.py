@@ -0,0 +1,59 @@
+import asyncio
+import hashlib
+
+import fitz
+import pytest
+
+import index
+
+PATIENT = {"abha_id": "ABHA0000000001", "name": "Asha Rao", "dob": "01-01-1980", "address": "Mumbai"}
+OTHER_PATIENT = {**PATIENT, "abha_id": "ABHA0000000002"}
+
+
+@pytest.fixture
+def duplicate_index(tmp_path, monkeypatch):
+    store = index.DuplicateHashIndex(str(tmp_path / "dups.db"), capacity=1000)
+    monkeypatch.setattr(index, "get_duplicate_index", lambda: store)
+    return store
+
+
+@pytest.fixture(scope="module")
+def bill():
+    with fitz.open() as doc:
+        doc.new_page().insert_text((72, 72), "CITY CARE HOSPITAL\nPatient Name: Asha Rao\nBill Date: 01-03-2024\nDiagnosis: Hypertension\nTotal Amount: 1200.00")
+        return doc.tobytes()
+
+
+def duplicate_flags(bill, abha_dict, claim_ref=None):
+    red_flags = index._run_rule_engine(bill, abha_dict, claim_ref=claim_ref)[2]
+    return [flag for flag in red_flags if "(Duplicate)" in flag]
+
+
+def record(bill, abha_dict, claim_ref):
+    extracted = {"file_hash": hashlib.sha256(bill).hexdigest()}
+    asyncio.run(index._record_verified_claim(abha_dict, extracted, {}, "REJECT", claim_ref))
+
+
+def test_first_submission_is_not_a_duplicate(duplicate_index, bill):
+    assert duplicate_flags(bill, PATIENT, "claim-1") == []
+
+
+def test_claim_reference_is_recorded(duplicate_index, bill):
+    record(bill, PATIENT, "claim-1")
+    assert duplicate_index.lookup(hashlib.sha256(bill).hexdigest())[:2] == (PATIENT["abha_id"], "claim-1")
+
+
+def test_reverifying_the_same_claim_is_exempt(duplicate_index, bill):
+    record(bill, PATIENT, "claim-1")
+    assert duplicate_flags(bill, PATIENT, "claim-1") == []
+
+
+@pytest.mark.parametrize("abha_dict, claim_ref", [
+    (PATIENT, "claim-2"), # Same patient, new claim on the same bill
+    (PATIENT, None), # Same patient, no claim id to match
+    (OTHER_PATIENT, "claim-1"), # Another patient
+])
+def test_another_claim_on_the_same_document_is_flagged(duplicate_index, bill, abha_dict, claim_ref):
+    record(bill, PATIENT, "claim-1")
+    [flag] = duplicate_flags(bill, abha_dict, claim_ref)
+    assert "Claim claim-1" in flag
@@ -0,0 +1,108 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import index
+
+CID = "bafkreidummycid"
+
+
+def fetcher(routes, **kwargs):
+    """IpfsFetcher over a MockTransport; `routes` maps gateway host -> async handler."""
+    async def handler(request: httpx.Request) -> httpx.Response:
+        return await routes[request.url.host](request)
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return index.IpfsFetcher([f"https://{host}/ipfs" for host in routes], client=client, **kwargs)
+
+
+def pdf(body: bytes, delay: float = 0.0):
+    async def handler(request):
+        await asyncio.sleep(delay)
+        return httpx.Response(200, content=body, headers={"Content-Type": "application/pdf"})
+    return handler
+
+
+def status(code: int):
+    async def handler(request):
+        return httpx.Response(code)
+    return handler
+
+
+def timeout():
+    async def handler(request):
+        raise httpx.ReadTimeout("gateway timed out", request=request)
+    return handler
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_race_returns_first_good_response_and_cancels_losers():
+    f = fetcher({"slow": pdf(b"slow", delay=0.5), "fast": pdf(b"fast", delay=0.01)}, mode="race")
+    assert run(f.fetch(CID)) == b"fast"
+    stats = f.gateway_stats()
+    assert stats["https://fast/ipfs"]["successes"] == 1
+    assert stats["https://slow/ipfs"]["cancelled"] == 1
+
+
+def test_race_skips_failing_gateway():
+    f = fetcher({"broken": status(500), "ok": pdf(b"%PDF", delay=0.05)}, mode="race")
+    assert run(f.fetch(CID)) == b"%PDF"
+    assert f.gateway_stats()["https://broken/ipfs"]["failures"] == 1
+
+
+def test_race_without_cancel_lets_losers_finish_in_background():
+    async def scenario(f):
+        body = await f.fetch(CID)
+        await asyncio.gather(*f._background)
+        return body
+    f = fetcher({"slow": pdf(b"slow", delay=0.1), "fast": pdf(b"fast")}, mode="race", cancel_losers=False)
+    assert run(scenario(f)) == b"fast"
+    assert f.gateway_stats()["https://slow/ipfs"]["successes"] == 1
+
+
+def test_sequential_falls_through_and_then_prefers_the_working_gateway():
+    calls = []
+    def counted(host, handler):
+        async def wrapper(request):
+            calls.append(host)
+            return await handler(request)
+        return wrapper
+    f = fetcher({"first": counted("first", status(502)), "second": counted("second", pdf(b"%PDF"))}, mode="sequential")
+    assert run(f.fetch(CID)) == b"%PDF"
+    assert calls == ["first", "second"]
+    assert run(f.fetch(CID)) == b"%PDF"
+    assert calls[2:] == ["second"] # The failure's penalty pushed "first" to the back
+
+
+@pytest.mark.parametrize("mode", ["race", "sequential"])
+def test_all_gateways_timing_out_maps_to_504(mode):
+    f = fetcher({"a": timeout(), "b": timeout()}, mode=mode)
+    with pytest.raises(HTTPException) as excinfo:
+        run(f.fetch(CID))
+    assert excinfo.value.status_code == 504
+
+
+@pytest.mark.parametrize("mode", ["race", "sequential"])
+def test_mixed_failures_map_to_503(mode):
+    f = fetcher({"a": timeout(), "b": status(500)}, mode=mode)
+    with pytest.raises(HTTPException) as excinfo:
+        run(f.fetch(CID))
+    assert excinfo.value.status_code == 503
+
+
+def test_empty_response_is_a_400():
+    f = fetcher({"a": pdf(b"")}, mode="sequential")
+    with pytest.raises(HTTPException) as excinfo:
+        run(f.fetch(CID))
+    assert excinfo.value.status_code == 400
+
+
+def test_rejects_unknown_mode_and_empty_gateway_list():
+    with pytest.raises(ValueError):
+        index.IpfsFetcher(["https://a/ipfs"], mode="parallel")
+    with pytest.raises(ValueError):
+        index.IpfsFetcher([])
@@ -0,0 +1,56 @@
+import json
+import os
+import pickle
+
+import pytest
+
+import index
+
+
+@pytest.fixture
+def kb_cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(index, "KB_CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def cache_file(kb_cache_dir):
+    [name] = [n for n in os.listdir(kb_cache_dir) if n.startswith("kb-")]
+    return kb_cache_dir / name
+
+
+def test_cache_round_trip_matches_a_fresh_compile(kb_cache_dir):
+    compiled, info = index.compile_knowledge_base()
+    assert not info["from_cache"] and info["cache_path"].endswith(".json")
+    cached, info = index.compile_knowledge_base()
+    assert info["from_cache"]
+    assert cached.stats() == compiled.stats()
+    text = "Type 2 diabetes mellitus with essential hypertension"
+    assert cached.find_terms(text) == compiled.find_terms(text)
+    assert cached.unsupported_drugs(["Metformin 500", "Salbutamol"], [text]) == compiled.unsupported_drugs(["Metformin 500", "Salbutamol"], [text])
+
+
+def test_planted_pickle_is_never_loaded(kb_cache_dir, monkeypatch):
+    index.compile_knowledge_base()
+    path = cache_file(kb_cache_dir)
+    ran = []
+    monkeypatch.setattr(index, "_planted", ran.append, raising=False)
+    class Payload:
+        def __reduce__(self): return (eval, ("__import__('index')._planted('ran')",))
+    path.write_bytes(pickle.dumps(Payload()))
+    kb, info = index.compile_knowledge_base()
+    assert not info["from_cache"] and not ran
+    assert json.loads(path.read_text(encoding="utf-8"))["terms"] == kb.terms # Damaged cache replaced
+
+
+@pytest.mark.parametrize("damage", [
+    lambda data: data.pop("goto"),
+    lambda data: data["fail"].append(0),
+    lambda data: data["goto"][0].update(x=10**6),
+    lambda data: data["out"].__setitem__(-1, [10**6]),
+])
+def test_malformed_cache_is_rebuilt(kb_cache_dir, damage):
+    index.compile_knowledge_base()
+    path = cache_file(kb_cache_dir)
+    data = json.loads(path.read_text(encoding="utf-8")); damage(data)
+    path.write_text(json.dumps(data), encoding="utf-8")
+    assert not index.compile_knowledge_base()[1]["from_cache"]
@@ -0,0 +1,91 @@
+import asyncio
+import time
+import uuid
+
+import pytest
+from groq import Groq
+
+import index
+from fake_llm_server import serve
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """Fake Groq server on a free port, with index.client pointed at it and a fresh verdict cache."""
+    servers = []
+    def start(**options):
+        server = serve(port=0, **{"latency_ms": 0, "jitter_ms": 0, **options})
+        servers.append(server)
+        monkeypatch.setattr(index, "client", Groq(api_key="fake", base_url=f"http://127.0.0.1:{server.server_address[1]}", max_retries=0))
+        monkeypatch.setattr(index, "llm_verdict_cache", index.LlmVerdictCache(60, 100))
+        return server
+    yield start
+    for server in servers: server.shutdown()
+
+
+def claim(pre_risk_score: int = 0) -> dict:
+    return {"pre_risk_score": pre_risk_score, "claim_ref": uuid.uuid4().hex} # Unique, so nothing is served from cache
+
+
+def scheduler(**options) -> index.LlmScheduler:
+    return index.LlmScheduler(**{"rpm": 0, "tpm": 0, "batch_window_ms": 5, "deadline_seconds": 10, **options})
+
+
+def test_scores_through_the_fake_llm(fake_llm):
+    server = fake_llm()
+    sched = scheduler()
+    score, reasoning, recommendation = asyncio.run(sched.score(0, [], claim(0)))
+    assert (score, recommendation) == (10, "APPROVE")
+    assert reasoning.startswith("Fake")
+    assert server.llm.counters["completed"] == 1
+
+
+def test_concurrent_claims_share_one_packed_call(fake_llm):
+    server = fake_llm(latency_ms=20)
+    sched = scheduler(batch_max=4, batch_window_ms=50)
+    async def scenario():
+        return await asyncio.gather(sched.score(0, [], claim(0)), sched.score(50, [], claim(50)), sched.score(150, [], claim(150)))
+    results = asyncio.run(scenario())
+    assert [r[2] for r in results] == ["APPROVE", "PENDING REVIEW", "REJECT"]
+    assert sched.counters["packed_calls"] == 1
+    assert server.llm.counters["completed"] == 1
+
+
+def test_429_pauses_and_requeues_until_the_llm_answers(fake_llm):
+    server = fake_llm(rpm=1, retry_after=0.3)
+    server.llm.admit() # Use up the fake's only slot this minute
+    sched = scheduler()
+    async def scenario():
+        task = asyncio.ensure_future(sched.score(0, [], claim(0)))
+        while not sched.counters["rate_limited"]: await asyncio.sleep(0.01)
+        server.llm.rpm = 0 # Limit lifted; the requeued claim must go through after Retry-After
+        return await task
+    start = time.monotonic()
+    score, reasoning, recommendation = asyncio.run(scenario())
+    assert time.monotonic() - start >= 0.3
+    assert reasoning.startswith("Fake") # The LLM's verdict, not the rule-only fallback
+    assert sched.counters["rate_limited"] == 1
+    assert server.llm.counters["rate_limited"] == 1 and server.llm.counters["completed"] == 1
+
+
+def test_deadline_falls_back_to_rule_only_verdict(fake_llm):
+    fake_llm(latency_ms=1000)
+    sched = scheduler(deadline_seconds=0.2)
+    async def scenario():
+        start = time.monotonic()
+        verdict = await sched.score(40, ["Warn: something"], claim(40))
+        return verdict, time.monotonic() - start
+    (score, reasoning, recommendation), elapsed = asyncio.run(scenario()) # asyncio.run itself still waits for the abandoned call's thread
+    assert elapsed < 0.9
+    assert (score, recommendation) == (40, "PENDING REVIEW")
+    assert "deadline" in reasoning
+    assert sched.counters["deadline_fallbacks"] == 1
+
+
+def test_upstream_error_falls_back_to_rule_only_verdict(fake_llm):
+    fake_llm(fail_rate=1.0)
+    sched = scheduler()
+    score, reasoning, recommendation = asyncio.run(sched.score(120, ["Identity Fail"], claim(120)))
+    assert (score, recommendation) == (100, "REJECT")
+    assert reasoning.startswith("AI Error")
+    assert sched.counters["errors"] == 1
@@ -0,0 +1,80 @@
+import asyncio
+import hashlib
+import json
+import os
+
+import pytest
+
+import index
+
+PDF = b"%PDF-1.7 scanned bill"
+FILE_HASH = hashlib.sha256(PDF).hexdigest()
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    service = index.OcrService("thread", cache_dir=str(tmp_path))
+    monkeypatch.setattr(index, "ocr_service", service)
+    monkeypatch.setattr(index, "OCR_ENABLED", True)
+    return service
+
+
+def write_entry(service, pages):
+    path = service._path(service._key(FILE_HASH))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(pages, f)
+
+
+class StubExecutor:
+    """Stands in for rule_engine_executor: a page counts as read if it has a text layer or OCR text."""
+
+    def __init__(self, text_pages=(), page_count=2):
+        self.text_pages, self.page_count, self.calls = set(text_pages), page_count, []
+
+    async def run(self, pdf_content, abha_dict, wait=False, ocr_pages=None, claim_ref=None):
+        self.calls.append(dict(ocr_pages or {}))
+        missing = [n for n in range(self.page_count) if n not in self.text_pages and n not in (ocr_pages or {})]
+        if len(missing) == self.page_count: raise index.ImageOnlyPdfError("No text", missing)
+        return 0, [], [], {}, {"pages_without_text": missing}, {}
+
+
+def test_disk_entry_is_read_off_the_event_loop(service, monkeypatch):
+    write_entry(service, {"0": "page zero", "1": "page one"})
+    threads = []
+    load = service._load
+    monkeypatch.setattr(service, "_load", lambda key: threads.append(index.threading.current_thread()) or load(key))
+    async def scenario():
+        return await service.cached_pages(FILE_HASH, [0, 1]), index.threading.current_thread()
+    pages, loop_thread = asyncio.run(scenario())
+    assert pages == {0: "page zero", 1: "page one"}
+    assert len(threads) == 1 and threads[0] is not loop_thread
+    assert asyncio.run(service.cached_pages(FILE_HASH, [0, 1])) == pages # Now from memory
+    assert len(threads) == 1
+
+
+def test_partial_entry_is_not_a_hit(service):
+    write_entry(service, {"0": "page zero"})
+    assert asyncio.run(service.cached_pages(FILE_HASH, [0, 1])) is None
+    assert asyncio.run(service.cached_pages(FILE_HASH)) == {0: "page zero"}
+
+
+def test_cached_document_runs_the_rule_engine_once(service, monkeypatch):
+    write_entry(service, {"0": "page zero", "1": "page one"})
+    executor = StubExecutor()
+    monkeypatch.setattr(index, "rule_engine_executor", executor)
+    verdict = asyncio.run(index._run_rules_with_ocr(PDF, {}))
+    assert verdict[4]["pages_without_text"] == []
+    assert executor.calls == [{0: "page zero", 1: "page one"}]
+
+
+def test_uncached_pages_are_still_ocrd(service, monkeypatch):
+    write_entry(service, {"0": "page zero"})
+    executor = StubExecutor(page_count=3)
+    monkeypatch.setattr(index, "rule_engine_executor", executor)
+    async def fake_ocr_batch(pdf_content, pages):
+        return {n: f"ocr {n}" for n in pages}
+    monkeypatch.setattr(service, "_ocr_batch", fake_ocr_batch)
+    verdict = asyncio.run(index._run_rules_with_ocr(PDF, {}))
+    assert verdict[4]["pages_without_text"] == []
+    assert executor.calls == [{0: "page zero"}, {0: "page zero", 1: "ocr 1", 2: "ocr 2"}]
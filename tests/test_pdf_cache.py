@@ -0,0 +1,50 @@
+import os
+
+import index
+from generate_dataset import cid_for
+
+UNVERIFIABLE_CID = "QmT78zSuBmuS4z925WZfrqQ1qHaJ56DQaTfyMUF7F8ff5o" # dag-pb; any body over one chunk can't be checked
+
+
+def make_cache(tmp_path, require_verified=False):
+    return index.PdfCache(str(tmp_path), max_bytes=10 * 1024 * 1024, memory_max_bytes=1024 * 1024, require_verified=require_verified)
+
+
+def test_verified_content_reaches_disk_and_survives_restart(tmp_path):
+    data = b"%PDF-1.4 verified"
+    cid = cid_for(data)
+    assert make_cache(tmp_path).put(cid, data)
+    assert make_cache(tmp_path).get(cid) == data
+
+
+def test_mismatched_content_is_never_cached(tmp_path):
+    cache = make_cache(tmp_path)
+    assert not cache.put(cid_for(b"the real bill"), b"something else")
+    assert cache.stats()["verify_failures"] == 1
+
+
+def test_unverifiable_content_stays_in_memory_only(tmp_path):
+    cache = make_cache(tmp_path)
+    data = b"x" * (index._UNIXFS_CHUNK_SIZE + 1)
+    assert cache.put(UNVERIFIABLE_CID, data)
+    assert cache.get(UNVERIFIABLE_CID) == data
+    assert not os.path.exists(cache._path(UNVERIFIABLE_CID))
+    assert make_cache(tmp_path).get(UNVERIFIABLE_CID) is None
+
+
+def test_require_verified_skips_unverifiable_content(tmp_path):
+    cache = make_cache(tmp_path, require_verified=True)
+    assert not cache.put(UNVERIFIABLE_CID, b"x" * (index._UNIXFS_CHUNK_SIZE + 1))
+    assert cache.get(UNVERIFIABLE_CID) is None
+
+
+def test_disk_entry_that_no_longer_verifies_is_dropped(tmp_path):
+    data = b"%PDF-1.4 original"
+    cid = cid_for(data)
+    make_cache(tmp_path).put(cid, data)
+    with open(make_cache(tmp_path)._path(cid), "wb") as f:
+        f.write(b"tampered")
+    cache = make_cache(tmp_path)
+    assert cache.get(cid) is None
+    assert not os.path.exists(cache._path(cid))
+    assert cache.stats()["disk_entries"] == 0
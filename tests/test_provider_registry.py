@@ -0,0 +1,89 @@
+import json
+import time
+
+import pytest
+
+import index
+
+
+def write_registry(path, providers, doctors):
+    path.write_text(json.dumps({"providers": providers, "doctors": doctors}), encoding="utf-8")
+
+
+@pytest.fixture
+def registry_file(tmp_path):
+    path = tmp_path / "registry.json"
+    write_registry(path,
+                   [{"name": "Mumbai Arthritis & Heart Clinic", "risk_score": 5}, {"name": "Pune Respiratory Clinic", "risk_score": 2}],
+                   [{"reg_id": "MH-MC-11223", "name": "Dr. Alok Deshpande", "status": "ACTIVE"}])
+    return path
+
+
+def wait_for_refreshes(registry, count, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while registry.counters["refreshes"] + registry.counters["refresh_failures"] < count:
+        assert time.monotonic() < deadline, "background refresh did not finish"
+        time.sleep(0.01)
+
+
+def test_exact_match_after_normalization(registry_file):
+    registry = index.ProviderRegistry(str(registry_file))
+    name, record, similarity = registry.find_provider("mumbai arthritis and heart clinic.")
+    assert (name, record["risk_score"], similarity) == ("Mumbai Arthritis & Heart Clinic", 5, 1.0)
+    assert registry.counters["provider_exact"] == 1
+
+
+def test_fuzzy_match_tolerates_ocr_noise_and_is_memoized(registry_file):
+    registry = index.ProviderRegistry(str(registry_file), fuzzy_threshold=0.7)
+    name, record, similarity = registry.find_provider("PUNE RESP1RATORY CLlNIC")
+    assert name == "Pune Respiratory Clinic" and 0.7 <= similarity < 1.0
+    assert registry.find_provider("PUNE RESP1RATORY CLlNIC")[0] == name
+    assert registry.counters["provider_fuzzy"] == 1 and registry.counters["memo_hits"] == 1
+
+
+def test_unknown_provider_misses(registry_file):
+    registry = index.ProviderRegistry(str(registry_file))
+    assert registry.find_provider("Totally Unrelated Diagnostics Lab")[:2] == (None, None)
+    assert registry.counters["provider_miss"] == 1
+
+
+def test_doctor_lookup_folds_separators_and_look_alikes(registry_file):
+    registry = index.ProviderRegistry(str(registry_file))
+    reg_id, record = registry.find_doctor("mh/mc/1l223")
+    assert (reg_id, record["name"]) == ("MH-MC-11223", "Dr. Alok Deshpande")
+    assert registry.find_doctor("MH-MC-99999") == (None, None)
+
+
+def test_dict_form_file(tmp_path):
+    path = tmp_path / "registry.json"
+    write_registry(path, {"City Care Hospital": {"risk_score": 9}}, {"KA-MC-1": {"name": "Dr. Rao", "status": "SUSPENDED"}})
+    registry = index.ProviderRegistry(str(path))
+    assert registry.find_provider("CITY CARE HOSPITAL")[1] == {"risk_score": 9}
+    assert registry.find_doctor("ka mc 1")[1]["status"] == "SUSPENDED"
+
+
+def test_missing_file_fails_on_first_use(tmp_path):
+    registry = index.ProviderRegistry(str(tmp_path / "missing.json"))
+    with pytest.raises(OSError):
+        registry.find_provider("Any Clinic")
+    assert registry.counters["refresh_failures"] == 1
+
+
+def test_stale_snapshot_reloads_in_background(registry_file):
+    registry = index.ProviderRegistry(str(registry_file), ttl=0.0)
+    assert registry.find_provider("Pune Respiratory Clinic")[1]["risk_score"] == 2
+    write_registry(registry_file, [{"name": "Pune Respiratory Clinic", "risk_score": 8}], [])
+    # The lookup that notices the stale snapshot is still answered from it
+    assert registry.find_provider("Pune Respiratory Clinic")[1]["risk_score"] == 2
+    wait_for_refreshes(registry, 2)
+    assert registry.find_provider("Pune Respiratory Clinic")[1]["risk_score"] == 8
+
+
+def test_failed_reload_keeps_serving_the_old_snapshot(registry_file):
+    registry = index.ProviderRegistry(str(registry_file), ttl=0.0)
+    registry.snapshot()
+    registry_file.write_text("{not json", encoding="utf-8")
+    registry.snapshot()
+    wait_for_refreshes(registry, 2)
+    assert registry.counters["refresh_failures"] == 1 and registry.last_error
+    assert registry.find_provider("Pune Respiratory Clinic")[1]["risk_score"] == 2
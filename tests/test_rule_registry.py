@@ -0,0 +1,107 @@
+import json
+import os
+import threading
+
+import pytest
+
+import index
+
+
+def make_registry(config_path=None, **depends_on):
+    """Registry of no-op rules a..e; keyword arguments give a rule's dependencies, e.g. c=("b",)."""
+    registry = index.RuleRegistry(str(config_path) if config_path else None, reload_check_seconds=0)
+    for name in "abcde":
+        registry.register(index.RuleSpec(name, None, lambda engine, result: None, (), {"hit": 10}, tuple(depends_on.get(name, ()))))
+    return registry
+
+
+def write_config(path, config):
+    path.write_text(json.dumps(config), encoding="utf-8")
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000)) # Distinct mtime even on coarse clocks
+
+
+def names(specs):
+    return [spec.name for spec in specs]
+
+
+def test_rules_without_dependencies_share_one_level():
+    plan = make_registry().plan()
+    assert [names(level) for level in plan.levels] == [list("abcde")]
+    assert names(plan.order) == list("abcde")
+
+
+def test_dependencies_split_the_plan_into_levels():
+    plan = make_registry(b=("a",), c=("b",), e=("a", "d")).plan()
+    assert [names(level) for level in plan.levels] == [["a", "d"], ["b", "e"], ["c"]]
+
+
+def test_report_order_puts_dependencies_first(tmp_path):
+    config = tmp_path / "rules.json"
+    write_config(config, {"order": ["c", "e", "b", "a", "d"]})
+    plan = make_registry(config, c=("b",)).plan()
+    assert names(plan.order) == ["e", "b", "a", "d", "c"]
+
+
+def test_dependency_cycle_is_rejected():
+    with pytest.raises(ValueError, match="cycle"):
+        make_registry(a=("c",), b=("a",), c=("b",)).plan()
+
+
+def test_disabled_rule_leaves_the_levels_and_frees_its_dependents(tmp_path):
+    config = tmp_path / "rules.json"
+    write_config(config, {"rules": {"a": {"enabled": False}, "zz": {"enabled": False}}})
+    plan = make_registry(config, b=("a",), c=("b",)).plan()
+    assert plan.disabled == {"a"}
+    assert [names(level) for level in plan.levels] == [["b", "d", "e"], ["c"]]
+    assert "a" in names(plan.order) # Still reported, as disabled
+
+
+def test_weight_overrides_merge_with_declared_weights(tmp_path):
+    config = tmp_path / "rules.json"
+    write_config(config, {"error_weight": 7, "rules": {"b": {"weights": {"hit": 25, "extra": 1}}}})
+    plan = make_registry(config).plan()
+    assert plan.weights["a"] == {"hit": 10}
+    assert plan.weights["b"] == {"hit": 25, "extra": 1}
+    assert plan.error_weight == 7
+
+
+def test_config_change_is_picked_up(tmp_path):
+    config = tmp_path / "rules.json"
+    write_config(config, {})
+    registry = make_registry(config)
+    first = registry.plan()
+    assert registry.plan() is first # Unchanged file: same plan
+    write_config(config, {"rules": {"c": {"enabled": False}}, "order": ["e"]})
+    plan = registry.plan()
+    assert plan.disabled == {"c"} and names(plan.order)[0] == "e"
+    config.unlink()
+    assert registry.plan().disabled == set() # Removed file: back to the declared rules
+
+
+def test_invalid_config_keeps_the_previous_plan(tmp_path):
+    config = tmp_path / "rules.json"
+    write_config(config, {"rules": {"d": {"enabled": False}}})
+    registry = make_registry(config)
+    assert registry.plan().disabled == {"d"}
+    config.write_text("{not json", encoding="utf-8")
+    os.utime(config, ns=(0, os.stat(config).st_mtime_ns + 2_000_000))
+    assert registry.plan().disabled == {"d"}
+
+
+def test_duplicate_rule_name_is_rejected():
+    registry = make_registry()
+    with pytest.raises(ValueError):
+        registry.register(index.RuleSpec("a", None, None, (), {}, ()))
+
+
+def test_concurrent_engines_share_one_rule_thread_pool(monkeypatch):
+    monkeypatch.setattr(index, "_rule_thread_pool", None)
+    barrier, pools = threading.Barrier(8), []
+    def get():
+        barrier.wait(); pools.append(index._get_rule_thread_pool())
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert len({id(pool) for pool in pools}) == 1
+    pools[0].shutdown()
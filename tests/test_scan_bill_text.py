@@ -0,0 +1,35 @@
+import pytest
+
+from bench_extraction import legacy_extract, make_bill, scan_extract
+from generate_dataset import DEFAULT_RATES, bill_pages, plan_claims
+
+EDGE_CASES = [
+    "",
+    "\n\n",
+    "Just some text\nwith no bill fields at all",
+    "city general hospital\nnet amount 1,234.50\ninvoice date 5/6/2024\nregistration id: ab/12-3",
+    "INVOICE\nApollo Clinic\nPrimary Diagnosis: Type 2 Diabetes (primary)\nSecondary diagnosis: hypertension (secondary)\n",
+    "Rx only Metformin 500\nMedicine: Tab Paracetamol 650mg\nprescribed_medications\": [\"Amlodipine 5\"]",
+    "HOSPITAL\nTotal Amount: Rs. 1,00,000.00\nDiagnosis: E11.9 - Type 2 diabetes mellitus without complications\nDr. Rao  DOB: 01/01/1970  BP 130/80",
+    "Invoice No 7\nOutpatient visit\nHbA1c 7.2 spirometry PFT glycated hemoglobin  blood pressure éè नमस्ते",
+]
+
+
+def assert_same(text: str):
+    assert scan_extract(text) == legacy_extract(text)
+
+
+@pytest.mark.parametrize("pages", [1, 2, 10, 50])
+@pytest.mark.parametrize("seed", range(3))
+def test_synthetic_bills(pages, seed):
+    assert_same(make_bill(pages, seed=seed * 100 + pages))
+
+
+@pytest.mark.parametrize("spec", plan_claims(20, 200, (1, 4), DEFAULT_RATES, seed=7), ids=lambda spec: f"claim{spec['claim']}-{spec['kind']}")
+def test_dataset_bills(spec):
+    assert_same("".join(bill_pages(spec, seed=7)))
+
+
+@pytest.mark.parametrize("text", EDGE_CASES)
+def test_edge_cases(text):
+    assert_same(text)
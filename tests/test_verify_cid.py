@@ -0,0 +1,47 @@
+import base64
+import hashlib
+
+import pytest
+
+import index
+from generate_dataset import cid_for
+
+HELLO_CIDV0 = "QmT78zSuBmuS4z925WZfrqQ1qHaJ56DQaTfyMUF7F8ff5o" # `echo "hello world" | ipfs add`
+HELLO_RAW_CIDV1 = "bafkreifzjut3te2nhyekklss27nh3k72ysco7y32koao5eei66wof36n5e" # `printf "hello world" | ipfs add --cid-version=1 --raw-leaves`
+
+
+def b32_cid(raw: bytes) -> str:
+    return "b" + base64.b32encode(raw).decode("ascii").lower().rstrip("=")
+
+
+def test_single_chunk_dag_pb_matches():
+    assert index.verify_cid(HELLO_CIDV0, b"hello world\n") is True
+
+
+def test_dag_pb_mismatch_is_inconclusive():
+    # Other chunkers/encodings could still produce this CID, so a miss can't be called a mismatch
+    assert index.verify_cid(HELLO_CIDV0, b"hello world!") is None
+
+
+def test_raw_cid_matches_and_mismatches():
+    assert index.verify_cid(HELLO_RAW_CIDV1, b"hello world") is True
+    assert index.verify_cid(HELLO_RAW_CIDV1, b"hello world\n") is False
+
+
+def test_raw_cid_has_no_size_limit():
+    data = b"%PDF-1.4\n" + bytes(range(256)) * 4096 # ~1 MiB, several UnixFS chunks
+    assert index.verify_cid(cid_for(data), data) is True
+
+
+def test_multi_chunk_dag_pb_cannot_be_checked_locally():
+    assert index.verify_cid(HELLO_CIDV0, b"x" * (index._UNIXFS_CHUNK_SIZE + 1)) is None
+
+
+def test_non_sha256_multihash_is_inconclusive():
+    sha512_raw_cid = b32_cid(b"\x01\x55\x13\x40" + hashlib.sha512(b"hello world").digest())
+    assert index.verify_cid(sha512_raw_cid, b"hello world") is None
+
+
+@pytest.mark.parametrize("cid", ["", "not-a-cid", "Qm" + "0" * 44, "mAXASIA", "bafkrei"])
+def test_undecodable_cids_are_inconclusive(cid):
+    assert index.verify_cid(cid, b"hello world") is None